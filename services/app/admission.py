@@ -0,0 +1,214 @@
+"""
+services/app/admission.py
+
+This module provides admission control and load shedding for the scoring endpoints.
+
+1. Limits the number of scoring requests processed at once in a worker process. Requests
+   over the limit wait in a bounded FIFO queue instead of piling up on the AnyIO threadpool.
+2. Rejects a request at once with status 503 and a `Retry-After` header when the queue is
+   full, or when its expected wait (its position in the queue times the average service time,
+   divided by the concurrency limit) would exceed the latency SLO. A queued request that still
+   waits longer than the SLO is rejected the same way.
+3. Lets the health, metrics and model management endpoints bypass the queue: only the paths
+   of ADMISSION_PATHS are admitted, and the concurrency limit keeps threads of the pool free
+   for the other endpoints (the AnyIO threadpool has 40 threads by default).
+4. Exposes the queue depth, the requests in flight, the rejections by reason and the wait
+   time as Prometheus metrics.
+
+The limits apply per worker process; with Gunicorn the service admits WEB_CONCURRENCY times
+as many requests.
+
+Key Components:
+- ADMISSION_MAX_CONCURRENCY: Maximum number of scoring requests in flight, 0 disables
+  admission control (environment variable).
+- ADMISSION_QUEUE_SIZE: Maximum number of waiting scoring requests (environment variable).
+- ADMISSION_LATENCY_SLO_MS: Maximum wait of a scoring request, in milliseconds (environment variable).
+- ADMISSION_PATHS: Paths of the scoring endpoints.
+- Custom Prometheus metrics: admission_queue_depth, admission_in_flight, admission_rejections,
+  admission_wait_seconds.
+- Overloaded: Exception raised when a request is rejected.
+- AdmissionController: Class admitting, queueing and rejecting requests.
+- AdmissionMiddleware: ASGI middleware applying the controller to the scoring endpoints.
+"""
+
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from fastapi.responses import JSONResponse
+from prometheus_client import Counter, Gauge, Histogram
+
+# Admission control settings
+ADMISSION_MAX_CONCURRENCY = int(os.getenv('ADMISSION_MAX_CONCURRENCY', 8))
+ADMISSION_QUEUE_SIZE = int(os.getenv('ADMISSION_QUEUE_SIZE', 64))
+ADMISSION_LATENCY_SLO_MS = float(os.getenv('ADMISSION_LATENCY_SLO_MS', 1000))
+
+# Paths of the scoring endpoints subject to admission control
+ADMISSION_PATHS = frozenset(['/predict', '/predict/batch', '/random', '/v2/predict', '/v2/predict/batch',
+                             '/v2/predict/arrow'])
+
+# Weight of the last request in the moving average of the service time
+SERVICE_TIME_WEIGHT = 0.1
+
+# Define Prometheus metrics for admission control
+QUEUE_DEPTH = Gauge('admission_queue_depth', 'Number of scoring requests waiting for admission',
+                    multiprocess_mode='livesum')
+IN_FLIGHT = Gauge('admission_in_flight', 'Number of scoring requests being processed', multiprocess_mode='livesum')
+REJECTIONS = Counter('admission_rejections', 'Number of scoring requests rejected with status 503', ['reason'])
+WAIT_TIME = Histogram(
+    'admission_wait_seconds',
+    'Time admitted scoring requests wait in the admission queue',
+    buckets=[0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5]
+)
+
+class Overloaded(Exception):
+    """
+    Raised when a request is rejected, with the reason and the suggested retry delay in seconds.
+    """
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Service overloaded ({reason}), retry after {retry_after} s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class AdmissionController:
+    """
+    Admits scoring requests up to a concurrency limit, queues a bounded number and rejects the rest.
+
+    The controller runs on the event loop of the worker process and needs no locks.
+    """
+    def __init__(self, max_concurrency: int = ADMISSION_MAX_CONCURRENCY, queue_size: int = ADMISSION_QUEUE_SIZE,
+                 latency_slo_ms: float = ADMISSION_LATENCY_SLO_MS, paths: frozenset = ADMISSION_PATHS):
+        """
+        Initializes the controller.
+
+        Args:
+            max_concurrency (int): Maximum number of requests in flight, 0 disables admission control.
+            queue_size (int): Maximum number of waiting requests.
+            latency_slo_ms (float): Maximum wait of a request, in milliseconds.
+            paths (frozenset): Paths of the endpoints subject to admission control.
+        """
+        self.max_concurrency = max_concurrency
+        self.queue_size = queue_size
+        self.latency_slo = latency_slo_ms / 1000
+        self.paths = paths
+        self.in_flight = 0
+        self.service_time = 0.0
+        self._waiters = deque()
+
+    @property
+    def enabled(self) -> bool:
+        """Whether admission control is enabled."""
+        return self.max_concurrency > 0
+
+    def expected_wait(self, position: int) -> float:
+        """
+        Estimates the wait of a request from its position in the queue.
+
+        Args:
+            position (int): Number of requests ahead of it in the queue.
+
+        Returns:
+            float: Expected wait, in seconds.
+        """
+        return (position + 1) * self.service_time / self.max_concurrency
+
+    def _retry_after(self) -> int:
+        """Returns the time to drain the queue, in whole seconds (at least 1)."""
+        return max(1, math.ceil(self.expected_wait(len(self._waiters))))
+
+    def _reject(self, reason: str):
+        """Counts a rejection and raises Overloaded."""
+        REJECTIONS.labels(reason=reason).inc()
+        raise Overloaded(reason, self._retry_after())
+
+    async def acquire(self):
+        """
+        Admits a request, waiting in the queue if the concurrency limit is reached.
+
+        Raises:
+            Overloaded: If the queue is full, the expected wait exceeds the latency SLO,
+                or the request waited longer than the latency SLO.
+        """
+        if self.in_flight < self.max_concurrency and not self._waiters:
+            self.in_flight += 1
+            IN_FLIGHT.inc()
+            WAIT_TIME.observe(0)
+            return
+        if len(self._waiters) >= self.queue_size:
+            self._reject('queue_full')
+        if self.expected_wait(len(self._waiters)) > self.latency_slo:
+            self._reject('slo')
+
+        start_time = time.perf_counter()
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        QUEUE_DEPTH.inc()
+        try:
+            # A waiter is admitted by `release`, which passes its slot in flight on to it
+            await asyncio.wait_for(asyncio.shield(waiter), self.latency_slo)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if not waiter.done():
+                self._waiters.remove(waiter)
+                QUEUE_DEPTH.dec()
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                self._reject('timeout')
+            elif isinstance(e, asyncio.CancelledError):
+                # The client went away just as the request was admitted: pass the slot on
+                self._hand_over()
+                raise
+        WAIT_TIME.observe(time.perf_counter() - start_time)
+
+    def release(self, service_time: float):
+        """
+        Ends an admitted request and passes its slot to the next waiting request.
+
+        Args:
+            service_time (float): Processing time of the request, in seconds.
+        """
+        self.service_time += SERVICE_TIME_WEIGHT * (service_time - self.service_time)
+        self._hand_over()
+
+    def _hand_over(self):
+        """Passes a slot in flight to the next waiting request, or frees it."""
+        if self._waiters:
+            self._waiters.popleft().set_result(None)
+            QUEUE_DEPTH.dec()
+            return
+        self.in_flight -= 1
+        IN_FLIGHT.dec()
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware applying an admission controller to the requests of its paths.
+    """
+    def __init__(self, app, controller: AdmissionController):
+        """
+        Initializes the middleware.
+
+        Args:
+            app: ASGI application.
+            controller (AdmissionController): Controller of the scoring requests.
+        """
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        """Admits or rejects a scoring request before it reaches the endpoint."""
+        if scope['type'] != 'http' or not self.controller.enabled or scope['path'] not in self.controller.paths:
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.controller.acquire()
+        except Overloaded as e:
+            response = JSONResponse({"detail": str(e)}, status_code=503,
+                                    headers={"Retry-After": str(e.retry_after)})
+            await response(scope, receive, send)
+            return
+
+        start_time = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.release(time.perf_counter() - start_time)
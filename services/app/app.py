@@ -1,23 +1,95 @@
 """
 services/app/app.py
 
-This module defines a FastAPI application with three endpoints:
+This module defines a FastAPI application with the following endpoints:
 
 1. GET "/": Returns the status of the service.
 2. POST "/predict": Accepts model parameters and returns predictions.
-3. GET "/random": Generates random model parameters and returns predictions based on them.
+3. POST "/predict/batch": Accepts a list of model parameters and returns predictions for each row.
+4. GET "/random": Generates random model parameters and returns predictions based on them.
+5. POST "/stage_metrics": Switches the per-stage latency instrumentation on or off in the worker
+   process serving the request.
+6. GET "/model": Returns the active and previous model versions.
+7. POST "/model/reload": Loads the model file again, warms it up and swaps it in without downtime,
+   in every worker process.
+8. POST "/model/rollback": Swaps the previous model back in (single process only).
+9. POST "/v2/predict": Typed version of "/predict" with range-checked parameters.
+10. POST "/v2/predict/batch": Typed version of "/predict/batch".
+11. POST "/v2/predict/arrow": Accepts flats as an Arrow IPC stream and streams their scores back
+    in the same format (see `columnar.py`).
 
-The FastAPI application uses a custom handler, `FastApiHandler`, to process predictions.
+The FastAPI application uses a custom handler, `FastApiHandler`, to process predictions,
+and a `ModelManager` to replace its model while serving (optionally watching the model file).
+The "/model" mutations and "/stage_metrics" require the MODEL_ADMIN_TOKEN bearer token
+(status 401 otherwise) and are disabled (status 403) when no token is set.
+The quantiles of the served predictions and their drift from the training profile are
+published in the background while the application is running.
+
+The "/v2" endpoints validate requests with the schemas of `schemas.py` (invalid requests get
+status 422 with the location of each error, prediction failures status 500), score rows as
+float arrays and serialize responses with orjson. The "/predict" endpoints keep their
+untyped {"Error": ...} contract, and also accept flats sent with only their flat-level
+parameters and building_id, completed from the building table saved with the model.
+
+The "/v2/predict/arrow" endpoint scores the float arrays of the request body without parsing
+JSON or building dictionaries; bodies over COLUMNAR_MAX_BYTES get status 413 before they are
+read in full, invalid streams status 422 with the rows of each error.
+
+The scoring endpoints ("/predict", "/predict/batch", "/random" and their "/v2" versions) are
+subject to the admission control of `admission.py`: over the concurrency limit they wait in a
+bounded queue, and are rejected with status 503 and a `Retry-After` header when the queue is
+full or the wait would exceed the latency SLO. The other endpoints are never queued; "/" runs
+on the event loop, so health checks do not wait for a thread of the pool.
 """
 
-from fastapi import FastAPI
+import hmac
+import itertools
+from typing import Annotated
+from fastapi import Body, Depends, FastAPI, Header, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from services.app.admission import AdmissionController, AdmissionMiddleware
+from services.app.columnar import (ARROW_MEDIA_TYPE, COLUMNAR_MAX_BYTES, ColumnarError, PayloadTooLarge, read_batches,
+                                   read_body, write_scores)
 from services.app.fastapi_handler import FastApiHandler, gen_random_data
+from services.app.model_manager import MODEL_ADMIN_TOKEN, ModelManager
+from services.app.schemas import BatchPrediction, FlatParams, Prediction, to_row, to_rows
+from services.app.stage_metrics import StageMetricsORJSONResponse, StageMetricsResponse
 
-app = FastAPI()
+app = FastAPI(default_response_class=StageMetricsResponse)
 app.handler = FastApiHandler()
+app.model_manager = ModelManager(app.handler)
+app.admission = AdmissionController()
+
+# Queue or shed scoring requests over the concurrency limit (if ADMISSION_MAX_CONCURRENCY is not 0)
+app.add_middleware(AdmissionMiddleware, controller=app.admission)
+
+# Watch the model file while the application is running (if MODEL_WATCH_INTERVAL is set)
+app.add_event_handler("startup", app.model_manager.start)
+app.add_event_handler("shutdown", app.model_manager.stop)
+
+# Publish the distribution and drift of the served predictions (if STREAM_STATS is set)
+if app.handler.stream_stats is not None:
+    app.add_event_handler("startup", app.handler.stream_stats.start)
+    app.add_event_handler("shutdown", app.handler.stream_stats.stop)
+
+def require_admin(authorization: Annotated[str, Header()] = None):
+    """
+    Checks the bearer token of an administration request.
+
+    Args:
+        authorization (str): Authorization header of the request.
+
+    Raises:
+        HTTPException: Status 403 if MODEL_ADMIN_TOKEN is not set, 401 if the token is missing or wrong.
+    """
+    if not MODEL_ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Model administration is disabled")
+    if authorization is None or not hmac.compare_digest(authorization.encode(), f"Bearer {MODEL_ADMIN_TOKEN}".encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token", headers={"WWW-Authenticate": "Bearer"})
 
 @app.get("/")
-def read_root() -> dict:
+async def read_root() -> dict:
     """
     Root endpoint that returns the status of the service.
 
@@ -39,6 +111,19 @@ def get_prediction_for_item(model_params: dict) -> dict:
     """
     return app.handler.handle(model_params)
 
+@app.post("/predict/batch")
+def get_batch_prediction(batch_params: list[dict]) -> dict:
+    """
+    Endpoint to get predictions for a batch of flats in a single model call.
+
+    Args:
+        batch_params (list[dict]): A list of dictionaries containing model parameters.
+
+    Returns:
+        dict: A dictionary containing the prediction results (or errors) for each row.
+    """
+    return app.handler.handle_batch(batch_params)
+
 @app.get("/random")
 def get_random_prediction() -> tuple:
     """
@@ -49,3 +134,127 @@ def get_random_prediction() -> tuple:
     """
     random_params = gen_random_data()
     return (random_params, app.handler.handle(random_params))
+
+@app.post("/stage_metrics", dependencies=[Depends(require_admin)])
+def set_stage_metrics(enabled: bool) -> dict:
+    """
+    Endpoint to switch the per-stage latency instrumentation on or off at runtime.
+
+    The switch applies to the worker process serving the request only: with several Gunicorn
+    workers, start the service with STAGE_METRICS=1 to instrument all of them.
+
+    Args:
+        enabled (bool): Whether to record the latency of each prediction stage.
+
+    Returns:
+        dict: A dictionary indicating the instrumentation state.
+    """
+    app.handler.set_stage_metrics(enabled)
+    return {"stage_metrics": enabled}
+
+@app.get("/model")
+def get_model_status() -> dict:
+    """
+    Endpoint to get the active and previous model versions.
+
+    Returns:
+        dict: A dictionary containing the model versions and the inference engine.
+    """
+    return app.model_manager.status()
+
+@app.post("/model/reload", dependencies=[Depends(require_admin)])
+def reload_model() -> dict:
+    """
+    Endpoint to load the model file again, warm it up and swap it in while requests are served.
+
+    With several workers, the Gunicorn master reloads the model and replaces every worker.
+
+    Returns:
+        dict: A dictionary containing the model versions or an error message.
+    """
+    return app.model_manager.reload_all()
+
+@app.post("/model/rollback", dependencies=[Depends(require_admin)])
+def rollback_model() -> dict:
+    """
+    Endpoint to swap the previous model back in, with a single worker.
+
+    Returns:
+        dict: A dictionary containing the model versions or an error message.
+    """
+    return app.model_manager.rollback()
+
+@app.post("/v2/predict", response_model=Prediction, response_class=StageMetricsORJSONResponse)
+def get_typed_prediction(flat: FlatParams) -> StageMetricsORJSONResponse:
+    """
+    Endpoint to get the prediction for the typed, range-checked parameters of a flat.
+
+    Args:
+        flat (FlatParams): Validated parameters of a flat.
+
+    Returns:
+        StageMetricsORJSONResponse: Response with the predicted score.
+
+    Raises:
+        HTTPException: Status 500 if the prediction fails.
+    """
+    result = app.handler.handle_row(to_row(flat))
+    if "Error" in result:
+        raise HTTPException(status_code=500, detail=result["Error"])
+    return StageMetricsORJSONResponse(result)
+
+@app.post("/v2/predict/batch", response_model=BatchPrediction, response_class=StageMetricsORJSONResponse)
+def get_typed_batch_prediction(
+    flats: Annotated[list[FlatParams], Body(max_length=app.handler.max_batch_size)]
+) -> StageMetricsORJSONResponse:
+    """
+    Endpoint to get predictions for a batch of typed flats in a single model call.
+
+    Args:
+        flats (list[FlatParams]): Validated parameters of the flats, at most MAX_BATCH_SIZE.
+
+    Returns:
+        StageMetricsORJSONResponse: Response with the scores in the order of the flats.
+
+    Raises:
+        HTTPException: Status 500 if the prediction fails.
+    """
+    result = app.handler.handle_rows(to_rows(flats))
+    if "Error" in result:
+        raise HTTPException(status_code=500, detail=result["Error"])
+    return StageMetricsORJSONResponse(result)
+
+@app.post("/v2/predict/arrow", response_class=StreamingResponse)
+async def get_columnar_prediction(request: Request) -> StreamingResponse:
+    """
+    Endpoint to get predictions for flats sent as an Arrow IPC stream.
+
+    The body is parsed and validated in the threadpool; the scores are streamed back as soon
+    as each slice of at most COLUMNAR_BATCH_ROWS flats is scored.
+
+    Args:
+        request (Request): Request with an Arrow IPC stream of the packed or columnar layout.
+
+    Returns:
+        StreamingResponse: Arrow IPC stream with the 'score' of each flat.
+
+    Raises:
+        HTTPException: Status 413 if the body exceeds COLUMNAR_MAX_BYTES, 422 if the stream is
+            invalid, 500 if the prediction of the first batch fails, 501 if pyarrow is not installed.
+    """
+    try:
+        body = await read_body(request, COLUMNAR_MAX_BYTES)
+    except PayloadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    try:
+        batches = await run_in_threadpool(read_batches, body)
+    except ColumnarError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except ImportError:
+        raise HTTPException(status_code=501, detail="pyarrow is not installed")
+    chunks = write_scores(app.handler, batches)
+    try:
+        first = await run_in_threadpool(next, chunks)
+    except RuntimeError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    return StreamingResponse(itertools.chain([first], chunks), media_type=ARROW_MEDIA_TYPE)
@@ -4,16 +4,16 @@ services/app/app-stage-4.py
 This module adds enhanced monitoring and error simulation to the FastAPI application.
 
 1. Imports the FastAPI application and instrumentation from previous stages.
-2. Defines additional Prometheus metrics for CPU, disk, memory, and network usage.
+2. Starts the background sampler of system metrics (CPU, disk, memory, network usage
+   and serving process metrics) with the application.
 3. Replaces the original "/random" endpoint with an enhanced version that includes:
    - Random error generation for testing purposes.
    - Random delay to simulate processing time.
-   - Collection and exposure of system metrics.
    - Recording of price prediction histograms.
 
 Key Components:
 - ERROR_PROBABILITY: Probability of generating a random error.
-- Custom Prometheus Gauges: CPU_USAGE, DISK_USAGE, MEMORY_USAGE, NETWORK_USAGE.
+- Custom Prometheus Gauges: CPU_USAGE, DISK_USAGE, MEMORY_USAGE, NETWORK_USAGE (see system_metrics.py).
 - Custom Prometheus Histogram: price_predictions.
 """
 
@@ -21,19 +21,18 @@ import random
 import time
 import numpy as np
 from fastapi import HTTPException
-from prometheus_client import Histogram, Gauge
-import psutil
+from prometheus_client import Histogram
 from services.app.app import app, gen_random_data
 from services.app.app_stage_3 import instrumentator
+from services.app.system_metrics import SystemMetricsSampler
 
 # Define the probability of generating a random error
 ERROR_PROBABILITY = 0.1
 
-# Define Prometheus Gauges for system metrics
-CPU_USAGE = Gauge('custom_cpu_usage_percent', 'CPU usage percent')
-DISK_USAGE = Gauge('custom_disk_usage_percent', 'Disk usage percent')
-MEMORY_USAGE = Gauge('custom_memory_usage_percent', 'Memory usage percent')
-NETWORK_USAGE = Gauge('custom_network_usage_bytes_total', 'Network usage bytes')
+# Sample system metrics in the background while the application is running
+system_metrics_sampler = SystemMetricsSampler()
+app.add_event_handler("startup", system_metrics_sampler.start)
+app.add_event_handler("shutdown", system_metrics_sampler.stop)
 
 # Define a Prometheus Histogram for price predictions
 price_predictions = Histogram(
@@ -68,11 +67,4 @@ def get_random_prediction() -> tuple:
     
     price_predictions.observe(predicted_price)
 
-    # Update Prometheus Gauges with system metrics
-    CPU_USAGE.set(psutil.cpu_percent(interval=1))
-    DISK_USAGE.set(psutil.disk_usage('/').percent)
-    MEMORY_USAGE.set(psutil.virtual_memory().percent)
-    net_io = psutil.net_io_counters()
-    NETWORK_USAGE.set(net_io.bytes_sent + net_io.bytes_recv)
-    
     return (random_params, predicted_price)
@@ -0,0 +1,163 @@
+"""
+services/app/batcher.py
+
+This module provides request coalescing (micro-batching) for single-flat predictions.
+
+1. Collects prediction requests that arrive within a short time window or up to a maximum batch size.
+2. Scores each collected batch with a single vectorized model call on a background thread.
+3. Returns to each caller its own result, or its own exception if the row cannot be scored.
+4. Records Prometheus metrics for the batch size and the time requests wait in the queue.
+
+Coalesced rows are scored together, so the handler only uses the batcher for models whose scores
+do not depend on the other rows of a batch (see `is_row_independent` in compiled_model.py).
+
+Key Components:
+- MICRO_BATCHING: Flag enabling micro-batching in the handler (environment variable).
+- BATCH_WINDOW_MS: Time window for collecting requests into one batch, in milliseconds.
+- BATCH_MAX_SIZE: Maximum number of requests coalesced into one batch.
+- MicroBatcher: Class collecting requests and scoring them in batches.
+"""
+
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from prometheus_client import Histogram
+
+# Micro-batching settings
+MICRO_BATCHING = os.getenv('MICRO_BATCHING', '0') == '1'
+BATCH_WINDOW_MS = float(os.getenv('BATCH_WINDOW_MS', 3))
+BATCH_MAX_SIZE = int(os.getenv('BATCH_MAX_SIZE', 64))
+
+# Define Prometheus Histograms for micro-batching
+BATCH_SIZE = Histogram(
+    'micro_batch_size',
+    'Number of requests coalesced into one batch',
+    buckets=[1, 2, 4, 8, 16, 32, 64, 128, 256]
+)
+QUEUE_WAIT = Histogram(
+    'micro_batch_queue_wait_seconds',
+    'Time requests wait in the micro-batching queue',
+    buckets=[0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25]
+)
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-row prediction requests into vectorized batches.
+    """
+    def __init__(self, predict_batch, predict_one,
+                 window_ms: float = BATCH_WINDOW_MS, max_size: int = BATCH_MAX_SIZE):
+        """
+        Initializes the batcher.
+
+        Args:
+            predict_batch (callable): Function scoring a list of model parameters in one call.
+            predict_one (callable): Function scoring a single set of model parameters,
+                used to isolate the failing rows when a batch cannot be scored.
+            window_ms (float): Time window for collecting requests, in milliseconds.
+            max_size (int): Maximum number of requests in one batch.
+        """
+        self.predict_batch = predict_batch
+        self.predict_one = predict_one
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._queue = None
+        self._worker = None
+        self._pid = None
+
+    def submit(self, model_params: dict) -> float:
+        """
+        Queues model parameters for scoring and waits for the result.
+
+        Args:
+            model_params (dict): Dictionary of model parameters.
+
+        Returns:
+            float: Predicted price.
+
+        Raises:
+            Exception: The exception raised while scoring this row.
+        """
+        future = Future()
+        self._ensure_worker().put((model_params, future, time.perf_counter()))
+        return future.result()
+
+    def _ensure_worker(self) -> queue.Queue:
+        """
+        Starts the worker thread if it is not running in the current process
+        (threads do not survive a fork of the serving process).
+
+        Returns:
+            queue.Queue: Queue of pending requests.
+        """
+        with self._lock:
+            if self._pid != os.getpid() or not self._worker.is_alive():
+                self._pid = os.getpid()
+                self._queue = queue.Queue()
+                self._worker = threading.Thread(
+                    target=self._run, args=(self._queue,), name='micro-batcher', daemon=True
+                )
+                self._worker.start()
+            return self._queue
+
+    def _collect(self, requests: queue.Queue) -> list:
+        """
+        Blocks until a request arrives, then collects further requests until
+        the time window closes or the batch is full.
+
+        Args:
+            requests (queue.Queue): Queue of pending requests.
+
+        Returns:
+            list: Collected (model_params, future, enqueue_time) tuples.
+        """
+        batch = [requests.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self, requests: queue.Queue):
+        """
+        Worker loop: collects batches and scores them.
+
+        Args:
+            requests (queue.Queue): Queue of pending requests.
+        """
+        while True:
+            batch = self._collect(requests)
+            started = time.perf_counter()
+            BATCH_SIZE.observe(len(batch))
+            for _, _, enqueued in batch:
+                QUEUE_WAIT.observe(started - enqueued)
+            self._score(batch)
+
+    def _score(self, batch: list):
+        """
+        Scores a batch and resolves the futures of its callers.
+
+        If the vectorized call fails, each row is scored separately so that
+        only the callers with invalid rows receive an exception.
+
+        Args:
+            batch (list): Collected (model_params, future, enqueue_time) tuples.
+        """
+        try:
+            predictions = self.predict_batch([model_params for model_params, _, _ in batch])
+        except Exception:
+            for model_params, future, _ in batch:
+                try:
+                    future.set_result(self.predict_one(model_params))
+                except Exception as e:
+                    future.set_exception(e)
+            return
+        for (_, future, _), prediction in zip(batch, predictions):
+            future.set_result(prediction)
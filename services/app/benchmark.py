@@ -0,0 +1,334 @@
+"""
+services/app/benchmark.py
+
+This script benchmarks the prediction handler and each stage of the model pipeline.
+
+1. Times `validate_params`, the `pd.DataFrame` construction of a batch, `price_predict` and
+   `batch_price_predict` for batch sizes of BATCH_SIZES rows.
+2. Times each named step of the fitted pipeline separately, feeding it the output of the
+   previous steps (nested pipelines are expanded step by step).
+3. Times the request path of the untyped and typed ("/v2") endpoints without HTTP: parsing the
+   JSON body, validation, prediction and response serialization, and the path of the Arrow
+   endpoint for the same batches (when pyarrow is installed).
+4. Times the streaming statistics of the hot path: recording one prediction (amortizing the
+   buffer flushes into the sketch) and a batch, and the background publication of the gauges.
+5. Times the building table: the lookup of a building, the request path of a flat sent with
+   only its flat-level parameters and building_id, and the stored against the computed
+   distances to the center of a batch.
+6. Reports the cost per call and per row, and the peak memory allocated by a call (tracemalloc).
+7. Saves the results as a baseline file and fails (exit code 1) when the per-row cost of a
+   benchmark exceeds its baseline by more than the regression threshold.
+8. Runs offline against the bundled model, or against a small stand-in pipeline of the notebook
+   structure trained on synthetic data.
+
+Key Components:
+- BATCH_SIZES: Batch sizes of the prediction benchmarks.
+- BENCHMARK_BASELINE: Path of the baseline file.
+- REGRESSION_THRESHOLD: Allowed relative slowdown against the baseline.
+- load_handler: Function creating a handler with the bundled or the stand-in model.
+- pipeline_stages: Function listing the named steps of a fitted pipeline.
+- request_paths: Function building the untyped and typed request paths of a JSON body.
+- arrow_request_path: Function building the request path of the Arrow endpoint.
+- run_benchmarks: Function running all benchmarks.
+- find_regressions: Function comparing results with a baseline.
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import timeit
+import tracemalloc
+import warnings
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+from sklearn.pipeline import Pipeline
+from services.app import columnar
+from services.app.building_store import BUILDING_PARAMS, build_building_table, load_building_store, save_building_table
+from services.app.compiled_model import CompiledPipeline
+from services.app.fastapi_handler import FastApiHandler, REQUIRED_PARAMS, gen_random_data
+from services.app.schemas import FlatParams, to_row, to_rows
+from services.app.stage_metrics import StageMetricsORJSONResponse, StageMetricsResponse
+from services.app.stream_stats import StreamingStats
+from services.models.distance import distance_to_center
+from services.models.pipeline import build_pipeline, synthetic_flats
+
+# Batch sizes of the prediction benchmarks
+BATCH_SIZES = [1, 10, 100, 10000]
+
+# Number of rows passed through the pipeline stages
+STAGE_ROWS = 1000
+
+# Baseline file and allowed relative slowdown against it
+BENCHMARK_BASELINE = os.getenv('BENCHMARK_BASELINE', 'services/app/benchmark_baseline.json')
+REGRESSION_THRESHOLD = float(os.getenv('BENCHMARK_REGRESSION_THRESHOLD', 0.2))
+
+def load_handler(model: str = 'bundled') -> FastApiHandler:
+    """
+    Creates a handler for benchmarking, without micro-batching and prediction cache.
+
+    Args:
+        model (str): 'bundled' for the model at MODEL_PATH, 'synthetic' for a small stand-in
+            pipeline trained on synthetic data. The stand-in is also used if the bundled
+            model cannot be loaded.
+
+    Returns:
+        FastApiHandler: Handler with the model loaded.
+    """
+    handler = FastApiHandler(micro_batching=False, prediction_cache=False)
+    if model == 'synthetic' or not hasattr(handler, 'model'):
+        X, y = synthetic_flats(1000)
+        pipeline = build_pipeline(k_features=5, regressor_params={'iterations': 200, 'depth': 6})
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            pipeline.fit(X, y)
+        handler.model = pipeline
+        handler.model_version = 'synthetic'
+        handler.set_engine(handler.engine)
+    return handler
+
+def pipeline_stages(model, prefix: str = '') -> list:
+    """
+    Lists the named steps of a fitted pipeline, expanding nested pipelines.
+
+    Args:
+        model: Fitted pipeline or estimator.
+        prefix (str): Name prefix of the steps.
+
+    Returns:
+        list: Tuples of the step name and the fitted step; a model that is not
+            a pipeline is a single step named 'model'.
+    """
+    if not isinstance(model, Pipeline):
+        return [(prefix or 'model', model)]
+    stages = []
+    for name, step in model.steps:
+        stages.extend(pipeline_stages(step, f"{prefix}{name}/") if isinstance(step, Pipeline)
+                      else [(f"{prefix}{name}", step)])
+    return stages
+
+def request_paths(handler: FastApiHandler, body: bytes, batch: bool = False) -> dict:
+    """
+    Builds the request paths of the untyped and typed endpoints for a JSON body, as run by FastAPI.
+
+    The untyped path parses the body into dictionaries, validates their keys, predicts and
+    serializes through `jsonable_encoder` and the standard JSON encoder. The typed path
+    validates the body with `FlatParams`, predicts from rows and serializes with orjson.
+
+    Args:
+        handler (FastApiHandler): Handler with the model loaded.
+        body (bytes): JSON body of a single flat or of a batch.
+        batch (bool): Whether the body is a batch.
+
+    Returns:
+        dict: Functions without arguments running each path, by version ('v1', 'v2').
+    """
+    if batch:
+        return {
+            'v1': lambda: StageMetricsResponse(jsonable_encoder(handler.handle_batch(json.loads(body)))).body,
+            'v2': lambda: StageMetricsORJSONResponse(handler.handle_rows(
+                to_rows([FlatParams.model_validate(row) for row in json.loads(body)])
+            )).body,
+        }
+    return {
+        'v1': lambda: StageMetricsResponse(jsonable_encoder(handler.handle(json.loads(body)))).body,
+        'v2': lambda: StageMetricsORJSONResponse(handler.handle_row(
+            to_row(FlatParams.model_validate(json.loads(body)))
+        )).body,
+    }
+
+def arrow_request_path(handler: FastApiHandler, batch: list):
+    """
+    Builds the request path of the Arrow endpoint for a batch: reading and validating the
+    stream, prediction and writing the response stream.
+
+    Args:
+        handler (FastApiHandler): Handler with the model loaded.
+        batch (list): Flats of the request.
+
+    Returns:
+        Function without arguments running the path, None if pyarrow is not installed.
+    """
+    try:
+        body = columnar.encode_rows(pd.DataFrame(batch, columns=REQUIRED_PARAMS), batch_rows=max(len(batch), 1))
+    except ImportError:
+        return None
+    return lambda: b''.join(columnar.write_scores(handler, columnar.read_batches(body)))
+
+def measure(func, rows: int, repeat: int = 5) -> dict:
+    """
+    Measures the time and peak memory of a call.
+
+    The time is the best of `repeat` runs, each averaging enough calls to last at least 0.2 s.
+
+    Args:
+        func (callable): Function called without arguments.
+        rows (int): Number of rows processed by a call.
+        repeat (int): Number of timing runs.
+
+    Returns:
+        dict: Seconds per call, seconds per row, rows and peak allocated bytes of a call.
+    """
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    seconds = min(timer.repeat(repeat=repeat, number=number)) / number
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak_bytes = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {'seconds': seconds, 'seconds_per_row': seconds / rows, 'rows': rows, 'peak_bytes': peak_bytes}
+
+def run_benchmarks(handler: FastApiHandler, batch_sizes: list = BATCH_SIZES,
+                   stage_rows: int = STAGE_ROWS, repeat: int = 5) -> dict:
+    """
+    Runs the handler and pipeline stage benchmarks.
+
+    Args:
+        handler (FastApiHandler): Handler with the model loaded.
+        batch_sizes (list): Batch sizes of the prediction benchmarks.
+        stage_rows (int): Number of rows passed through the pipeline stages.
+        repeat (int): Number of timing runs of each benchmark.
+
+    Returns:
+        dict: Results of each benchmark by name.
+    """
+    results = {}
+    params = gen_random_data()
+    results['validate_params'] = measure(lambda: handler.validate_params(params), 1, repeat)
+    results['price_predict'] = measure(lambda: handler.price_predict(params), 1, repeat)
+
+    for batch_size in batch_sizes:
+        batch = [gen_random_data() for _ in range(batch_size)]
+        results[f"dataframe[{batch_size}]"] = measure(
+            lambda: pd.DataFrame(batch, columns=REQUIRED_PARAMS), batch_size, repeat
+        )
+        results[f"batch_price_predict[{batch_size}]"] = measure(
+            lambda: handler.batch_price_predict(batch), batch_size, repeat
+        )
+
+    for version, path in request_paths(handler, json.dumps(params).encode()).items():
+        results[f"request[{version}]"] = measure(path, 1, repeat)
+    for batch_size in batch_sizes:
+        batch = [gen_random_data() for _ in range(batch_size)]
+        arrow_path = arrow_request_path(handler, batch)
+        if arrow_path is not None:
+            results[f"request_batch[arrow][{batch_size}]"] = measure(arrow_path, batch_size, repeat)
+        if batch_size > handler.max_batch_size:
+            continue
+        for version, path in request_paths(handler, json.dumps(batch).encode(), batch=True).items():
+            results[f"request_batch[{version}][{batch_size}]"] = measure(path, batch_size, repeat)
+
+    # Streaming statistics, recorded into their own sketch so the handler's are not skewed
+    stats = StreamingStats(REQUIRED_PARAMS)
+    row = tuple(params[name] for name in REQUIRED_PARAMS)
+    results['stream_stats.record'] = measure(lambda: stats.record(params, 1e7), 1, repeat)
+    results['stream_stats.record_row'] = measure(lambda: stats.record(row, 1e7), 1, repeat)
+    for batch_size in batch_sizes:
+        batch = [gen_random_data() for _ in range(batch_size)]
+        prices = [1e7] * batch_size
+        results[f"stream_stats.record_many[{batch_size}]"] = measure(
+            lambda: stats.record_many(batch, prices), batch_size, repeat
+        )
+    results['stream_stats.publish'] = measure(stats.publish, 1, repeat)
+
+    # Building table of random buildings, memory-mapped like the one of the service
+    buildings = pd.DataFrame([gen_random_data() for _ in range(stage_rows)], columns=REQUIRED_PARAMS)
+    buildings = buildings.drop_duplicates('building_id', keep='last')
+    with tempfile.TemporaryDirectory() as store_dir:
+        store_path = os.path.join(store_dir, 'buildings.npy')
+        save_building_table(build_building_table(buildings), store_path)
+        store = load_building_store(store_path)
+        flat = {name: value for name, value in buildings.iloc[[0]].to_dict('records')[0].items()
+                if name not in BUILDING_PARAMS}
+        results['building_store.lookup'] = measure(lambda: store.lookup(flat['building_id']), 1, repeat)
+        building_store, handler.building_store = handler.building_store, store
+        try:
+            results['request[v1][building_id]'] = measure(request_paths(handler, json.dumps(flat).encode())['v1'],
+                                                          1, repeat)
+        finally:
+            handler.building_store = building_store
+        for batch_size in batch_sizes:
+            sample = buildings.sample(batch_size, replace=True, random_state=0)
+            ids, latitude, longitude = (sample[name].to_numpy(dtype=float)
+                                        for name in ['building_id', 'latitude', 'longitude'])
+            results[f"distance[{batch_size}]"] = measure(
+                lambda: distance_to_center(latitude, longitude), batch_size, repeat
+            )
+            results[f"building_store.distance[{batch_size}]"] = measure(
+                lambda: store.distance(ids, latitude, longitude), batch_size, repeat
+            )
+
+    X = pd.DataFrame([gen_random_data() for _ in range(stage_rows)], columns=REQUIRED_PARAMS)
+    if isinstance(handler.model, CompiledPipeline):
+        # A model loaded from a serving artifact scores float arrays
+        X = X[handler.model.input_columns].to_numpy(dtype=float)
+    stages = pipeline_stages(handler.model)
+    for i, (name, step) in enumerate(stages):
+        call = step.predict if i == len(stages) - 1 else step.transform
+        results[f"stage[{name}]"] = measure(lambda: call(X), stage_rows, repeat)
+        if i < len(stages) - 1:
+            X = call(X)
+    return results
+
+def find_regressions(results: dict, baseline: dict, threshold: float = REGRESSION_THRESHOLD) -> list:
+    """
+    Compares benchmark results with a baseline.
+
+    Args:
+        results (dict): Current results by benchmark name.
+        baseline (dict): Baseline results by benchmark name.
+        threshold (float): Allowed relative slowdown of the cost per row.
+
+    Returns:
+        list: Tuples of the name, baseline and current cost per row of each regressed benchmark.
+    """
+    return [
+        (name, baseline[name]['seconds_per_row'], result['seconds_per_row'])
+        for name, result in results.items()
+        if name in baseline and result['seconds_per_row'] > baseline[name]['seconds_per_row'] * (1 + threshold)
+    ]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the prediction handler and pipeline stages")
+    parser.add_argument('--model', choices=['bundled', 'synthetic'], default='bundled')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=BATCH_SIZES)
+    parser.add_argument('--stage-rows', type=int, default=STAGE_ROWS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--baseline', default=BENCHMARK_BASELINE, help="path of the baseline file")
+    parser.add_argument('--save', action='store_true', help="save the results as the new baseline")
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD,
+                        help="allowed relative slowdown against the baseline")
+    args = parser.parse_args()
+
+    handler = load_handler(args.model)
+    results = run_benchmarks(handler, args.batch_sizes, args.stage_rows, args.repeat)
+
+    print(f"{'benchmark':<50} {'per call':>12} {'per row':>12} {'peak memory':>14}")
+    for name, result in results.items():
+        print(f"{name:<50} {result['seconds'] * 1e6:>10.1f}us {result['seconds_per_row'] * 1e6:>10.2f}us "
+              f"{result['peak_bytes'] / 2**10:>11.1f}KiB")
+
+    if args.save:
+        with open(args.baseline, 'w') as baseline_file:
+            json.dump({
+                'model_version': handler.model_version,
+                'python': platform.python_version(),
+                'results': results
+            }, baseline_file, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline['model_version'] != handler.model_version:
+            print(f"Warning: baseline was measured with model {baseline['model_version']}")
+        regressions = find_regressions(results, baseline['results'], args.threshold)
+        for name, baseline_cost, cost in regressions:
+            print(f"Regression: {name} {baseline_cost * 1e6:.2f}us -> {cost * 1e6:.2f}us per row")
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions above {args.threshold:.0%} against {args.baseline}")
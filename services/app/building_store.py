@@ -0,0 +1,183 @@
+"""
+services/app/building_store.py
+
+This module provides the building table of the service: the parameters of each building of the
+training data, keyed by building_id.
+
+1. Builds the table from training data: one row per building with its BUILDING_PARAMS (from its
+   last flat) and its precomputed distance to the center. The table is dense, row i holding
+   building_id i (NaN rows for unknown ids), so a lookup is a single array index.
+2. Saves the table as a `.npy` file, written aside and renamed, and memory-maps it for serving:
+   workers share its pages through the page cache and only touched rows are read.
+3. Completes requests that send only the flat-level parameters and building_id with the
+   parameters of the building; parameters sent by the client override the stored ones.
+4. Serves the stored distance to the compiled engine for rows whose coordinates are those of
+   their building, computing it only for unknown buildings and overridden coordinates.
+
+Key Components:
+- BUILDING_STORE: Whether the handler completes requests from the building table (environment variable).
+- BUILDING_STORE_PATH: Path of the building table, by default next to the model file (environment variable).
+- BUILDING_STORE_MAX_ID: Largest building_id of a table.
+- BUILDING_PARAMS: Parameters of a building and their types.
+- STORE_COLUMNS: Columns of the table.
+- BuildingStore: Class looking up buildings and their distances in a table.
+- build_building_table: Function building the table of training data.
+- save_building_table: Function saving a table.
+- load_building_store: Function memory-mapping a saved table.
+"""
+
+import os
+import numpy as np
+from services.app.logger import get_logger
+from services.models.distance import distance_to_center
+
+# Whether the handler completes requests from the building table
+BUILDING_STORE = os.getenv('BUILDING_STORE', '1') == '1'
+
+# Path of the building table ('<model>.buildings.npy' by default)
+BUILDING_STORE_PATH = os.getenv('BUILDING_STORE_PATH')
+
+# Largest building_id of a dense table (its file takes 72 bytes per id up to it)
+BUILDING_STORE_MAX_ID = 2**22
+
+# Parameters of a building and their types
+BUILDING_PARAMS = {
+    'build_year': int,
+    'building_type_int': int,
+    'latitude': float,
+    'longitude': float,
+    'ceiling_height': float,
+    'flats_count': int,
+    'floors_total': int,
+    'has_elevator': int,
+}
+
+# Columns of the table: the building parameters and the distance to the center in kilometers
+DISTANCE_COLUMN = 'distance'
+STORE_COLUMNS = list(BUILDING_PARAMS) + [DISTANCE_COLUMN]
+LATITUDE, LONGITUDE = STORE_COLUMNS.index('latitude'), STORE_COLUMNS.index('longitude')
+
+logger = get_logger(__name__)
+
+class BuildingStore:
+    """
+    Looks up the parameters and distances of buildings in a dense table indexed by building_id.
+    """
+    def __init__(self, values: np.ndarray, path: str = None):
+        """
+        Initializes the store.
+
+        Args:
+            values (np.ndarray): Table of shape (largest building_id + 1, STORE_COLUMNS),
+                usually memory-mapped.
+            path (str): Path of the table file, for logging.
+
+        Raises:
+            ValueError: If the table does not have the STORE_COLUMNS columns.
+        """
+        if values.ndim != 2 or values.shape[1] != len(STORE_COLUMNS):
+            raise ValueError(f"Building table of shape {values.shape}, expected {len(STORE_COLUMNS)} columns")
+        # A plain array view of a memory map indexes faster than the memmap subclass
+        self.values = values.view(np.ndarray)
+        self.path = path
+
+    def lookup(self, building_id) -> dict:
+        """
+        Returns the parameters of a building.
+
+        Args:
+            building_id: Building id sent by the client.
+
+        Returns:
+            dict: BUILDING_PARAMS of the building, None if the id is not a known integer id
+                (booleans are not ids).
+        """
+        if (not isinstance(building_id, int) or isinstance(building_id, bool)
+                or not 0 <= building_id < len(self.values)):
+            return None
+        row = self.values[building_id].tolist()
+        if any(value != value for value in row):
+            return None
+        return {name: param_type(value) for (name, param_type), value in zip(BUILDING_PARAMS.items(), row)}
+
+    def distance(self, building_ids: np.ndarray, latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+        """
+        Returns the distances to the center of rows, from the table where the coordinates of a
+        row are those of its building.
+
+        Args:
+            building_ids (np.ndarray): Building ids of the rows.
+            latitude (np.ndarray): Latitudes of the rows, in degrees.
+            longitude (np.ndarray): Longitudes of the rows, in degrees.
+
+        Returns:
+            np.ndarray: Distances in kilometers.
+        """
+        building_ids = np.asarray(building_ids, dtype=float)
+        known = (building_ids >= 0) & (building_ids < len(self.values)) & (building_ids == np.floor(building_ids))
+        rows = self.values[np.where(known, building_ids, 0).astype(np.int64)]
+        known &= (rows[:, LATITUDE] == latitude) & (rows[:, LONGITUDE] == longitude)
+        distance = rows[:, -1].copy()
+        if not known.all():
+            distance[~known] = distance_to_center(np.asarray(latitude)[~known], np.asarray(longitude)[~known])
+        return distance
+
+def build_building_table(X, base: np.ndarray = None) -> np.ndarray:
+    """
+    Builds the building table of training data.
+
+    A building takes the parameters of its last flat in X; buildings of the base table
+    absent from X keep their row.
+
+    Args:
+        X (pd.DataFrame): Training features with building_id and the BUILDING_PARAMS columns.
+        base (np.ndarray): Table to update, None to build a new one.
+
+    Returns:
+        np.ndarray: Table of shape (largest building_id + 1, STORE_COLUMNS).
+
+    Raises:
+        ValueError: If a building_id is negative or larger than BUILDING_STORE_MAX_ID.
+    """
+    buildings = X.groupby('building_id', sort=False)[list(BUILDING_PARAMS)].last()
+    ids = buildings.index.to_numpy(dtype=np.int64)
+    if len(ids) and (ids.min() < 0 or ids.max() > BUILDING_STORE_MAX_ID):
+        raise ValueError(f"Building ids must be between 0 and {BUILDING_STORE_MAX_ID}")
+    size = max(ids.max() + 1 if len(ids) else 0, len(base) if base is not None else 0)
+    table = np.full((size, len(STORE_COLUMNS)), np.nan)
+    if base is not None:
+        table[:len(base)] = base
+    values = buildings.to_numpy(dtype=float)
+    table[ids, :-1] = values
+    table[ids, -1] = distance_to_center(values[:, LATITUDE], values[:, LONGITUDE])
+    return table
+
+def save_building_table(table: np.ndarray, path: str):
+    """
+    Saves a building table as a `.npy` file, written aside and renamed.
+
+    Args:
+        table (np.ndarray): Building table.
+        path (str): Path of the table file.
+    """
+    with open(f"{path}.tmp", 'wb') as table_file:
+        np.save(table_file, table)
+    os.replace(f"{path}.tmp", path)
+
+def load_building_store(path: str) -> BuildingStore:
+    """
+    Memory-maps a saved building table.
+
+    Args:
+        path (str): Path of the table file.
+
+    Returns:
+        BuildingStore: Store of the table, None if the file does not exist or is not a building table.
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        return BuildingStore(np.load(path, mmap_mode='r'), path)
+    except (OSError, ValueError) as e:
+        logger.warning(f"Cannot load building table {path}: {e}")
+        return None
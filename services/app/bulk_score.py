@@ -0,0 +1,292 @@
+"""
+services/app/bulk_score.py
+
+This script scores large CSV or Parquet files of flats offline, with bounded memory.
+
+1. Reads the input in chunks of a fixed number of rows (Parquet requires pyarrow).
+2. Validates each chunk against REQUIRED_PARAMS and PARAM_RANGES with vectorized checks;
+   rows with missing, non-numeric or out-of-range values get a per-row error and are not scored.
+3. Scores the valid rows of each chunk on a pool of worker processes, each loading the model
+   once into its own `FastApiHandler` with the engine of the service (INFERENCE_ENGINE), with
+   a single model call per chunk. A row gets the score the service gives it, whatever the
+   chunk size.
+4. Streams the results (row ID, score, error) to a CSV or Parquet file in input order.
+   At most two chunks per worker are in flight, so memory use does not grow with the input.
+5. Reports progress and throughput while running, and a summary at the end.
+
+Usage:
+    python -m services.app.bulk_score flats.csv scores.csv --id-column flat_id --workers 4
+
+Key Components:
+- BULK_CHUNK_SIZE: Number of rows read, validated and scored at a time (environment variable).
+- BULK_WORKERS: Number of worker processes (environment variable, defaults to the available cores).
+- read_chunks: Function reading a CSV or Parquet file in chunks.
+- validate_chunk: Function validating a chunk and returning the per-row errors.
+- ChunkWriter: Class streaming result chunks to a CSV or Parquet file.
+- bulk_score: Function scoring a file and writing the results.
+"""
+
+import argparse
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from services.app.fastapi_handler import FastApiHandler, INFERENCE_ENGINE, MODEL_PATH, REQUIRED_PARAMS
+from services.app.schemas import PARAM_RANGES
+
+# Number of rows read, validated and scored at a time
+BULK_CHUNK_SIZE = int(os.getenv('BULK_CHUNK_SIZE', 10000))
+
+# Number of worker processes scoring chunks
+BULK_WORKERS = int(os.getenv('BULK_WORKERS', len(os.sched_getaffinity(0))))
+
+# Name of the row ID column when the input has no ID column
+ROW_COLUMN = 'row'
+
+# Handler of the worker process, created once by `_init_worker`
+_handler = None
+
+def _is_parquet(path: str) -> bool:
+    """Tells Parquet files from CSV files by their extension."""
+    return path.endswith(('.parquet', '.pq'))
+
+def read_chunks(path: str, chunk_size: int = BULK_CHUNK_SIZE):
+    """
+    Reads a CSV or Parquet file in chunks.
+
+    Args:
+        path (str): Path of the input file; '.parquet' and '.pq' files are read as Parquet.
+        chunk_size (int): Number of rows of a chunk.
+
+    Yields:
+        pd.DataFrame: Chunk of rows, indexed by the row number in the file.
+
+    Raises:
+        ImportError: If a Parquet file is given and pyarrow is not installed.
+    """
+    if not _is_parquet(path):
+        yield from pd.read_csv(path, chunksize=chunk_size)
+        return
+
+    import pyarrow.parquet as pq
+    start = 0
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_size):
+        chunk = batch.to_pandas()
+        chunk.index = pd.RangeIndex(start, start + len(chunk))
+        start += len(chunk)
+        yield chunk
+
+def validate_chunk(chunk: pd.DataFrame) -> tuple:
+    """
+    Validates the rows of a chunk against REQUIRED_PARAMS and PARAM_RANGES.
+
+    Args:
+        chunk (pd.DataFrame): Chunk with the REQUIRED_PARAMS columns.
+
+    Returns:
+        tuple: DataFrame of the valid rows with the REQUIRED_PARAMS columns in order (integer
+            parameters as integers), and a Series with the error of each row (None if valid).
+    """
+    params = chunk[REQUIRED_PARAMS]
+    values = params.apply(pd.to_numeric, errors='coerce')
+    errors = pd.Series(None, index=chunk.index, dtype=object)
+    # Checks in order of precedence: a row gets the error of its first failed check
+    checks = [(params.isna().any(axis=1), "Problem with parameters"),
+              (values.isna().any(axis=1), "Invalid input data format or value")]
+    for param in REQUIRED_PARAMS:
+        param_type, minimum, maximum = PARAM_RANGES[param]
+        out_of_range = pd.Series(False, index=chunk.index)
+        if minimum is not None:
+            out_of_range |= values[param] < minimum
+        if maximum is not None:
+            out_of_range |= values[param] > maximum
+        if param_type is int:
+            out_of_range |= values[param] % 1 != 0
+        checks.append((out_of_range, f"Invalid value of {param}"))
+    for failed, message in checks:
+        errors[failed & errors.isna()] = message
+
+    valid = values[errors.isna()]
+    int_params = [param for param in REQUIRED_PARAMS if PARAM_RANGES[param][0] is int]
+    return valid.astype({param: np.int64 for param in int_params}), errors
+
+def _init_worker(model_path: str, engine: str):
+    """
+    Loads the model into the handler of a worker process.
+
+    Args:
+        model_path (str): Path to the model pickle file or serving artifact.
+        engine (str): Inference engine, 'pipeline' or 'compiled'.
+    """
+    global _handler
+    _handler = FastApiHandler(micro_batching=False, prediction_cache=False, stage_metrics=False,
+                              stream_stats=False, engine=engine, model_path=model_path)
+    if not hasattr(_handler, 'model'):
+        raise RuntimeError(f"Cannot load model {model_path}")
+
+def _score_chunk(rows: pd.DataFrame):
+    """
+    Scores the valid rows of a chunk in a worker process.
+
+    Args:
+        rows (pd.DataFrame): Valid rows with the REQUIRED_PARAMS columns.
+
+    Returns:
+        list or str: Predicted prices in the order of the rows, or the error message
+            of the chunk if the model call fails.
+    """
+    try:
+        return _handler.rows_price_predict(rows)
+    except Exception as e:
+        return _handler.prediction_error(e)["Error"]
+
+class ChunkWriter:
+    """
+    Streams result chunks to a CSV or Parquet file.
+    """
+    def __init__(self, path: str):
+        """
+        Initializes the writer; the file is created with the first chunk.
+
+        Args:
+            path (str): Path of the output file; '.parquet' and '.pq' files are written as Parquet.
+        """
+        self.path = path
+        self._file = None
+        self._parquet_writer = None
+
+    def write(self, results: pd.DataFrame):
+        """
+        Appends a chunk of results to the file.
+
+        Args:
+            results (pd.DataFrame): Results of a chunk, with the same columns for every chunk.
+
+        Raises:
+            ImportError: If the output is a Parquet file and pyarrow is not installed.
+        """
+        if not _is_parquet(self.path):
+            if self._file is None:
+                self._file = open(self.path, 'w', newline='')
+                results.to_csv(self._file, index=False)
+            else:
+                results.to_csv(self._file, index=False, header=False)
+            return
+
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        table = pa.Table.from_pandas(results, preserve_index=False)
+        if self._parquet_writer is None:
+            schema = table.schema.set(table.schema.get_field_index('error'), pa.field('error', pa.string()))
+            self._parquet_writer = pq.ParquetWriter(self.path, schema)
+        self._parquet_writer.write_table(table.cast(self._parquet_writer.schema))
+
+    def close(self):
+        """Closes the file."""
+        if self._file is not None:
+            self._file.close()
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+
+def print_progress(stats: dict):
+    """
+    Prints the progress of a bulk scoring run to stderr.
+
+    Args:
+        stats (dict): Rows read, rows scored, rows with errors, seconds and rows per second.
+    """
+    print(f"{stats['rows']} rows, {stats['errors']} errors, {stats['seconds']:.1f} s, "
+          f"{stats['rows_per_second']:.0f} rows/s", file=sys.stderr, flush=True)
+
+def bulk_score(input_path: str, output_path: str, id_column: str = None, chunk_size: int = BULK_CHUNK_SIZE,
+               workers: int = BULK_WORKERS, model_path: str = MODEL_PATH, engine: str = INFERENCE_ENGINE,
+               progress=print_progress, progress_interval: float = 5) -> dict:
+    """
+    Scores every row of a file and writes the results in input order.
+
+    Args:
+        input_path (str): Path of the CSV or Parquet file of flats.
+        output_path (str): Path of the CSV or Parquet file of results, with the row ID,
+            'score' and 'error' columns.
+        id_column (str): Column of the input identifying the rows, None to use the row number.
+        chunk_size (int): Number of rows read, validated and scored at a time.
+        workers (int): Number of worker processes.
+        model_path (str): Path to the model pickle file or serving artifact.
+        engine (str): Inference engine of the workers, 'pipeline' or 'compiled'.
+        progress (callable): Function called with the run statistics every `progress_interval`
+            seconds, None to disable progress reports.
+        progress_interval (float): Interval of the progress reports, in seconds.
+
+    Returns:
+        dict: Rows read, rows scored, rows with errors, seconds and rows per second.
+
+    Raises:
+        ValueError: If the input lacks required parameters or the ID column.
+    """
+    stats = {'rows': 0, 'scored': 0, 'errors': 0, 'seconds': 0.0, 'rows_per_second': 0.0}
+    start_time = last_report = time.perf_counter()
+    writer = ChunkWriter(output_path)
+    pending = deque()
+
+    def write_oldest():
+        nonlocal last_report
+        ids, errors, valid_index, future = pending.popleft()
+        scores = pd.Series(np.nan, index=errors.index)
+        if future is not None:
+            result = future.result()
+            if isinstance(result, str):
+                errors.loc[valid_index] = result
+            else:
+                scores.loc[valid_index] = result
+        writer.write(pd.DataFrame({id_column or ROW_COLUMN: ids, 'score': scores.to_numpy(),
+                                   'error': errors.to_numpy()}))
+        stats['rows'] += len(errors)
+        stats['errors'] += int(errors.notna().sum())
+        stats['scored'] = stats['rows'] - stats['errors']
+        stats['seconds'] = time.perf_counter() - start_time
+        stats['rows_per_second'] = stats['rows'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+        if progress is not None and time.perf_counter() - last_report >= progress_interval:
+            last_report = time.perf_counter()
+            progress(stats)
+
+    try:
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(model_path, engine)) as executor:
+            for chunk in read_chunks(input_path, chunk_size):
+                missing = [column for column in REQUIRED_PARAMS + [id_column] if column and column not in chunk]
+                if missing:
+                    raise ValueError(f"Input lacks columns {missing}")
+                valid, errors = validate_chunk(chunk)
+                ids = chunk[id_column].to_numpy() if id_column else chunk.index.to_numpy()
+                future = executor.submit(_score_chunk, valid) if len(valid) else None
+                pending.append((ids, errors, valid.index, future))
+                # Bound the chunks held in memory
+                if len(pending) >= 2 * workers:
+                    write_oldest()
+            while pending:
+                write_oldest()
+    finally:
+        writer.close()
+
+    stats['seconds'] = time.perf_counter() - start_time
+    stats['rows_per_second'] = stats['rows'] / stats['seconds'] if stats['seconds'] > 0 else 0.0
+    return stats
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk scoring of a CSV or Parquet file of flats")
+    parser.add_argument('input', help="path of the CSV or Parquet (.parquet) file of flats")
+    parser.add_argument('output', help="path of the CSV or Parquet (.parquet) file of results")
+    parser.add_argument('--id-column', help="column identifying the rows (default: the row number)")
+    parser.add_argument('--chunk-size', type=int, default=BULK_CHUNK_SIZE)
+    parser.add_argument('--workers', type=int, default=BULK_WORKERS)
+    parser.add_argument('--model', default=MODEL_PATH, help="path of the model pickle or serving artifact")
+    parser.add_argument('--engine', choices=['pipeline', 'compiled'], default=INFERENCE_ENGINE)
+    args = parser.parse_args()
+
+    stats = bulk_score(args.input, args.output, id_column=args.id_column, chunk_size=args.chunk_size,
+                       workers=args.workers, model_path=args.model, engine=args.engine)
+    print_progress(stats)
+    print(f"Results saved to {args.output}: {stats['scored']} rows scored, {stats['errors']} rows with errors")
@@ -0,0 +1,396 @@
+"""
+services/app/columnar.py
+
+This module provides the columnar binary transport of the "/v2/predict/arrow" endpoint: flats are
+sent as an Arrow IPC stream and their scores come back as an Arrow IPC stream.
+
+1. Reads the record batches of a request in one of two layouts:
+   - packed: a single FixedSizeList<double> column of the REQUIRED_PARAMS values of each flat,
+     with the order of the parameters in the 'columns' schema metadata (a JSON list). The values
+     buffer of a batch is its row-major float array, which is scored in place in the request
+     body without copying;
+   - columnar: one numeric column per parameter, in any order, copied into a float array.
+2. Validates all batches against PARAM_RANGES with vectorized checks before scoring; a request
+   with missing, null, non-finite or out-of-range values is rejected with the rows of each error.
+3. Streams the scores back as they are computed, one batch of scores per model call of at
+   most COLUMNAR_BATCH_ROWS flats; a flat gets the same score whatever the batch layout.
+4. When run as a script, starts the service and compares payload sizes and end-to-end rows per
+   second of the Arrow endpoint with the JSON batch endpoints.
+
+Request bodies larger than COLUMNAR_MAX_BYTES are rejected from their Content-Length, or as
+soon as the bytes read exceed it, before any of the stream is parsed.
+
+pyarrow is imported when a stream is read or written, so the service starts without it.
+
+Key Components:
+- ARROW_MEDIA_TYPE: Media type of Arrow IPC streams.
+- COLUMNAR_MAX_ROWS: Maximum number of flats of a request (environment variable).
+- COLUMNAR_MAX_BYTES: Maximum size of a request body (environment variable).
+- COLUMNAR_BATCH_ROWS: Number of flats of a batch written by `encode_rows` and of a model call
+  of `write_scores` (environment variable).
+- ColumnarError: Exception raised for an invalid request stream.
+- PayloadTooLarge: Exception raised for a request body over COLUMNAR_MAX_BYTES.
+- read_body: Function reading a request body up to COLUMNAR_MAX_BYTES.
+- read_batches: Function reading and validating the float arrays of a request stream.
+- write_scores: Function scoring arrays and writing the response stream chunk by chunk.
+- encode_rows, decode_scores: Functions encoding flats and decoding scores on the client side.
+- predict_columnar: Function scoring flats through the endpoint.
+- compare_transports: Function comparing the Arrow and JSON endpoints.
+"""
+
+import argparse
+import json
+import os
+import time
+import httpx
+import numpy as np
+from services.app.fastapi_handler import FastApiHandler, MAX_BATCH_SIZE, REQUIRED_PARAMS, gen_random_data
+from services.app.schemas import PARAM_RANGES
+
+# Media type of Arrow IPC streams
+ARROW_MEDIA_TYPE = 'application/vnd.apache.arrow.stream'
+
+# Maximum number of flats of a request
+COLUMNAR_MAX_ROWS = int(os.getenv('COLUMNAR_MAX_ROWS', 1000000))
+
+# Maximum size of a request body, in bytes (a packed flat takes 120 bytes)
+COLUMNAR_MAX_BYTES = int(os.getenv('COLUMNAR_MAX_BYTES', 256 * 2**20))
+
+# Number of flats of a record batch written by the client and of a model call of the server
+COLUMNAR_BATCH_ROWS = int(os.getenv('COLUMNAR_BATCH_ROWS', 10000))
+
+# Name of the column of the packed layout and of the response column
+PACKED_COLUMN = 'params'
+SCORE_COLUMN = 'score'
+
+# End-of-stream marker of the Arrow IPC stream format
+END_OF_STREAM = b'\xff\xff\xff\xff\x00\x00\x00\x00'
+
+# Maximum number of rows listed in an error message
+MAX_ERROR_ROWS = 5
+
+class ColumnarError(ValueError):
+    """
+    Raised when a request stream cannot be read or holds invalid values.
+    """
+
+class PayloadTooLarge(ColumnarError):
+    """
+    Raised when a request body exceeds the size limit.
+    """
+
+async def read_body(request, max_bytes: int = COLUMNAR_MAX_BYTES) -> bytes:
+    """
+    Reads a request body, rejecting it as soon as it is known to exceed the size limit.
+
+    Args:
+        request (Request): Incoming request.
+        max_bytes (int): Maximum size of the body, in bytes.
+
+    Returns:
+        bytes: Request body.
+
+    Raises:
+        PayloadTooLarge: If the Content-Length or the bytes read exceed max_bytes.
+    """
+    error = f"Request body exceeds the limit of {max_bytes} bytes"
+    length = request.headers.get('content-length', '')
+    if length.isdigit() and int(length) > max_bytes:
+        raise PayloadTooLarge(error)
+    chunks, size = [], 0
+    async for chunk in request.stream():
+        size += len(chunk)
+        if size > max_bytes:
+            raise PayloadTooLarge(error)
+        chunks.append(chunk)
+    return b''.join(chunks)
+
+def _packed_order(schema) -> list:
+    """
+    Returns the positions of REQUIRED_PARAMS in the rows of a packed stream.
+
+    Args:
+        schema (pa.Schema): Schema of the stream.
+
+    Returns:
+        list: Position of each parameter in the packed rows.
+
+    Raises:
+        ColumnarError: If the parameters of the schema metadata are not REQUIRED_PARAMS.
+    """
+    try:
+        columns = json.loads((schema.metadata or {})[b'columns'])
+    except (KeyError, ValueError) as e:
+        raise ColumnarError("Packed stream without a 'columns' list in its schema metadata") from e
+    if sorted(columns) != sorted(REQUIRED_PARAMS) or len(columns) != schema.field(0).type.list_size:
+        raise ColumnarError(f"Packed columns {columns} do not match the required parameters")
+    return [columns.index(param) for param in REQUIRED_PARAMS]
+
+def _batch_array(batch, order: list) -> np.ndarray:
+    """
+    Converts a record batch into a float array in REQUIRED_PARAMS order.
+
+    Args:
+        batch (pa.RecordBatch): Record batch of the packed or columnar layout.
+        order (list): Positions of REQUIRED_PARAMS in the packed rows, None for the columnar layout.
+
+    Returns:
+        np.ndarray: Float array of shape (rows, REQUIRED_PARAMS), a read-only view of the request
+            body for a packed batch of doubles in REQUIRED_PARAMS order.
+
+    Raises:
+        ColumnarError: If a column is missing, excess, null or not numeric.
+    """
+    import pyarrow as pa
+
+    if order is not None:
+        column = batch.column(0)
+        values = column.flatten()
+        if column.null_count or values.null_count:
+            raise ColumnarError("Packed stream with null values")
+        if not pa.types.is_float64(values.type):
+            values = values.cast(pa.float64())
+        X = values.to_numpy(zero_copy_only=True).reshape(-1, len(order))
+        return X if order == list(range(len(order))) else X[:, order]
+
+    names = set(batch.schema.names)
+    if names != set(REQUIRED_PARAMS):
+        raise ColumnarError(f"Missing columns {sorted(set(REQUIRED_PARAMS) - names)}, "
+                            f"excess columns {sorted(names - set(REQUIRED_PARAMS))}")
+    X = np.empty((batch.num_rows, len(REQUIRED_PARAMS)))
+    for j, param in enumerate(REQUIRED_PARAMS):
+        column = batch.column(param)
+        if not (pa.types.is_integer(column.type) or pa.types.is_floating(column.type)):
+            raise ColumnarError(f"Column {param} of type {column.type} is not numeric")
+        if column.null_count:
+            raise ColumnarError(f"Column {param} has null values")
+        X[:, j] = column.to_numpy()
+    return X
+
+def validate_array(X: np.ndarray, start: int = 0) -> list:
+    """
+    Validates a float array of flats against PARAM_RANGES.
+
+    Args:
+        X (np.ndarray): Float array of shape (rows, REQUIRED_PARAMS).
+        start (int): Row number of the first row in the request, for the error messages.
+
+    Returns:
+        list: Error message of each parameter with invalid values, with the first rows.
+    """
+    errors = []
+    for j, param in enumerate(REQUIRED_PARAMS):
+        param_type, minimum, maximum = PARAM_RANGES[param]
+        values = X[:, j]
+        invalid = ~np.isfinite(values)
+        if minimum is not None:
+            invalid |= values < minimum
+        if maximum is not None:
+            invalid |= values > maximum
+        if param_type is int:
+            invalid |= values % 1 != 0
+        if invalid.any():
+            rows = (np.flatnonzero(invalid)[:MAX_ERROR_ROWS] + start).tolist()
+            errors.append(f"Invalid value of {param} in rows {rows}")
+    return errors
+
+def read_batches(body: bytes, max_rows: int = COLUMNAR_MAX_ROWS) -> list:
+    """
+    Reads and validates the float arrays of a request stream.
+
+    Args:
+        body (bytes): Arrow IPC stream of the packed or columnar layout.
+        max_rows (int): Maximum number of flats.
+
+    Returns:
+        list: Float array of each record batch, in REQUIRED_PARAMS order.
+
+    Raises:
+        ColumnarError: If the stream cannot be read, has too many rows or holds invalid values.
+        ImportError: If pyarrow is not installed.
+    """
+    import pyarrow as pa
+
+    try:
+        reader = pa.ipc.open_stream(pa.py_buffer(body))
+        schema = reader.schema
+        packed = len(schema) == 1 and pa.types.is_fixed_size_list(schema.field(0).type)
+        order = _packed_order(schema) if packed else None
+        batches, rows, errors = [], 0, []
+        for batch in reader:
+            X = _batch_array(batch, order)
+            errors += validate_array(X, rows)
+            rows += len(X)
+            if rows > max_rows:
+                raise ColumnarError(f"Request exceeds the limit of {max_rows} rows")
+            batches.append(X)
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError) as e:
+        raise ColumnarError(f"Invalid Arrow IPC stream: {e}") from e
+    if errors:
+        raise ColumnarError("; ".join(errors))
+    return batches
+
+def write_scores(handler: FastApiHandler, batches: list, max_rows: int = COLUMNAR_BATCH_ROWS):
+    """
+    Scores float arrays and writes the response stream, one chunk per model call.
+
+    Args:
+        handler (FastApiHandler): Handler with the model loaded.
+        batches (list): Float arrays of shape (rows, REQUIRED_PARAMS).
+        max_rows (int): Maximum number of flats of a model call; larger arrays are scored in slices.
+
+    Yields:
+        bytes: Schema and first batch of scores, the following batches, and the end-of-stream marker.
+
+    Raises:
+        RuntimeError: If the prediction of a batch fails (the error is logged by the handler).
+    """
+    import pyarrow as pa
+
+    schema = pa.schema([pa.field(SCORE_COLUMN, pa.float64(), nullable=False)])
+    header = schema.serialize().to_pybytes()
+    slices = (X[start:start + max_rows] for X in batches for start in range(0, max(len(X), 1), max_rows))
+    for X in slices:
+        result = handler.handle_array(X)
+        if "Error" in result:
+            raise RuntimeError(result["Error"])
+        scores = pa.record_batch([pa.array(result["scores"], pa.float64())], schema=schema)
+        yield header + scores.serialize().to_pybytes()
+        header = b''
+    yield header + END_OF_STREAM
+
+def encode_rows(rows, batch_rows: int = COLUMNAR_BATCH_ROWS) -> bytes:
+    """
+    Encodes flats as a packed Arrow IPC stream.
+
+    Args:
+        rows: DataFrame with the REQUIRED_PARAMS columns, or array of rows in REQUIRED_PARAMS order.
+        batch_rows (int): Number of flats of a record batch.
+
+    Returns:
+        bytes: Arrow IPC stream.
+    """
+    import pyarrow as pa
+
+    X = rows[REQUIRED_PARAMS].to_numpy(dtype=float) if hasattr(rows, 'columns') else np.asarray(rows, dtype=float)
+    X = np.ascontiguousarray(X.reshape(-1, len(REQUIRED_PARAMS)))
+    schema = pa.schema([pa.field(PACKED_COLUMN, pa.list_(pa.float64(), len(REQUIRED_PARAMS)), nullable=False)],
+                       metadata={'columns': json.dumps(REQUIRED_PARAMS)})
+    sink = pa.BufferOutputStream()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        for start in range(0, len(X), batch_rows):
+            values = pa.array(X[start:start + batch_rows].ravel())
+            writer.write_batch(pa.record_batch([pa.FixedSizeListArray.from_arrays(values, len(REQUIRED_PARAMS))],
+                                               schema=schema))
+    return sink.getvalue().to_pybytes()
+
+def decode_scores(body: bytes) -> np.ndarray:
+    """
+    Decodes the scores of a response stream.
+
+    Args:
+        body (bytes): Arrow IPC stream of the response.
+
+    Returns:
+        np.ndarray: Scores in the order of the flats.
+    """
+    import pyarrow as pa
+
+    return pa.ipc.open_stream(pa.py_buffer(body)).read_all().column(SCORE_COLUMN).to_numpy()
+
+def predict_columnar(client: httpx.Client, rows, batch_rows: int = COLUMNAR_BATCH_ROWS,
+                     path: str = '/v2/predict/arrow') -> np.ndarray:
+    """
+    Scores flats through the Arrow endpoint.
+
+    Args:
+        client (httpx.Client): HTTP client bound to the service (or a FastAPI TestClient).
+        rows: DataFrame with the REQUIRED_PARAMS columns, or array of rows in REQUIRED_PARAMS order.
+        batch_rows (int): Number of flats of a record batch (and of a model call).
+        path (str): Path of the endpoint.
+
+    Returns:
+        np.ndarray: Scores in the order of the flats.
+
+    Raises:
+        httpx.HTTPStatusError: If the request is rejected.
+    """
+    response = client.post(path, content=encode_rows(rows, batch_rows), headers={'Content-Type': ARROW_MEDIA_TYPE})
+    response.raise_for_status()
+    return decode_scores(response.content)
+
+def compare_transports(client: httpx.Client, rows: int, batch_rows: int, max_batch_size: int,
+                       repeat: int = 3) -> dict:
+    """
+    Compares the payload sizes and end-to-end rows per second of the Arrow and JSON endpoints.
+
+    JSON requests are split into batches of at most max_batch_size flats, sent one after another.
+
+    Args:
+        client (httpx.Client): HTTP client bound to the service.
+        rows (int): Number of random flats to score.
+        batch_rows (int): Number of flats of a record batch of the Arrow request.
+        max_batch_size (int): Maximum number of flats of a JSON batch request.
+        repeat (int): Number of timing runs of each transport; the best one is reported.
+
+    Returns:
+        dict: Request and response bytes, seconds and rows per second of each transport.
+    """
+    flats = [gen_random_data() for _ in range(rows)]
+    X = np.array([[flat[param] for param in REQUIRED_PARAMS] for flat in flats])
+
+    def send_json(path: str):
+        sizes = [0, 0]
+        for start in range(0, rows, max_batch_size):
+            body = json.dumps(flats[start:start + max_batch_size]).encode()
+            response = client.post(path, content=body, headers={'Content-Type': 'application/json'})
+            response.raise_for_status()
+            sizes[0] += len(body)
+            sizes[1] += len(response.content)
+        return sizes
+
+    def send_arrow():
+        body = encode_rows(X, batch_rows)
+        response = client.post('/v2/predict/arrow', content=body, headers={'Content-Type': ARROW_MEDIA_TYPE})
+        response.raise_for_status()
+        decode_scores(response.content)
+        return [len(body), len(response.content)]
+
+    results = {}
+    transports = [('json', lambda: send_json('/predict/batch')), ('json_v2', lambda: send_json('/v2/predict/batch')),
+                  ('arrow', send_arrow)]
+    for name, send in transports:
+        seconds = []
+        for _ in range(repeat):
+            start_time = time.perf_counter()
+            request_bytes, response_bytes = send()
+            seconds.append(time.perf_counter() - start_time)
+        results[name] = {'request_bytes': request_bytes, 'response_bytes': response_bytes,
+                         'seconds': min(seconds), 'rows_per_second': rows / min(seconds)}
+    return results
+
+if __name__ == "__main__":
+    from services.app.scaling_benchmark import start_server
+
+    parser = argparse.ArgumentParser(description="Payload size and throughput of the Arrow and JSON endpoints")
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000], help="flats per run")
+    parser.add_argument('--batch-rows', type=int, default=COLUMNAR_BATCH_ROWS, help="flats per Arrow record batch")
+    parser.add_argument('--app', default='services.app.app:app', help="application to serve")
+    parser.add_argument('--port', type=int, default=8011)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    server = start_server(args.app, 1, args.port)
+    try:
+        with httpx.Client(base_url=f"http://127.0.0.1:{args.port}", timeout=600) as client:
+            print(f"{'rows':>8} {'transport':<10} {'request KiB':>12} {'response KiB':>13} "
+                  f"{'seconds':>9} {'rows/s':>10}")
+            for rows in args.rows:
+                results = compare_transports(client, rows, args.batch_rows, MAX_BATCH_SIZE, args.repeat)
+                for name, result in results.items():
+                    print(f"{rows:>8} {name:<10} {result['request_bytes'] / 1024:>12.1f} "
+                          f"{result['response_bytes'] / 1024:>13.1f} {result['seconds']:>9.3f} "
+                          f"{result['rows_per_second']:>10.0f}")
+    finally:
+        server.terminate()
+        server.wait()
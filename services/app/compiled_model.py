@@ -0,0 +1,375 @@
+"""
+services/app/compiled_model.py
+
+This module provides a pandas-free "compiled" inference engine for the fitted model pipeline.
+
+1. Translates the fitted sklearn pipeline into a flat NumPy plan at load time: the scaler,
+   power and k-bins parameters of the preprocessor, the AutoFeat formulas and polynomial
+   terms of only the features kept by the SFS selectors, and the CatBoost regressor.
+2. Scores float arrays directly with the plan, bypassing DataFrame construction and the
+   column bookkeeping of the custom transformers.
+
+The plan reproduces the fitted pipeline row by row: the distance feature is standardized
+with the training mean and deviation learned by `FeatureAdder.fit`, so a score does not depend
+on the other rows of the batch. Pipelines fitted before these statistics were learned
+standardize the distance over the scored batch; their plans are not `row_independent`.
+The distances to the center can be served by a lookup (the building table of
+building_store.py) instead of being computed for every row.
+
+Scoring only needs NumPy; sklearn and sympy are imported when a pipeline is compiled, so
+a plan loaded from a serving artifact (see model_artifact.py) starts without them.
+
+Key Components:
+- FORMULA_GLOBALS: Names available to the compiled AutoFeat formulas.
+- CompiledPipeline: Class scoring float arrays with a compiled plan.
+- compile_pipeline: Function translating a fitted pipeline (or a bare regressor) into a plan.
+- is_row_independent: Function telling whether the scores of a model do not depend on the batch.
+"""
+
+import numpy as np
+from services.models.distance import distance_to_center
+
+# Names available to the AutoFeat formulas printed as NumPy code
+FORMULA_GLOBALS = {'__builtins__': {}, 'numpy': np, 'abs': np.abs}
+
+class CompiledPipeline:
+    """
+    Scores float arrays with a flat NumPy plan compiled from a fitted pipeline.
+
+    `distance_lookup`, if set, is called with the building ids, latitudes and longitudes of the
+    rows and returns their distances to the center in kilometers. `row_independent` tells whether
+    the score of a row does not depend on the other rows of the scored array.
+    """
+    def __init__(self, plan: dict):
+        """
+        Initializes the engine with a compiled plan.
+
+        Args:
+            plan (dict): Plan produced by `compile_pipeline`.
+        """
+        self.plan = plan
+        self.input_columns = plan['input_columns']
+        self.regressor = plan['regressor']
+        self.distance_lookup = None
+        self.row_independent = all(
+            step.get('mean') is not None
+            for block in plan['preprocessor'] for step in block['steps'] if step['kind'] == 'distance'
+        )
+        self._building_column = (self.input_columns.index('building_id')
+                                 if 'building_id' in self.input_columns else None)
+        self._formulas = [
+            compile(feature['expression'], '<formula>', 'eval') if feature['kind'] == 'formula' else None
+            for feature in plan['features']
+        ]
+
+    def to_array(self, batch_params: list) -> np.ndarray:
+        """
+        Converts a list of model parameter dictionaries into a float array in input column order.
+
+        Args:
+            batch_params (list): List of dictionaries of model parameters.
+
+        Returns:
+            np.ndarray: Float array of shape (rows, input columns).
+
+        Raises:
+            ValueError: If a parameter value cannot be converted to float.
+        """
+        return np.array([[row[column] for column in self.input_columns] for row in batch_params], dtype=float)
+
+    def transform(self, X: np.ndarray) -> np.ndarray:
+        """
+        Computes the regressor features for a float array of inputs.
+
+        Args:
+            X (np.ndarray): Float array of shape (rows, input columns).
+
+        Returns:
+            np.ndarray: Float array of shape (rows, regressor features).
+        """
+        P = np.empty((X.shape[0], len(self.plan['preprocessor_columns'])))
+        position = 0
+        for block in self.plan['preprocessor']:
+            values = X[:, block['columns']]
+            for i, step in enumerate(block['steps']):
+                if (step['kind'] == 'distance' and i == 0 and self.distance_lookup is not None
+                        and self._building_column is not None):
+                    distance = self.distance_lookup(X[:, self._building_column], values[:, 0], values[:, 1])
+                    values = _standardized(distance, step)
+                else:
+                    values = _apply_step(step, values)
+            P[:, position:position + values.shape[1]] = values
+            position += values.shape[1]
+
+        features = np.empty((X.shape[0], len(self.plan['features'])))
+        for i, (feature, formula) in enumerate(zip(self.plan['features'], self._formulas)):
+            kind = feature['kind']
+            if kind == 'column':
+                features[:, i] = P[:, feature['column']]
+            elif kind == 'onehot':
+                features[:, i] = P[:, feature['column']] == feature['value']
+            elif kind == 'poly':
+                features[:, i] = np.prod(P[:, feature['columns']] ** feature['powers'], axis=1)
+            else:
+                namespace = dict(zip(feature['symbols'], P[:, feature['columns']].T))
+                features[:, i] = eval(formula, FORMULA_GLOBALS, namespace)
+        return features
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """
+        Predicts prices for a float array of inputs.
+
+        Args:
+            X (np.ndarray): Float array of shape (rows, input columns).
+
+        Returns:
+            np.ndarray: Predicted prices.
+        """
+        return self.regressor.predict(self.transform(X))
+
+def _apply_step(step: dict, values: np.ndarray) -> np.ndarray:
+    """
+    Applies one compiled preprocessing step to a block of columns.
+
+    Args:
+        step (dict): Compiled step.
+        values (np.ndarray): Float array of the block columns.
+
+    Returns:
+        np.ndarray: Transformed block.
+    """
+    kind = step['kind']
+    if kind == 'standard':
+        if step['mean'] is not None:
+            values = values - step['mean']
+        if step['scale'] is not None:
+            values = values / step['scale']
+        return values
+    if kind == 'boxcox':
+        lambdas = step['lambdas']
+        with np.errstate(divide='ignore', invalid='ignore'):
+            logs = np.log(values)
+            return np.where(lambdas == 0, logs, np.expm1(lambdas * logs) / np.where(lambdas == 0, 1, lambdas))
+    if kind == 'kbins':
+        binned = np.empty_like(values)
+        for j, edges in enumerate(step['edges']):
+            binned[:, j] = np.searchsorted(edges[1:-1], values[:, j], side='right')
+        return binned
+    if kind == 'distance':
+        return _standardized(distance_to_center(values[:, 0], values[:, 1]), step)
+    return values
+
+def _standardized(distance: np.ndarray, step: dict) -> np.ndarray:
+    """
+    Standardizes distances with the training statistics of a distance step into a column.
+
+    A step without statistics (a pipeline fitted before they were learned) standardizes
+    over the distances of the batch, as that pipeline does.
+    """
+    if step.get('mean') is not None:
+        return ((distance - step['mean']) / step['scale'])[:, None]
+    std = distance.std()
+    return ((distance - distance.mean()) / (std if std > 0 else 1))[:, None]
+
+def _compile_transformer(transformer) -> list:
+    """
+    Translates a fitted preprocessing transformer into compiled steps.
+
+    Args:
+        transformer: Fitted transformer of the preprocessor.
+
+    Returns:
+        list: Compiled steps.
+
+    Raises:
+        NotImplementedError: If the transformer is not supported.
+    """
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import StandardScaler, PowerTransformer, KBinsDiscretizer, FunctionTransformer
+
+    if transformer == 'passthrough' or isinstance(transformer, FunctionTransformer) and transformer.func is None:
+        return []
+    if isinstance(transformer, Pipeline):
+        return [step for _, t in transformer.steps for step in _compile_transformer(t)]
+    if isinstance(transformer, StandardScaler):
+        return [{'kind': 'standard', 'mean': transformer.mean_, 'scale': transformer.scale_}]
+    if isinstance(transformer, PowerTransformer) and transformer.method == 'box-cox':
+        steps = [{'kind': 'boxcox', 'lambdas': transformer.lambdas_}]
+        if transformer.standardize:
+            steps += _compile_transformer(transformer._scaler)
+        return steps
+    if isinstance(transformer, KBinsDiscretizer) and transformer.encode == 'ordinal':
+        return [{'kind': 'kbins', 'edges': list(transformer.bin_edges_)}]
+    if type(transformer).__name__ == 'FeatureAdder':
+        scaler = getattr(transformer, 'scaler_', None)
+        if scaler is None:
+            return [{'kind': 'distance', 'mean': None, 'scale': None}]
+        return [{'kind': 'distance', 'mean': float(scaler.mean_[0]), 'scale': float(scaler.scale_[0])}]
+    raise NotImplementedError(f"Cannot compile transformer {type(transformer).__name__}")
+
+def _compile_preprocessor(preprocessor: 'ColumnTransformer') -> tuple:
+    """
+    Translates the fitted preprocessor into blocks of compiled steps.
+
+    Args:
+        preprocessor (ColumnTransformer): Fitted preprocessor of the pipeline.
+
+    Returns:
+        tuple: Input columns, list of blocks, preprocessor output column names.
+    """
+    input_columns = list(preprocessor.feature_names_in_)
+    blocks = []
+    for _, transformer, columns in preprocessor.transformers_:
+        if transformer == 'drop' or len(columns) == 0:
+            continue
+        indices = [input_columns.index(c) if isinstance(c, str) else int(c) for c in columns]
+        blocks.append({'columns': indices, 'steps': _compile_transformer(transformer)})
+    return input_columns, blocks, list(preprocessor.get_feature_names_out())
+
+def _selected_upstream(stage, names: list) -> list:
+    """
+    Maps feature names at the output of a column selection stage to its input names.
+
+    Args:
+        stage: Fitted selection stage (duplicate remover or union of feature selectors).
+        names (list): Feature names at the output of the stage.
+
+    Returns:
+        list: Feature names at the input of the stage.
+
+    Raises:
+        NotImplementedError: If the stage does not only select columns.
+    """
+    from sklearn.pipeline import FeatureUnion
+
+    if hasattr(stage, 'columns_to_keep_'):
+        return names
+    if isinstance(stage, FeatureUnion) and all(hasattr(t, 'k_feature_idx_') for _, t in stage.transformer_list):
+        prefixes = [name + '__' for name, _ in stage.transformer_list]
+        return [next(n[len(p):] for p in prefixes if n.startswith(p)) for n in names]
+    raise NotImplementedError(f"Cannot compile stage {type(stage).__name__}")
+
+def _generated_feature(generator: 'ColumnTransformer', name: str, columns: list) -> dict:
+    """
+    Translates one output column of the fitted feature generator into a feature spec.
+
+    Args:
+        generator (ColumnTransformer): Fitted feature generator (AutoFeat and polynomial features).
+        name (str): Output column name of the generator.
+        columns (list): Preprocessor output column names (the generator inputs).
+
+    Returns:
+        dict: Feature spec.
+
+    Raises:
+        NotImplementedError: If the column comes from an unsupported transformer.
+    """
+    from sklearn.preprocessing import PolynomialFeatures
+    from sympy.printing.numpy import NumPyPrinter
+
+    transformer_name, feature = name.split('__', 1)
+    if transformer_name == 'remainder':
+        return {'kind': 'column', 'column': columns.index(feature)}
+    transformer = generator.named_transformers_[transformer_name]
+    if isinstance(transformer, PolynomialFeatures):
+        inputs = list(transformer.feature_names_in_)
+        powers = transformer.powers_[list(transformer.get_feature_names_out()).index(feature)]
+        used = np.flatnonzero(powers)
+        return {'kind': 'poly', 'columns': [columns.index(inputs[j]) for j in used], 'powers': powers[used]}
+    autofeat = getattr(transformer, 'model', None)
+    if autofeat is not None and hasattr(autofeat, 'feature_formulas_'):
+        if feature in autofeat.feateng_cols_:
+            return {'kind': 'column', 'column': columns.index(feature)}
+        for categorical in autofeat.categorical_cols or []:
+            if feature.startswith(f"cat_{categorical}_"):
+                return {
+                    'kind': 'onehot',
+                    'column': columns.index(categorical),
+                    'value': float(feature[len(f"cat_{categorical}_"):])
+                }
+        formula = autofeat.feature_formulas_[feature]
+        symbols = {str(autofeat.feature_formulas_[c]): c for c in autofeat.feateng_cols_}
+        used = sorted(str(s) for s in formula.free_symbols)
+        return {
+            'kind': 'formula',
+            'columns': [columns.index(symbols[s]) for s in used],
+            'symbols': used,
+            'expression': NumPyPrinter().doprint(formula)
+        }
+    raise NotImplementedError(f"Cannot compile feature {name}")
+
+def compile_pipeline(model) -> CompiledPipeline:
+    """
+    Translates a fitted model into a compiled inference engine.
+
+    Supports the feature engineering pipeline of `model_pipeline.ipynb` and a bare
+    CatBoost regressor fitted on the raw model parameters.
+
+    Args:
+        model: Fitted sklearn Pipeline ending with a CatBoost regressor, or the regressor itself.
+
+    Returns:
+        CompiledPipeline: Compiled inference engine.
+
+    Raises:
+        NotImplementedError: If the model contains unsupported transformers.
+    """
+    from sklearn.compose import ColumnTransformer
+    from sklearn.pipeline import Pipeline
+
+    stages = []
+    regressor = model
+    if isinstance(model, Pipeline):
+        regressor = model.steps[-1][1]
+        pending = [t for _, t in model.steps[:-1]]
+        while pending:
+            stage = pending.pop(0)
+            if isinstance(stage, Pipeline):
+                pending = [t for _, t in stage.steps] + pending
+            elif stage != 'passthrough':
+                stages.append(stage)
+
+    names = list(regressor.feature_names_)
+    if not stages:
+        input_columns, blocks, columns = names, [{'columns': list(range(len(names))), 'steps': []}], names
+    elif isinstance(stages[0], ColumnTransformer):
+        input_columns, blocks, columns = _compile_preprocessor(stages[0])
+    else:
+        raise NotImplementedError(f"Cannot compile stage {type(stages[0]).__name__}")
+
+    for stage in reversed(stages[1:]):
+        if isinstance(stage, ColumnTransformer):
+            features = [_generated_feature(stage, name, columns) for name in names]
+            break
+        names = _selected_upstream(stage, names)
+    else:
+        features = [{'kind': 'column', 'column': columns.index(name)} for name in names]
+
+    return CompiledPipeline({
+        'input_columns': input_columns,
+        'preprocessor': blocks,
+        'preprocessor_columns': columns,
+        'features': features,
+        'regressor': regressor
+    })
+
+def is_row_independent(model) -> bool:
+    """
+    Tells whether the score of a row does not depend on the other rows scored with it.
+
+    Only a distance step fitted before its training statistics were learned makes a
+    pipeline batch-dependent.
+
+    Args:
+        model: Fitted pipeline, bare regressor or compiled engine.
+
+    Returns:
+        bool: True if rows can be scored together without changing their scores.
+    """
+    if isinstance(model, CompiledPipeline):
+        return model.row_independent
+    if type(model).__name__ == 'FeatureAdder':
+        return hasattr(model, 'scaler_')
+    children = (getattr(model, 'transformers_', None) or getattr(model, 'steps', None)
+                or getattr(model, 'transformer_list', None) or [])
+    return all(is_row_independent(child[1]) for child in children)
@@ -4,23 +4,53 @@ services/app/fastapi_handler.py
 This module provides a handler for processing model predictions in a FastAPI application.
 
 1. Defines the `FastApiHandler` class to handle predictions and parameter validation.
-2. Loads a pre-trained model from a pickle file.
-3. Provides functions to generate sample data and random data for testing purposes.
+2. Loads a pre-trained model from a pickle file or from a lean serving artifact;
+   pandas is imported only when the fitted pipeline is used for inference.
+3. Scores batches of flats with a single vectorized model call; a flat gets the same score
+   in a batch as alone (a batch-dependent model scores the rows of a batch one by one).
+   Rows validated by the typed schemas (schemas.py) are scored from a float array directly,
+   and so are the float arrays read from Arrow IPC streams (columnar.py).
+4. Optionally coalesces concurrent single-flat requests into micro-batches, unless the scores
+   of the loaded model depend on the other rows of a batch (a pipeline fitted before the
+   distance statistics were learned).
+5. Switches between the fitted pipeline and the compiled NumPy inference engine.
+6. Caches predictions per model version for repeated requests.
+7. Logs through the non-blocking structured logger, sampling request payloads.
+8. Optionally records the latency of each pipeline stage, validation and serialization.
+9. Records the parameters and predicted price of served predictions into constant-memory
+   quantile sketches, published with their drift from the training profile (stream_stats.py).
+10. Completes untyped requests that send only the flat-level parameters and building_id from
+    the memory-mapped building table saved with the model (building_store.py); parameters sent
+    by the client override the stored ones. The compiled engine takes the distances to the
+    center of known buildings from the table.
+11. Provides functions to generate sample data and random data for testing purposes.
 
 Key Components:
 - REQUIRED_PARAMS: List of required model parameters.
-- MODEL_PATH: Path to the pre-trained model file.
+- MODEL_PATH: Path to the pre-trained model file (pickle or serving artifact).
+- MAX_BATCH_SIZE: Maximum number of flats accepted in a single batch request.
+- INFERENCE_ENGINE: Inference engine used by default ('pipeline' or 'compiled').
+- PREDICTION_ERRORS: Mapping of prediction exceptions to error responses.
 - FastApiHandler: Class to handle model predictions and parameter validation.
 - sample_data: Function to generate a sample set of model parameters.
 - gen_random_data: Function to generate a random set of model parameters.
 """
 
 from random import randint, uniform
+import hashlib
 import pickle
-from pprint import pprint
-import pandas as pd
-from geopy.distance import geodesic
 import os
+import numpy as np
+from services.app.batcher import MicroBatcher, MICRO_BATCHING
+from services.app.building_store import BUILDING_STORE, BUILDING_STORE_PATH, load_building_store
+from services.app.compiled_model import CompiledPipeline, compile_pipeline, is_row_independent
+from services.app.model_artifact import is_artifact, load_artifact
+from services.app.prediction_cache import PredictionCache, PREDICTION_CACHE
+from services.app.logger import get_logger, sample_payload
+from services.app.stage_metrics import StageMetricsResponse, STAGE_METRICS, instrument, timed, uninstrument
+from services.app.stream_stats import StreamingStats, REFERENCE_PROFILE_PATH, STREAM_STATS
+
+logger = get_logger(__name__)
 
 # List of required model parameters
 REQUIRED_PARAMS = [
@@ -31,40 +61,158 @@ REQUIRED_PARAMS = [
 ]
 
 # Path to the pre-trained model file
-MODEL_PATH = 'services/models/loaded_model.pkl'
+MODEL_PATH = os.getenv('MODEL_PATH', 'services/models/loaded_model.pkl')
+
+# Maximum number of flats accepted in a single batch request
+MAX_BATCH_SIZE = int(os.getenv('MAX_BATCH_SIZE', 1000))
+
+# Inference engine: 'pipeline' (fitted sklearn pipeline) or 'compiled' (NumPy plan of the pipeline)
+INFERENCE_ENGINE = os.getenv('INFERENCE_ENGINE', 'pipeline')
+
+# Exceptions raised while predicting: (exception type, log label, error message)
+PREDICTION_ERRORS = [
+    (ValueError, "Value Error", "Invalid input data format or value"),
+    (TypeError, "Type Error", "Incorrect input data type"),
+    (AttributeError, "Attribute Error", "Model or pipeline attribute issue"),
+    (IndexError, "Index Error", "Indexing issue with input data"),
+    (KeyError, "Key Error", "Missing key in input data"),
+]
 
 class FastApiHandler:
     """
     A handler class for managing model predictions and parameter validation.
     """
-    def __init__(self):
-        """Initializes the handler and loads the model."""
+    def __init__(self, max_batch_size: int = MAX_BATCH_SIZE, micro_batching: bool = MICRO_BATCHING,
+                 engine: str = INFERENCE_ENGINE, prediction_cache: bool = PREDICTION_CACHE,
+                 stage_metrics: bool = STAGE_METRICS, model_path: str = MODEL_PATH,
+                 stream_stats: bool = STREAM_STATS, building_store: bool = BUILDING_STORE):
+        """
+        Initializes the handler and loads the model.
+
+        Args:
+            max_batch_size (int): Maximum number of flats accepted in a single batch request.
+            micro_batching (bool): Whether to coalesce concurrent single-flat predictions.
+            engine (str): Inference engine, 'pipeline' or 'compiled'.
+            prediction_cache (bool): Whether to cache predictions of repeated requests.
+            stage_metrics (bool): Whether to record the latency of each prediction stage.
+            model_path (str): Path to the model pickle file or serving artifact.
+            stream_stats (bool): Whether to record the distribution of served predictions,
+                compared with the reference profile next to the model file by default.
+            building_store (bool): Whether to complete requests from the building table
+                next to the model file (or at BUILDING_STORE_PATH).
+        """
         self.required_model_params = REQUIRED_PARAMS
-        self.load_model(model_path=MODEL_PATH)
+        self.max_batch_size = max_batch_size
+        self.engine = engine
+        self.compiled_model = None
+        self.model_version = None
+        self.row_independent = True
+        self.stage_metrics = False
+        self.use_building_store = building_store
+        self.building_store = None
+        self.cache = PredictionCache(REQUIRED_PARAMS) if prediction_cache else None
+        self.batcher = MicroBatcher(self.batch_price_predict, self.price_predict) if micro_batching else None
+        self.row_batcher = MicroBatcher(self.rows_price_predict, self.row_price_predict) if micro_batching else None
+        self.stream_stats = StreamingStats(
+            REQUIRED_PARAMS, profile_path=REFERENCE_PROFILE_PATH or f"{model_path}.profile.json"
+        ) if stream_stats else None
+        self.load_model(model_path=model_path)
+        self.set_stage_metrics(stage_metrics)
 
-    def load_model(self, model_path: str):
+    def load_model(self, model_path: str) -> bool:
         """
-        Loads a pre-trained model from a pickle file.
+        Loads a pre-trained model from a pickle file or a serving artifact.
+
+        Errors are logged and leave the previously loaded model (if any) in place. The building
+        table of the model is loaded with it.
 
         Args:
-            model_path (str): Path to the model pickle file.
+            model_path (str): Path to the model pickle file or serving artifact.
 
-        Raises:
-            Various exceptions if loading the model fails.
+        Returns:
+            bool: True if the model was loaded, False otherwise.
         """
+        loaded = False
         try:
             with open(model_path, 'rb') as model_file:
-                self.model = pickle.load(model_file)
+                model_bytes = model_file.read()
+            self.model = load_artifact(model_bytes) if is_artifact(model_bytes) else pickle.loads(model_bytes)
+            self.model_version = hashlib.sha256(model_bytes).hexdigest()[:12]
+            loaded = True
         except pickle.UnpicklingError:
-            print("Error unpickling the data. The file may be corrupted or not a valid pickle file.")
+            logger.error("Error unpickling the data. The file may be corrupted or not a valid pickle file.")
         except EOFError:
-            print("Reached end of file unexpectedly. The file may be corrupted.")
+            logger.error("Reached end of file unexpectedly. The file may be corrupted.")
         except ImportError:
-            print("Required module for unpickling not found.")
+            logger.error("Required module for unpickling not found.")
         except AttributeError as e:
-            print(f"An attribute referenced during unpickling does not exist: {e}")
+            logger.error(f"An attribute referenced during unpickling does not exist: {e}")
         except Exception as e:
-            print(f"An unexpected error occurred, failed to load model: {e}")
+            logger.error(f"An unexpected error occurred, failed to load model: {e}",
+                         extra={'error_type': type(e).__name__})
+        if loaded:
+            self.building_store = load_building_store(
+                BUILDING_STORE_PATH or f"{model_path}.buildings.npy"
+            ) if self.use_building_store else None
+            self.set_engine(self.engine)
+        return loaded
+
+    def set_engine(self, engine: str):
+        """
+        Selects the inference engine, compiling the loaded model if needed.
+
+        Falls back to the pipeline engine if the model cannot be compiled. A model loaded
+        from a serving artifact is already compiled and always uses the compiled engine.
+
+        Args:
+            engine (str): Inference engine, 'pipeline' or 'compiled'.
+        """
+        # The compiler expects the model without timing wrappers
+        stage_metrics = self.stage_metrics
+        self.set_stage_metrics(False)
+        self.compiled_model = None
+        if isinstance(self.model, CompiledPipeline):
+            engine = 'compiled'
+        if engine == 'compiled':
+            try:
+                self.compiled_model = (self.model if isinstance(self.model, CompiledPipeline)
+                                       else compile_pipeline(self.model))
+            except Exception as e:
+                logger.warning(f"Cannot compile model, using pipeline engine: {e}")
+                engine = 'pipeline'
+        if self.compiled_model is not None:
+            self.compiled_model.distance_lookup = (self.building_store.distance if self.building_store is not None
+                                                   else None)
+        self.row_independent = is_row_independent(self.compiled_model if self.compiled_model is not None
+                                                  else self.model)
+        if not self.row_independent and self.batcher is not None:
+            logger.warning("Model scores depend on the batch, micro-batching is disabled for this model")
+        self.engine = engine
+        self.set_stage_metrics(stage_metrics)
+
+    def set_stage_metrics(self, enabled: bool):
+        """
+        Switches the per-stage latency instrumentation on or off.
+
+        Wraps the steps of the loaded model (or the compiled model), the validation
+        methods and the response serialization with timing; switching off restores
+        the original objects.
+
+        Args:
+            enabled (bool): Whether to record the latency of each stage.
+        """
+        if hasattr(self, 'model'):
+            self.model = instrument(self.model) if enabled else uninstrument(self.model)
+        if self.compiled_model is not None:
+            self.compiled_model = (instrument(self.compiled_model, 'compiled') if enabled
+                                   else uninstrument(self.compiled_model))
+        for method in ('validate_params', 'validate_batch'):
+            if enabled:
+                setattr(self, method, timed(getattr(FastApiHandler, method).__get__(self), 'validation'))
+            else:
+                self.__dict__.pop(method, None)
+        StageMetricsResponse.enabled = enabled
+        self.stage_metrics = enabled
 
     def price_predict(self, model_params: dict) -> float:
         """
@@ -76,9 +224,107 @@ class FastApiHandler:
         Returns:
             float: Predicted price.
         """
+        if self.compiled_model is not None:
+            return self.compiled_model.predict(self.compiled_model.to_array([model_params]))[0]
+        import pandas as pd
         df_sample = pd.DataFrame(model_params, index=[0])
         return self.model.predict(df_sample)[0]
 
+    def batch_price_predict(self, batch_params: list) -> list:
+        """
+        Predicts prices for a batch of flats with a single model call.
+
+        A batch-dependent model scores each flat alone, so the batch does not change its score.
+
+        Args:
+            batch_params (list): List of dictionaries of model parameters.
+
+        Returns:
+            list: Predicted prices in the order of the input rows.
+        """
+        if not self.row_independent:
+            return [float(self.price_predict(model_params)) for model_params in batch_params]
+        if self.compiled_model is not None:
+            return self.compiled_model.predict(self.compiled_model.to_array(batch_params)).tolist()
+        import pandas as pd
+        df_batch = pd.DataFrame(batch_params, columns=self.required_model_params)
+        return self.model.predict(df_batch).tolist()
+
+    def row_price_predict(self, row: tuple) -> float:
+        """
+        Predicts the price for a row of parameter values in REQUIRED_PARAMS order.
+
+        Args:
+            row (tuple): Parameter values of a flat.
+
+        Returns:
+            float: Predicted price.
+        """
+        return self.rows_price_predict([row])[0]
+
+    def rows_price_predict(self, rows: list) -> list:
+        """
+        Predicts prices for rows of parameter values in REQUIRED_PARAMS order with a single model call.
+
+        The compiled engine (and a batch-dependent model) scores the rows as a float array;
+        the pipeline engine needs a DataFrame, built from the rows without per-row dictionaries.
+
+        Args:
+            rows (list): Tuples of parameter values, or a DataFrame of the REQUIRED_PARAMS columns.
+
+        Returns:
+            list: Predicted prices in the order of the input rows.
+        """
+        if self.compiled_model is not None or not self.row_independent:
+            return self.array_price_predict(np.array(rows, dtype=float)).tolist()
+        import pandas as pd
+        df_batch = pd.DataFrame(rows, columns=self.required_model_params)
+        return self.model.predict(df_batch).tolist()
+
+    def array_price_predict(self, X: np.ndarray) -> np.ndarray:
+        """
+        Predicts prices for a float array of rows in REQUIRED_PARAMS order with a single model call.
+
+        The array is not modified, so it can be a read-only view of a request body.
+        A batch-dependent model scores each row alone.
+
+        Args:
+            X (np.ndarray): Float array of shape (rows, REQUIRED_PARAMS).
+
+        Returns:
+            np.ndarray: Predicted prices in the order of the rows.
+        """
+        if not self.row_independent and len(X) > 1:
+            return np.concatenate([self.array_price_predict(X[i:i + 1]) for i in range(len(X))])
+        if self.compiled_model is not None:
+            if self.compiled_model.input_columns != self.required_model_params:
+                X = X[:, [self.required_model_params.index(column) for column in self.compiled_model.input_columns]]
+            return self.compiled_model.predict(X)
+        import pandas as pd
+        return np.asarray(self.model.predict(pd.DataFrame(X, columns=self.required_model_params)))
+
+    def fill_building_params(self, model_params: dict) -> dict:
+        """
+        Completes the parameters of a flat with the stored parameters of its building.
+
+        Args:
+            model_params (dict): Dictionary of model parameters, possibly without the building ones.
+
+        Returns:
+            dict: Complete parameters in REQUIRED_PARAMS order, with the values sent by the client
+                where given; the parameters unchanged if they cannot be completed.
+        """
+        if self.building_store is None or len(model_params) >= len(self.required_model_params):
+            return model_params
+        building = self.building_store.lookup(model_params.get('building_id'))
+        if building is None:
+            logger.debug("Unknown building_id, parameters not completed")
+            return model_params
+        params = {**building, **model_params}
+        if set(params) != set(self.required_model_params):
+            return model_params
+        return {name: params[name] for name in self.required_model_params}
+
     def validate_params(self, model_params: dict) -> bool:
         """
         Validates that the provided parameters match the required model parameters.
@@ -90,12 +336,54 @@ class FastApiHandler:
             bool: True if validation is successful, False otherwise.
         """
         if set(model_params.keys()) == set(self.required_model_params):
-            print("All model params exist")
+            logger.debug("All model params exist")
         else:
-            print("Not all model params exist")
+            logger.info("Not all model params exist")
             return False
         return True
 
+    def validate_batch(self, batch_params: list) -> list:
+        """
+        Validates every row of a batch against the required model parameters.
+
+        Rows with missing or excess parameters, and rows with non-numeric values
+        (which would otherwise fail the whole vectorized prediction), are rejected.
+
+        Args:
+            batch_params (list): List of dictionaries of model parameters.
+
+        Returns:
+            list: Error response for each rejected row, None for each valid row.
+        """
+        required_params = set(self.required_model_params)
+        errors = []
+        for row in batch_params:
+            if not isinstance(row, dict) or set(row.keys()) != required_params:
+                errors.append({"Error": "Problem with parameters"})
+            elif not all(isinstance(value, (int, float)) for value in row.values()):
+                errors.append({"Error": "Invalid input data format or value"})
+            else:
+                errors.append(None)
+        return errors
+
+    def prediction_error(self, error: Exception) -> dict:
+        """
+        Converts an exception raised while predicting into an error response.
+
+        Args:
+            error (Exception): Exception raised by the model or pipeline.
+
+        Returns:
+            dict: Dictionary containing the error message.
+        """
+        for error_type, label, message in PREDICTION_ERRORS:
+            if isinstance(error, error_type):
+                logger.error(f"{label}: {error}", extra={'error_type': type(error).__name__}, exc_info=error)
+                return {"Error": message}
+        logger.error(f"Error while handling request: {error}",
+                     extra={'error_type': type(error).__name__}, exc_info=error)
+        return {"Error": "Problem with request"}
+
     def handle(self, model_params: dict) -> dict:
         """
         Handles the prediction request by validating parameters and predicting the price.
@@ -106,32 +394,144 @@ class FastApiHandler:
         Returns:
             dict: Dictionary containing the prediction result or an error message.
         """
+        model_params = self.fill_building_params(model_params)
         if not self.validate_params(model_params):
             return {"Error": "Problem with parameters"}
 
-        print("Predicting for model_params:")
-        pprint(model_params, sort_dicts=False)
+        if sample_payload():
+            logger.info("Predicting for model_params", extra={'payload': model_params})
+        cache_key = self.cache.key(self.model_version, model_params) if self.cache is not None else None
+        return self._predict_one(model_params, cache_key, self.batcher, self.price_predict)
+
+    def handle_row(self, row: tuple) -> dict:
+        """
+        Handles a prediction request for a row validated by the typed schema.
+
+        Args:
+            row (tuple): Parameter values of a flat in REQUIRED_PARAMS order.
+
+        Returns:
+            dict: Dictionary containing the prediction result or an error message.
+        """
+        if sample_payload():
+            logger.info("Predicting for model_params",
+                        extra={'payload': dict(zip(self.required_model_params, row))})
+        cache_key = self.cache.row_key(self.model_version, row) if self.cache is not None else None
+        return self._predict_one(row, cache_key, self.row_batcher, self.row_price_predict)
+
+    def _predict_one(self, params, cache_key: tuple, batcher: MicroBatcher, predict) -> dict:
+        """
+        Predicts the price of one flat through the prediction cache and the micro-batcher.
+
+        Args:
+            params: Model parameters of the flat, as accepted by `predict`.
+            cache_key (tuple): Cache key of the parameters, None to bypass the cache.
+            batcher (MicroBatcher): Micro-batcher of the parameters, None to predict directly
+                (the batcher is also bypassed for a batch-dependent model).
+            predict (callable): Function predicting the price of the parameters.
+
+        Returns:
+            dict: Dictionary containing the prediction result or an error message.
+        """
+        if cache_key is not None:
+            predicted_price = self.cache.get(cache_key)
+            if predicted_price is not None:
+                if self.stream_stats is not None:
+                    self.stream_stats.record(params, predicted_price)
+                return {"score": predicted_price}
+        try:
+            # Rows of a batch-dependent model are not coalesced with unrelated requests
+            if batcher is not None and self.row_independent:
+                predicted_price = batcher.submit(params)
+            else:
+                predicted_price = predict(params)
+        except Exception as e:
+            return self.prediction_error(e)
+        # Skip caching if the model was swapped while predicting
+        if cache_key is not None and cache_key[0] == self.model_version:
+            self.cache.put(cache_key, predicted_price)
+        if self.stream_stats is not None:
+            self.stream_stats.record(params, predicted_price)
+        return {"score": predicted_price}
+
+    def handle_batch(self, batch_params: list) -> dict:
+        """
+        Handles a batch prediction request.
+
+        Valid rows are scored together with one model call; invalid rows get
+        their own error response instead of failing the whole batch.
+
+        Args:
+            batch_params (list): List of dictionaries of model parameters.
+
+        Returns:
+            dict: Dictionary with a list of per-row results (score or error message),
+                or an error message if the batch exceeds the size limit.
+        """
+        if len(batch_params) > self.max_batch_size:
+            return {"Error": f"Batch size exceeds the limit of {self.max_batch_size}"}
+
+        if self.building_store is not None:
+            batch_params = [self.fill_building_params(row) if isinstance(row, dict) else row for row in batch_params]
+        results = self.validate_batch(batch_params)
+        valid_rows = [i for i, error in enumerate(results) if error is None]
+        logger.debug(f"Predicting for batch: {len(valid_rows)} of {len(batch_params)} rows are valid")
+        if valid_rows:
+            try:
+                valid_params = [batch_params[i] for i in valid_rows]
+                predicted_prices = self.batch_price_predict(valid_params)
+                for i, predicted_price in zip(valid_rows, predicted_prices):
+                    results[i] = {"score": predicted_price}
+            except Exception as e:
+                error = self.prediction_error(e)
+                for i in valid_rows:
+                    results[i] = error
+            else:
+                if self.stream_stats is not None:
+                    self.stream_stats.record_many(valid_params, predicted_prices)
+        return {"results": results}
+
+    def handle_rows(self, rows: list) -> dict:
+        """
+        Handles a batch prediction request of rows validated by the typed schema.
+
+        Args:
+            rows (list): Tuples of parameter values in REQUIRED_PARAMS order.
+
+        Returns:
+            dict: Dictionary with the scores in the order of the rows, or an error message.
+        """
+        logger.debug(f"Predicting for typed batch of {len(rows)} rows")
+        if not rows:
+            return {"scores": []}
+        try:
+            predicted_prices = self.rows_price_predict(rows)
+        except Exception as e:
+            return self.prediction_error(e)
+        if self.stream_stats is not None:
+            self.stream_stats.record_many(rows, predicted_prices)
+        return {"scores": predicted_prices}
+
+    def handle_array(self, X: np.ndarray) -> dict:
+        """
+        Handles a batch prediction request of a validated float array.
+
+        Args:
+            X (np.ndarray): Float array of shape (rows, REQUIRED_PARAMS).
+
+        Returns:
+            dict: Dictionary with the array of scores in the order of the rows, or an error message.
+        """
+        logger.debug(f"Predicting for columnar batch of {len(X)} rows")
+        if not len(X):
+            return {"scores": np.empty(0)}
         try:
-            predicted_price = self.price_predict(model_params)
-            return {"score": predicted_price}
-        except ValueError as ve:
-            print(f"Value Error: {ve}")
-            return {"Error": "Invalid input data format or value"}
-        except TypeError as te:
-            print(f"Type Error: {te}")
-            return {"Error": "Incorrect input data type"}
-        except AttributeError as ae:
-            print(f"Attribute Error: {ae}")
-            return {"Error": "Model or pipeline attribute issue"}
-        except IndexError as ie:
-            print(f"Index Error: {ie}")
-            return {"Error": "Indexing issue with input data"}
-        except KeyError as ke:
-            print(f"Key Error: {ke}")
-            return {"Error": "Missing key in input data"}
+            predicted_prices = self.array_price_predict(X)
         except Exception as e:
-            print(f"Error while handling request: {e}")
-            return {"Error": "Problem with request"}
+            return self.prediction_error(e)
+        if self.stream_stats is not None:
+            self.stream_stats.record_many(X, predicted_prices)
+        return {"scores": predicted_prices}
 
 def sample_data() -> dict:
     """
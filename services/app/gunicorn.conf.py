@@ -0,0 +1,71 @@
+"""
+services/app/gunicorn.conf.py
+
+This module configures multi-worker serving of the FastAPI application with Gunicorn.
+
+1. Runs WEB_CONCURRENCY Uvicorn workers, so inference is spread over several cores
+   instead of being limited to one process by the GIL.
+2. Loads the application, and so the model, once in the master process before forking
+   (`preload_app`), so workers share its memory copy-on-write; objects loaded at startup
+   are frozen out of the garbage collector to keep their pages shared.
+3. Switches prometheus_client to multiprocess mode: every process writes its metrics to
+   PROMETHEUS_MULTIPROC_DIR, and /metrics combines the values of all workers; the metric
+   files of an exited worker are marked dead and its prediction sketch is removed.
+4. Reloads the model of every worker on SIGHUP (sent by "/model/reload"): the master reloads
+   and warms up the model of the preloaded application, then Gunicorn replaces the workers
+   with forks sharing the new model. A model that fails to load or warm up is not swapped in.
+
+Usage:
+    gunicorn --config services/app/gunicorn.conf.py services.app.app_stage_4:app
+
+Key Components:
+- WEB_CONCURRENCY: Number of worker processes (environment variable, defaults to the number of cores).
+- PROMETHEUS_MULTIPROC_DIR: Directory of the multiprocess metric files (environment variable).
+"""
+
+import gc
+import os
+import shutil
+
+# Number of worker processes
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', len(os.sched_getaffinity(0))))
+
+# Directory of the multiprocess metric files, cleaned on every start (but not when the
+# configuration is read again on SIGHUP); it has to be set before prometheus_client is
+# imported by the preloaded application
+PROMETHEUS_MULTIPROC_DIR = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', '/tmp/prometheus_multiproc')
+if os.environ.get('PROMETHEUS_MULTIPROC_MASTER') != str(os.getpid()):
+    os.environ['PROMETHEUS_MULTIPROC_MASTER'] = str(os.getpid())
+    shutil.rmtree(PROMETHEUS_MULTIPROC_DIR, ignore_errors=True)
+    os.makedirs(PROMETHEUS_MULTIPROC_DIR)
+
+# Gunicorn settings
+bind = '0.0.0.0:8000'
+workers = WEB_CONCURRENCY
+worker_class = 'uvicorn.workers.UvicornWorker'
+preload_app = True
+graceful_timeout = 30
+
+def when_ready(server):
+    """Freezes the preloaded objects before the workers are forked."""
+    gc.freeze()
+
+def post_fork(server, worker):
+    """Lets the model manager of a worker ask the master for reloads."""
+    manager = getattr(server.app.wsgi(), 'model_manager', None)
+    if manager is not None:
+        manager.master_pid = server.pid
+
+def on_reload(server):
+    """Reloads the model of the preloaded application before the workers are replaced (SIGHUP)."""
+    manager = getattr(server.app.wsgi(), 'model_manager', None)
+    if manager is not None:
+        manager.reload()
+        gc.freeze()
+
+def child_exit(server, worker):
+    """Marks the metric files of an exited worker as dead and removes its prediction sketch."""
+    from prometheus_client import multiprocess
+    from services.app.stream_stats import remove_worker_sketch
+    multiprocess.mark_process_dead(worker.pid)
+    remove_worker_sketch(worker.pid)
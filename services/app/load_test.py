@@ -1,34 +1,251 @@
 """
-services/app/load_test_script.py
+services/app/load_test.py
 
-This script performs load testing on a FastAPI application by sending a series of requests
-to specific endpoints.
+This script generates open-loop load on the FastAPI application and reports its latency distribution.
 
-1. Sends GET requests to the "/random" endpoint.
-2. Sends GET requests to the "/metrics" endpoint.
-3. Introduces random delays between requests to simulate real-world usage patterns.
+1. Sends requests asynchronously to "/predict", "/predict/batch", their typed "/v2" versions
+   or "/random" following a constant
+   or stepped arrival rate, independently of how fast the service responds (open loop).
+2. Limits the number of in-flight requests; latency is measured from the scheduled send time,
+   so queueing in the generator is not hidden (no coordinated omission).
+3. Builds payloads with `gen_random_data` or `sample_data`.
+4. Reports throughput, error counts and latency percentiles (p50/p95/p99/max), overall and per
+   rate step, and exports them as JSON for comparing runs.
+5. Runs against a URL (e.g. a local uvicorn) or against the application in-process.
 
 Key Components:
-- NUM_REQUESTS: The total number of requests to be sent.
+- ENDPOINTS: Request builders for the supported endpoints.
+- arrival_times: Function generating the open-loop schedule of request send times.
+- run_load_test: Coroutine running a load test and returning its report.
+- summarize: Function computing throughput, errors and latency percentiles.
 """
 
+import argparse
+import asyncio
+import importlib
+import itertools
+import json
 import time
-import random
-import requests
+import httpx
+import numpy as np
+from services.app.fastapi_handler import gen_random_data, sample_data
 
-# Total number of requests to be sent during the load test
-NUM_REQUESTS = 1000
+# Payload generators
+PAYLOADS = {'random': gen_random_data, 'sample': sample_data}
 
-for i in range(NUM_REQUESTS):
+# Request builders: endpoint name -> function(payload generator, batch size) -> (method, path, json body)
+ENDPOINTS = {
+    'predict': lambda payload, batch_size: ('POST', '/predict', payload()),
+    'predict_batch': lambda payload, batch_size: (
+        'POST', '/predict/batch', [payload() for _ in range(batch_size)]
+    ),
+    'random': lambda payload, batch_size: ('GET', '/random', None),
+    'predict_v2': lambda payload, batch_size: ('POST', '/v2/predict', payload()),
+    'predict_batch_v2': lambda payload, batch_size: (
+        'POST', '/v2/predict/batch', [payload() for _ in range(batch_size)]
+    ),
+}
+
+def arrival_times(rate: float, duration: float, step_rate: float = 0, step_duration: float = 0):
+    """
+    Generates the send times of an open-loop load test.
+
+    Args:
+        rate (float): Initial arrival rate, requests per second.
+        duration (float): Duration of the test, in seconds.
+        step_rate (float): Rate increase applied every step (0 for a constant rate).
+        step_duration (float): Duration of a rate step, in seconds.
+
+    Yields:
+        tuple: Send time relative to the start, in seconds, and the index of the rate step.
+
+    Raises:
+        ValueError: If the duration or the step duration is negative, or the rate of a step is not positive.
+    """
+    if duration < 0 or step_duration < 0:
+        raise ValueError(f"Durations must not be negative, got {duration} and {step_duration}")
+    if not (step_rate and step_duration):
+        step_rate, step_duration = 0, duration
+    # The rate changes linearly, so the first and last steps have the extreme rates
+    last_step = max(int(np.ceil(duration / step_duration)) - 1, 0) if duration else 0
+    if min(rate, rate + step_rate * last_step) <= 0:
+        raise ValueError(f"Arrival rates must be positive, got {rate} rising by {step_rate} for {last_step} steps")
+    step = 0
+    while step * step_duration < duration:
+        step_rate_rps = rate + step_rate * step
+        end = min((step + 1) * step_duration, duration)
+        # Send times are computed from the request index to avoid accumulating rounding errors
+        for i in itertools.count():
+            t = step * step_duration + i / step_rate_rps
+            if t >= end:
+                break
+            yield t, step
+        step += 1
+
+def summarize(results: list, elapsed: float) -> dict:
+    """
+    Computes throughput, error counts and latency percentiles of request results.
+
+    Args:
+        results (list): Dictionaries with 'latency' (seconds), 'status' and 'app_error' of each request.
+        elapsed (float): Wall-clock duration of the requests, in seconds.
+
+    Returns:
+        dict: Summary of the results.
+    """
+    latencies = np.array([r['latency'] for r in results]) * 1000
+    ok = [r for r in results if r['status'] is not None and r['status'] < 400]
+    summary = {
+        'requests': len(results),
+        'throughput_rps': len(ok) / elapsed if elapsed > 0 else 0.0,
+        'errors': len(results) - len(ok),
+        'app_errors': sum(r['app_error'] for r in ok),
+        'status_codes': {},
+    }
+    for r in results:
+        summary['status_codes'][str(r['status'])] = summary['status_codes'].get(str(r['status']), 0) + 1
+    if len(latencies):
+        summary.update({
+            'latency_ms': {
+                'mean': float(latencies.mean()),
+                'p50': float(np.percentile(latencies, 50)),
+                'p95': float(np.percentile(latencies, 95)),
+                'p99': float(np.percentile(latencies, 99)),
+                'max': float(latencies.max()),
+            }
+        })
+    return summary
+
+async def _send(client: httpx.AsyncClient, request: tuple, scheduled: float,
+                semaphore: asyncio.Semaphore, timeout: float) -> dict:
     """
-    Send requests to the specified endpoints and introduce random delays.
+    Sends one request and records its latency from the scheduled send time.
 
-    Iterates NUM_REQUESTS times, sending GET requests to the "/random" and "/metrics"
-    endpoints of the FastAPI application running on localhost, and sleeps for a random
-    duration between requests to simulate load.
+    Args:
+        client (httpx.AsyncClient): HTTP client.
+        request (tuple): Method, path and JSON body.
+        scheduled (float): Scheduled send time (perf_counter clock).
+        semaphore (asyncio.Semaphore): Limit of in-flight requests.
+        timeout (float): Request timeout, in seconds.
+
+    Returns:
+        dict: Latency, HTTP status (None on a transport error) and whether the body reports an error.
+    """
+    method, path, body = request
+    status, app_error = None, False
+    async with semaphore:
+        try:
+            response = await client.request(method, path, json=body, timeout=timeout)
+            status = response.status_code
+            app_error = status < 400 and 'Error' in response.text
+        except httpx.HTTPError:
+            pass
+    return {'latency': time.perf_counter() - scheduled, 'status': status, 'app_error': app_error}
+
+async def run_load_test(client: httpx.AsyncClient, endpoint: str = 'predict', payload: str = 'random',
+                        rate: float = 10, duration: float = 10, step_rate: float = 0,
+                        step_duration: float = 0, concurrency: int = 100, batch_size: int = 10,
+                        timeout: float = 10) -> dict:
     """
-    print(f'\rRequest: {i+1} of {NUM_REQUESTS}', end='', flush=True)
-    requests.get('http://localhost:8000/random', timeout=10)
-    time.sleep(random.random())
-    requests.get('http://localhost:8000/metrics', timeout=10)
-    time.sleep(random.random())
+    Runs an open-loop load test.
+
+    Args:
+        client (httpx.AsyncClient): HTTP client bound to the service.
+        endpoint (str): Endpoint name, a key of ENDPOINTS.
+        payload (str): Payload generator, a key of PAYLOADS.
+        rate (float): Initial arrival rate, requests per second.
+        duration (float): Duration of the test, in seconds.
+        step_rate (float): Rate increase applied every step (0 for a constant rate).
+        step_duration (float): Duration of a rate step, in seconds.
+        concurrency (int): Maximum number of in-flight requests.
+        batch_size (int): Number of flats per request of the batch endpoint.
+        timeout (float): Request timeout, in seconds.
+
+    Returns:
+        dict: Report with the configuration, the overall summary and the summary of each rate step.
+    """
+    config = {
+        'endpoint': endpoint, 'payload': payload, 'rate': rate, 'duration': duration,
+        'step_rate': step_rate, 'step_duration': step_duration, 'concurrency': concurrency,
+        'batch_size': batch_size, 'timeout': timeout,
+    }
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks, steps = [], []
+    start = time.perf_counter()
+    for offset, step in arrival_times(rate, duration, step_rate, step_duration):
+        delay = start + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        request = ENDPOINTS[endpoint](PAYLOADS[payload], batch_size)
+        tasks.append(asyncio.create_task(_send(client, request, start + offset, semaphore, timeout)))
+        steps.append(step)
+    results = await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+
+    report = {'config': config, 'summary': summarize(results, elapsed)}
+    if step_rate and step_duration:
+        # The last step is cut short when the duration is not a multiple of the step duration
+        report['steps'] = [
+            dict(step=step, rate=rate + step_rate * step,
+                 **summarize([r for r, s in zip(results, steps) if s == step],
+                             min(step_duration, duration - step * step_duration)))
+            for step in sorted(set(steps))
+        ]
+    return report
+
+def make_client(url: str = None, app_path: str = None) -> httpx.AsyncClient:
+    """
+    Creates an HTTP client for a service URL or for an application running in-process.
+
+    Args:
+        url (str): Base URL of the service, e.g. http://localhost:8000.
+        app_path (str): Application to run in-process, as 'module:attribute'.
+
+    Returns:
+        httpx.AsyncClient: HTTP client.
+    """
+    if app_path:
+        module, attribute = app_path.split(':')
+        app = getattr(importlib.import_module(module), attribute)
+        return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://app')
+    return httpx.AsyncClient(base_url=url, limits=httpx.Limits(max_connections=None))
+
+async def main(args: argparse.Namespace) -> dict:
+    """
+    Runs the load test described by the command line arguments.
+
+    Args:
+        args (argparse.Namespace): Parsed command line arguments.
+
+    Returns:
+        dict: Load test report.
+    """
+    async with make_client(args.url, args.app) as client:
+        return await run_load_test(
+            client, endpoint=args.endpoint, payload=args.payload, rate=args.rate,
+            duration=args.duration, step_rate=args.step_rate, step_duration=args.step_duration,
+            concurrency=args.concurrency, batch_size=args.batch_size, timeout=args.timeout
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Open-loop load test of the price prediction service")
+    parser.add_argument('--url', default='http://localhost:8000', help="base URL of the service")
+    parser.add_argument('--app', help="run the application in-process, e.g. services.app.app:app")
+    parser.add_argument('--endpoint', choices=list(ENDPOINTS), default='predict')
+    parser.add_argument('--payload', choices=list(PAYLOADS), default='random')
+    parser.add_argument('--rate', type=float, default=10, help="arrival rate, requests per second")
+    parser.add_argument('--duration', type=float, default=10, help="test duration, seconds")
+    parser.add_argument('--step-rate', type=float, default=0, help="rate increase per step")
+    parser.add_argument('--step-duration', type=float, default=0, help="duration of a rate step, seconds")
+    parser.add_argument('--concurrency', type=int, default=100, help="maximum in-flight requests")
+    parser.add_argument('--batch-size', type=int, default=10, help="flats per /predict/batch request")
+    parser.add_argument('--timeout', type=float, default=10, help="request timeout, seconds")
+    parser.add_argument('--output', help="path of the JSON report")
+    args = parser.parse_args()
+
+    report = asyncio.run(main(args))
+    print(json.dumps(report['summary'], indent=2))
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            json.dump(report, report_file, indent=2)
+        print(f"Report saved to {args.output}")
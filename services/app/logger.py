@@ -0,0 +1,170 @@
+"""
+services/app/logger.py
+
+This module configures non-blocking structured logging for the request hot path.
+
+1. Formats log records as JSON lines, including the extra fields passed by the caller
+   (e.g. the error type or the request payload).
+2. Puts records on a bounded in-memory queue; a background listener thread formats them and
+   writes them to stdout, so request threads never wait on I/O. Records with an exception keep
+   it until they are formatted, so the traceback is reported in its own field. When the queue
+   is full, records are dropped and counted instead of blocking the request. A forked process
+   (e.g. a Gunicorn worker) gets a queue and a listener of its own.
+3. Samples per-request payload logs (1 in N requests) to keep the volume bounded.
+
+Key Components:
+- LOG_LEVEL: Log level of the service loggers (environment variable).
+- PAYLOAD_LOG_SAMPLE_RATE: Log the payload of 1 in N requests (0 disables payload logs).
+- LOG_QUEUE_SIZE: Maximum number of records waiting for the listener (environment variable).
+- Custom Prometheus metric: log_records_dropped.
+- JsonFormatter: Class formatting log records as JSON.
+- RecordQueueHandler: Class queueing records without formatting them.
+- get_logger: Function returning a logger attached to the queue-backed handler.
+- sample_payload: Function deciding whether the current request payload is logged.
+"""
+
+import atexit
+import copy
+import itertools
+import json
+import logging
+import os
+import queue
+import sys
+from logging.handlers import QueueHandler, QueueListener
+from prometheus_client import Counter
+
+# Logging settings
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+PAYLOAD_LOG_SAMPLE_RATE = int(os.getenv('PAYLOAD_LOG_SAMPLE_RATE', 100))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+
+# Name of the parent logger of the service modules
+ROOT_LOGGER = 'services'
+
+# Attributes of every LogRecord, not reported as extra fields
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'taskName'}
+
+# Define a Prometheus Counter for the records dropped when the queue is full
+DROPPED_RECORDS = Counter('log_records_dropped', 'Number of log records dropped because the log queue was full')
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats log records as single-line JSON objects.
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        """
+        Formats a record with its extra fields and exception traceback.
+
+        Args:
+            record (logging.LogRecord): Log record.
+
+        Returns:
+            str: JSON line.
+        """
+        entry = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in RECORD_ATTRIBUTES})
+        if record.exc_info:
+            entry['traceback'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+class RecordQueueHandler(QueueHandler):
+    """
+    Queues log records for the listener, which formats them.
+
+    Unlike `QueueHandler`, the record keeps its exception information (the listener formats
+    the traceback into its own field) and a full queue drops the record.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """
+        Renders the message of a record, so later changes of its arguments do not alter it.
+
+        Args:
+            record (logging.LogRecord): Log record.
+
+        Returns:
+            logging.LogRecord: Copy of the record with its message rendered and its exception kept.
+        """
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        """Puts a record on the queue, dropping it if the queue is full."""
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            DROPPED_RECORDS.inc()
+
+_listener = None
+_payload_counter = itertools.count()
+
+def _start_listener(log_queue: queue.Queue):
+    """
+    Starts the listener thread writing queued records to stdout.
+
+    Args:
+        log_queue (queue.Queue): Queue of log records.
+    """
+    global _listener
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=False)
+    _listener.start()
+
+def _restart_after_fork(handler: RecordQueueHandler):
+    """
+    Gives the handler of a forked process a new queue and starts its listener.
+
+    The listener thread does not survive a fork, and the parent's queue cannot be reused: its
+    lock may have been held by the parent's listener at the fork, and its records are written
+    by the parent.
+
+    Args:
+        handler (RecordQueueHandler): Queue-backed handler of the service loggers.
+    """
+    handler.queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+    _start_listener(handler.queue)
+
+def _configure():
+    """Attaches the queue-backed handler to the parent logger of the service modules."""
+    handler = RecordQueueHandler(queue.Queue(maxsize=LOG_QUEUE_SIZE))
+    root = logging.getLogger(ROOT_LOGGER)
+    root.setLevel(LOG_LEVEL)
+    root.addHandler(handler)
+    root.propagate = False
+    _start_listener(handler.queue)
+    atexit.register(lambda: _listener.stop())
+    os.register_at_fork(after_in_child=lambda: _restart_after_fork(handler))
+
+def get_logger(name: str) -> logging.Logger:
+    """
+    Returns a service logger writing through the queue-backed handler.
+
+    Args:
+        name (str): Logger name, usually the module `__name__`; names outside the
+            service package (e.g. '__main__') are placed under it.
+
+    Returns:
+        logging.Logger: Logger.
+    """
+    if _listener is None:
+        _configure()
+    if name != ROOT_LOGGER and not name.startswith(ROOT_LOGGER + '.'):
+        name = f"{ROOT_LOGGER}.{name}"
+    return logging.getLogger(name)
+
+def sample_payload() -> bool:
+    """
+    Decides whether the payload of the current request is logged.
+
+    Returns:
+        bool: True for 1 in PAYLOAD_LOG_SAMPLE_RATE requests.
+    """
+    return PAYLOAD_LOG_SAMPLE_RATE > 0 and next(_payload_counter) % PAYLOAD_LOG_SAMPLE_RATE == 0
@@ -0,0 +1,199 @@
+"""
+services/app/model_artifact.py
+
+This module writes and reads the lean serving artifact of the model.
+
+1. Keeps only the inference state of a fitted pipeline: the compiled plan of `compile_pipeline`
+   (transformer parameters, formulas of the selected features) and the CatBoost regressor in
+   its native formats; fitted selector state, AutoFeat internals and training data are dropped.
+2. Stores it as a zip archive of `plan.json` (NumPy arrays are tagged lists, floats are
+   written exactly), `regressor.cbm` and CatBoost's JSON export `regressor.json`.
+3. Loads it with NumPy only: the trees of `regressor.json` are evaluated by
+   `ObliviousTreeEnsemble`, and CatBoost is imported from `regressor.cbm` on the first large
+   batch (or at load time if the trees are not supported). sklearn, sympy, autofeat, mlxtend,
+   pandas and CatBoost are not imported at start, which shortens the start of the service
+   and lowers its memory use.
+4. When run as a script, converts a pickled model into an artifact, or compares the start
+   time and resident memory of the service with a pickle and with an artifact.
+
+Key Components:
+- ARTIFACT_FORMAT: Format version stored in the artifact.
+- is_artifact: Function telling artifacts from pickles.
+- save_artifact: Function writing the artifact of a fitted model.
+- load_artifact: Function reading an artifact into a compiled inference engine.
+"""
+
+import argparse
+import io
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import zipfile
+import numpy as np
+from services.app.compiled_model import CompiledPipeline
+from services.app.tree_ensemble import from_catboost_json
+
+# Format version stored in the artifact
+ARTIFACT_FORMAT = 1
+
+# Leading bytes of a zip archive
+ZIP_MAGIC = b'PK\x03\x04'
+
+def is_artifact(model_bytes: bytes) -> bool:
+    """
+    Tells a serving artifact from a pickled model.
+
+    Args:
+        model_bytes (bytes): Contents of the model file.
+
+    Returns:
+        bool: True if the contents are a serving artifact.
+    """
+    return model_bytes[:4] == ZIP_MAGIC
+
+def save_artifact(model, path: str):
+    """
+    Writes the serving artifact of a fitted model.
+
+    Args:
+        model: Fitted pipeline of `model_pipeline.ipynb`, or a bare CatBoost regressor.
+        path (str): Path of the artifact file.
+
+    Raises:
+        NotImplementedError: If the model cannot be compiled.
+    """
+    from services.app.compiled_model import compile_pipeline
+
+    plan = dict(compile_pipeline(model).plan)
+    regressor = plan.pop('regressor')
+    regressor_files = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for model_format in ['cbm', 'json']:
+            regressor_path = os.path.join(tmp_dir, f"regressor.{model_format}")
+            regressor.save_model(regressor_path, format=model_format)
+            with open(regressor_path, 'rb') as regressor_file:
+                regressor_files[f"regressor.{model_format}"] = regressor_file.read()
+
+    # Write aside and rename, so that a watching service never reads a partial file
+    with zipfile.ZipFile(path + '.tmp', 'w', compression=zipfile.ZIP_DEFLATED) as artifact:
+        artifact.writestr('plan.json', json.dumps({'format': ARTIFACT_FORMAT, 'plan': plan}, default=_encode))
+        for name, regressor_bytes in regressor_files.items():
+            artifact.writestr(name, regressor_bytes)
+    os.replace(path + '.tmp', path)
+
+def load_artifact(model_bytes: bytes) -> CompiledPipeline:
+    """
+    Reads a serving artifact into a compiled inference engine.
+
+    Args:
+        model_bytes (bytes): Contents of the artifact file.
+
+    Returns:
+        CompiledPipeline: Compiled inference engine.
+
+    Raises:
+        ValueError: If the artifact format is not supported.
+    """
+    with zipfile.ZipFile(io.BytesIO(model_bytes)) as artifact:
+        content = json.loads(artifact.read('plan.json'), object_hook=_decode)
+        if content['format'] != ARTIFACT_FORMAT:
+            raise ValueError(f"Unsupported artifact format {content['format']}")
+        cbm_bytes = artifact.read('regressor.cbm')
+        regressor_json = json.loads(artifact.read('regressor.json'))
+
+    def load_catboost():
+        from catboost import CatBoostRegressor
+        return CatBoostRegressor().load_model(blob=cbm_bytes)
+
+    regressor = from_catboost_json(regressor_json, load_catboost) or load_catboost()
+    return CompiledPipeline(dict(content['plan'], regressor=regressor))
+
+def _encode(value):
+    """
+    Encodes the NumPy values of a plan for JSON.
+
+    Args:
+        value: Value not serializable by `json`.
+
+    Returns:
+        Tagged dictionary for an array, Python number for a NumPy scalar.
+    """
+    if isinstance(value, np.ndarray):
+        return {'__ndarray__': value.tolist(), 'dtype': str(value.dtype)}
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot encode {type(value).__name__}")
+
+def _decode(value: dict):
+    """
+    Decodes the tagged arrays of a plan read from JSON.
+
+    Args:
+        value (dict): JSON object.
+
+    Returns:
+        NumPy array for a tagged dictionary, the dictionary otherwise.
+    """
+    if '__ndarray__' in value:
+        return np.array(value['__ndarray__'], dtype=value['dtype'])
+    return value
+
+# Measures the start of the service in a fresh interpreter: imports, model load and first prediction
+STARTUP_PROBE = """
+import json, sys, time
+start_time = time.perf_counter()
+from services.app.fastapi_handler import FastApiHandler, sample_data
+handler = FastApiHandler(micro_batching=False, prediction_cache=False)
+handler.price_predict(sample_data())
+print(json.dumps({
+    'seconds': time.perf_counter() - start_time,
+    # Peak RSS of this process image (ru_maxrss would include the parent's peak before exec)
+    'max_rss_mib': int(next(line for line in open('/proc/self/status') if line.startswith('VmHWM')).split()[1]) / 1024,
+    'modules': sum(name.split('.')[0] in {'sklearn', 'sympy', 'autofeat', 'mlxtend', 'pandas', 'catboost'}
+                   for name in sys.modules),
+    'engine': handler.engine,
+}))
+"""
+
+def measure_startup(model_path: str, repeat: int = 3) -> dict:
+    """
+    Measures the start time and peak resident memory of the handler with a model file.
+
+    Args:
+        model_path (str): Path of a pickled model or an artifact.
+        repeat (int): Number of fresh interpreters; the fastest start is reported.
+
+    Returns:
+        dict: Start seconds, peak RSS in MiB, number of heavy modules imported and the engine.
+    """
+    env = dict(os.environ, MODEL_PATH=model_path, LOG_LEVEL='WARNING')
+    runs = [
+        json.loads(subprocess.run(
+            [sys.executable, '-c', STARTUP_PROBE],
+            env=env, check=True, capture_output=True, text=True
+        ).stdout.splitlines()[-1])
+        for _ in range(repeat)
+    ]
+    return min(runs, key=lambda run: run['seconds'])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Lean serving artifact of the model")
+    parser.add_argument('model', help="path of the pickled model")
+    parser.add_argument('artifact', help="path of the artifact to write")
+    parser.add_argument('--compare', action='store_true',
+                        help="compare the start of the service with the pickle and with the artifact")
+    args = parser.parse_args()
+
+    with open(args.model, 'rb') as model_file:
+        save_artifact(pickle.load(model_file), args.artifact)
+    print(f"Artifact saved to {args.artifact}: {os.path.getsize(args.artifact) / 2**20:.2f} MiB "
+          f"(pickle {os.path.getsize(args.model) / 2**20:.2f} MiB)")
+
+    if args.compare:
+        print(f"{'model file':<50} {'start s':>8} {'peak RSS MiB':>13} {'heavy modules':>14}")
+        for path in [args.model, args.artifact]:
+            startup = measure_startup(path)
+            print(f"{path:<50} {startup['seconds']:>8.2f} {startup['max_rss_mib']:>13.1f} {startup['modules']:>14}")
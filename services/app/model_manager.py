@@ -0,0 +1,243 @@
+"""
+services/app/model_manager.py
+
+This module replaces the model of the running service without downtime.
+
+1. Loads a new model into a candidate copy of the handler, compiled and instrumented the way
+   the handler is configured, while the current model keeps serving requests.
+2. Warms the candidate up with `sample_data()` predictions, which both checks that it works
+   and primes it, and rejects it if a prediction fails or is not finite.
+3. Swaps the model attributes of the handler (with the building table saved with the model)
+   in a single update, keeping the previous model for rollback.
+4. Optionally watches the model file and reloads it when it changes, in every worker process.
+   Model files should be replaced atomically (written aside and renamed).
+5. Reloads the model of every worker on request: in multi-worker serving, the request is sent
+   to the Gunicorn master (SIGHUP), which reloads the preloaded model and replaces the workers
+   with forks sharing it (see gunicorn.conf.py). A rollback only exists in a single process,
+   the previous model of a worker being unknown to the others.
+6. Exposes the active model version and reload results as Prometheus metrics.
+
+The administration endpoints of the application require the MODEL_ADMIN_TOKEN bearer token
+and are disabled when it is not set.
+
+Key Components:
+- MODEL_WATCH_INTERVAL: Polling interval of the model file in seconds, 0 disables (environment variable).
+- MODEL_ADMIN_TOKEN: Bearer token of the administration endpoints (model reload and rollback,
+  stage metrics switch), unset disables them (environment variable).
+- WARMUP_ROWS: Number of rows of the warmup batch prediction.
+- Custom Prometheus metrics: model_version_info, model_reloads.
+- ModelManager: Class loading, warming up, swapping and rolling back models.
+"""
+
+import copy
+import os
+import signal
+import threading
+import numpy as np
+from prometheus_client import Counter, Gauge
+from services.app.fastapi_handler import FastApiHandler, MODEL_PATH, sample_data
+from services.app.logger import get_logger
+
+# Polling interval of the model file, in seconds (0 disables the watcher)
+MODEL_WATCH_INTERVAL = float(os.getenv('MODEL_WATCH_INTERVAL', 0))
+
+# Bearer token of the administration endpoints: model reload and rollback, stage metrics switch
+# (unset disables them)
+MODEL_ADMIN_TOKEN = os.getenv('MODEL_ADMIN_TOKEN')
+
+# Number of rows of the warmup batch prediction
+WARMUP_ROWS = 16
+
+# Attributes of the handler swapped together with the model
+MODEL_STATE = ('model', 'compiled_model', 'model_version', 'engine', 'building_store', 'row_independent')
+
+# Define Prometheus metrics for model swaps
+MODEL_VERSION = Gauge('model_version_info', 'Active model version (1) and replaced versions (0)', ['version'],
+                      multiprocess_mode='livemax')
+MODEL_RELOADS = Counter('model_reloads', 'Number of model reloads by result', ['result'])
+
+logger = get_logger(__name__)
+
+class ModelManager:
+    """
+    Loads, warms up and swaps the model of a handler while it serves requests.
+
+    `master_pid` is the pid of the Gunicorn master in multi-worker serving, set in each worker
+    after it is forked, and None when the application runs in a single process.
+    """
+    def __init__(self, handler: FastApiHandler, model_path: str = MODEL_PATH,
+                 watch_interval: float = MODEL_WATCH_INTERVAL):
+        """
+        Initializes the manager with the model currently loaded by the handler.
+
+        Args:
+            handler (FastApiHandler): Handler serving the requests.
+            model_path (str): Path to the model pickle file.
+            watch_interval (float): Polling interval of the model file in seconds, 0 disables the watcher.
+        """
+        self.handler = handler
+        self.model_path = model_path
+        self.watch_interval = watch_interval
+        self.previous = None
+        self.master_pid = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._mtime = _modification_time(model_path)
+        if handler.model_version is not None:
+            MODEL_VERSION.labels(version=handler.model_version).set(1)
+
+    def reload(self, model_path: str = None) -> dict:
+        """
+        Loads a model, warms it up and swaps it in if it works.
+
+        Args:
+            model_path (str): Path to the model pickle file, defaults to the managed path.
+
+        Returns:
+            dict: Dictionary with the active and previous model versions, or an error message.
+        """
+        with self._lock:
+            # The watcher does not load the same file again
+            if model_path is None:
+                self._mtime = _modification_time(self.model_path)
+            candidate = copy.copy(self.handler)
+            candidate.__dict__.pop('model', None)
+            candidate.compiled_model = None
+            if not candidate.load_model(model_path or self.model_path):
+                MODEL_RELOADS.labels(result='failed').inc()
+                return {"Error": "Cannot load model"}
+            if candidate.model_version == self.handler.model_version:
+                return {"model_version": self.handler.model_version, "status": "unchanged"}
+            try:
+                self.warmup(candidate)
+            except Exception as e:
+                logger.error(f"Model {candidate.model_version} failed warmup: {e}",
+                             extra={'error_type': type(e).__name__}, exc_info=e)
+                MODEL_RELOADS.labels(result='failed').inc()
+                return {"Error": "Model warmup failed"}
+            self.previous = self._swap({name: getattr(candidate, name) for name in MODEL_STATE})
+            MODEL_RELOADS.labels(result='success').inc()
+            logger.info(f"Model {self.previous['model_version']} replaced by {self.handler.model_version}")
+            return self.status()
+
+    def reload_all(self) -> dict:
+        """
+        Reloads the model of every worker process.
+
+        In multi-worker serving, the Gunicorn master is asked to reload and replace the workers,
+        and the versions of the current worker are returned with the 'reloading' status.
+
+        Returns:
+            dict: Dictionary with the active and previous model versions, or an error message.
+        """
+        if self.master_pid is None:
+            return self.reload()
+        os.kill(self.master_pid, signal.SIGHUP)
+        logger.info(f"Model reload of all workers requested from master {self.master_pid}")
+        return dict(self.status(), status="reloading")
+
+    def rollback(self) -> dict:
+        """
+        Swaps the previous model back in; a second rollback returns to the replaced model.
+
+        Only available in a single process: in multi-worker serving, the previous model file is
+        restored instead, and reloaded by every worker.
+
+        Returns:
+            dict: Dictionary with the active and previous model versions, or an error message.
+        """
+        if self.master_pid is not None:
+            return {"Error": "Rollback is not available with several workers, restore the previous model file"}
+        with self._lock:
+            if self.previous is None:
+                return {"Error": "No previous model to roll back to"}
+            self.previous = self._swap(self.previous)
+            MODEL_RELOADS.labels(result='rollback').inc()
+            logger.info(f"Model {self.previous['model_version']} rolled back to {self.handler.model_version}")
+            return self.status()
+
+    def warmup(self, handler: FastApiHandler):
+        """
+        Runs single and batch predictions on sample data with a handler.
+
+        Args:
+            handler (FastApiHandler): Handler with the model to warm up.
+
+        Raises:
+            ValueError: If a prediction is not finite; prediction exceptions are propagated.
+        """
+        prices = handler.batch_price_predict([sample_data() for _ in range(WARMUP_ROWS)])
+        prices.append(handler.price_predict(sample_data()))
+        if not np.all(np.isfinite(prices)):
+            raise ValueError("Warmup predictions are not finite")
+
+    def status(self) -> dict:
+        """
+        Returns the active and previous model versions.
+
+        Returns:
+            dict: Dictionary with the active model version, the previous version and the engine.
+        """
+        return {
+            "model_version": self.handler.model_version,
+            "previous_version": self.previous['model_version'] if self.previous is not None else None,
+            "engine": self.handler.engine,
+        }
+
+    def start(self):
+        """Starts the model file watcher if a polling interval is set."""
+        if self.watch_interval <= 0 or self._thread is not None:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='model-watcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the model file watcher."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        """Watcher loop reloading the model when its file changes, stopped by `stop`."""
+        while not self._stopped.wait(self.watch_interval):
+            mtime = _modification_time(self.model_path)
+            if mtime is not None and mtime != self._mtime:
+                self._mtime = mtime
+                self.reload()
+
+    def _swap(self, state: dict) -> dict:
+        """
+        Replaces the model attributes of the handler in a single update.
+
+        Args:
+            state (dict): Model attributes to set, by name.
+
+        Returns:
+            dict: Replaced model attributes, by name.
+        """
+        previous = {name: getattr(self.handler, name, None) for name in MODEL_STATE}
+        self.handler.__dict__.update(state)
+        # Align the instrumentation of the swapped-in model with the handler setting
+        self.handler.set_stage_metrics(self.handler.stage_metrics)
+        if previous['model_version'] is not None:
+            MODEL_VERSION.labels(version=previous['model_version']).set(0)
+        MODEL_VERSION.labels(version=state['model_version']).set(1)
+        return previous
+
+def _modification_time(path: str):
+    """
+    Returns the modification time of a file.
+
+    Args:
+        path (str): Path to the file.
+
+    Returns:
+        float: Modification time, or None if the file does not exist.
+    """
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
@@ -0,0 +1,166 @@
+"""
+services/app/prediction_cache.py
+
+This module provides a bounded in-process cache of price predictions.
+
+1. Keys predictions by the loaded model version and a canonical form of the REQUIRED_PARAMS
+   values, so equal flats hit the cache regardless of key order or int/float spelling,
+   and a model swap invalidates old entries.
+2. Evicts entries by LRU order, by TTL, and when the entry count or the estimated
+   memory use exceeds its limit.
+3. Counts hits, misses and evictions with Prometheus metrics, exposed on /metrics.
+
+Key Components:
+- PREDICTION_CACHE: Flag enabling the cache in the handler (environment variable).
+- CACHE_MAX_ENTRIES, CACHE_MAX_BYTES, CACHE_TTL: Cache limits.
+- PredictionCache: Class implementing the LRU/TTL cache.
+"""
+
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from prometheus_client import Counter, Gauge
+
+# Prediction cache settings
+PREDICTION_CACHE = os.getenv('PREDICTION_CACHE', '1') == '1'
+CACHE_MAX_ENTRIES = int(os.getenv('PREDICTION_CACHE_MAX_ENTRIES', 100000))
+CACHE_MAX_BYTES = int(os.getenv('PREDICTION_CACHE_MAX_BYTES', 64 * 2**20))
+CACHE_TTL = float(os.getenv('PREDICTION_CACHE_TTL', 3600))
+
+# Define Prometheus metrics for the prediction cache
+CACHE_HITS = Counter('prediction_cache_hits', 'Number of predictions served from the cache')
+CACHE_MISSES = Counter('prediction_cache_misses', 'Number of predictions missing in the cache')
+CACHE_EVICTIONS = Counter('prediction_cache_evictions', 'Number of evicted cache entries', ['reason'])
+CACHE_SIZE = Gauge('prediction_cache_entries', 'Number of entries in the prediction cache',
+                   multiprocess_mode='livesum')
+
+class PredictionCache:
+    """
+    Thread-safe LRU cache of predictions with TTL expiry and memory bound.
+    """
+    def __init__(self, params: list, max_entries: int = CACHE_MAX_ENTRIES,
+                 max_bytes: int = CACHE_MAX_BYTES, ttl: float = CACHE_TTL):
+        """
+        Initializes the cache.
+
+        Args:
+            params (list): Names of the model parameters forming the key, in canonical order.
+            max_entries (int): Maximum number of entries.
+            max_bytes (int): Maximum estimated memory use of the entries, in bytes.
+            ttl (float): Time to live of an entry, in seconds.
+        """
+        self.params = params
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def key(self, model_version: str, model_params: dict):
+        """
+        Builds the canonical cache key of a request.
+
+        Args:
+            model_version (str): Version (hash) of the loaded model.
+            model_params (dict): Dictionary of model parameters.
+
+        Returns:
+            tuple: Cache key, or None if the parameters are not numeric and cannot be cached.
+        """
+        try:
+            return (model_version,) + tuple(float(model_params[param]) for param in self.params)
+        except (TypeError, ValueError, KeyError):
+            return None
+
+    def row_key(self, model_version: str, row: tuple) -> tuple:
+        """
+        Builds the canonical cache key of a validated row, equal to the key of the same flat
+        sent as a dictionary.
+
+        Args:
+            model_version (str): Version (hash) of the loaded model.
+            row (tuple): Numeric parameter values in the order of `params`.
+
+        Returns:
+            tuple: Cache key.
+        """
+        return (model_version,) + tuple(map(float, row))
+
+    def get(self, key: tuple):
+        """
+        Returns the cached prediction for a key and marks it as recently used.
+
+        Args:
+            key (tuple): Cache key.
+
+        Returns:
+            float: Cached prediction, or None on a miss.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] < time.monotonic():
+                self._remove(key, 'ttl')
+                entry = None
+            if entry is None:
+                CACHE_MISSES.inc()
+                return None
+            self._entries.move_to_end(key)
+        CACHE_HITS.inc()
+        return entry[0]
+
+    def put(self, key: tuple, value: float):
+        """
+        Stores a prediction, evicting the least recently used entries over the limits.
+
+        Args:
+            key (tuple): Cache key.
+            value (float): Prediction.
+        """
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, time.monotonic() + self.ttl, _entry_size(key, value))
+            self._bytes += self._entries[key][2]
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)), 'lru')
+            CACHE_SIZE.set(len(self._entries))
+
+    def clear(self):
+        """Removes all entries."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            CACHE_SIZE.set(0)
+
+    def __len__(self) -> int:
+        """Returns the number of entries."""
+        return len(self._entries)
+
+    def _remove(self, key: tuple, reason: str = None):
+        """
+        Removes an entry; the caller holds the lock.
+
+        Args:
+            key (tuple): Cache key.
+            reason (str): Eviction reason label, None if the entry is being replaced.
+        """
+        self._bytes -= self._entries.pop(key)[2]
+        if reason is not None:
+            CACHE_EVICTIONS.labels(reason=reason).inc()
+        CACHE_SIZE.set(len(self._entries))
+
+def _entry_size(key: tuple, value: float) -> int:
+    """
+    Estimates the memory used by a cache entry.
+
+    Args:
+        key (tuple): Cache key.
+        value (float): Prediction.
+
+    Returns:
+        int: Estimated size in bytes.
+    """
+    return sys.getsizeof(key) + sum(sys.getsizeof(item) for item in key) + sys.getsizeof(value)
@@ -0,0 +1,127 @@
+"""
+services/app/scaling_benchmark.py
+
+This script measures how the throughput of the service scales with the number of Gunicorn workers.
+
+1. Starts the application with `gunicorn.conf.py` for each worker count, with the prediction
+   cache disabled so that every request reaches the model.
+2. Saturates it with the open-loop load generator (`load_test.py`) at an arrival rate above
+   its capacity, so the completed requests per second measure the capacity.
+3. Reports throughput, speedup over one worker and latency percentiles for each worker count.
+
+Key Components:
+- GUNICORN_CONFIG: Path of the Gunicorn configuration.
+- start_server: Function starting the service with a given number of workers.
+- run_scaling_benchmark: Function running the load test for each worker count.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import tempfile
+import time
+import httpx
+from services.app.load_test import run_load_test
+
+# Path of the Gunicorn configuration
+GUNICORN_CONFIG = os.path.join(os.path.dirname(__file__), 'gunicorn.conf.py')
+
+def start_server(app_module: str, workers: int, port: int, startup_timeout: float = 120) -> subprocess.Popen:
+    """
+    Starts the service with Gunicorn and waits until it answers.
+
+    Args:
+        app_module (str): Application to serve, as 'module:attribute'.
+        workers (int): Number of worker processes.
+        port (int): Local port to bind.
+        startup_timeout (float): Maximum time to wait for the service, in seconds.
+
+    Returns:
+        subprocess.Popen: Gunicorn master process.
+
+    Raises:
+        RuntimeError: If the service does not answer within the timeout.
+    """
+    env = dict(
+        os.environ,
+        WEB_CONCURRENCY=str(workers),
+        PREDICTION_CACHE='0',
+        PROMETHEUS_MULTIPROC_DIR=tempfile.mkdtemp(prefix='prometheus_multiproc_'),
+    )
+    server = subprocess.Popen(
+        ['gunicorn', '--config', GUNICORN_CONFIG, '--bind', f"127.0.0.1:{port}", app_module],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    deadline = time.monotonic() + startup_timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/").status_code == 200:
+                return server
+        except httpx.HTTPError:
+            time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError(f"Service with {workers} workers did not start in {startup_timeout} s")
+
+async def _load(port: int, **load_params) -> dict:
+    """Runs the load test against the local service."""
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}",
+                                 limits=httpx.Limits(max_connections=None)) as client:
+        return await run_load_test(client, **load_params)
+
+def run_scaling_benchmark(worker_counts: list, app_module: str = 'services.app.app:app',
+                          port: int = 8010, **load_params) -> list:
+    """
+    Runs the load test against the service for each worker count.
+
+    Args:
+        worker_counts (list): Numbers of worker processes to measure.
+        app_module (str): Application to serve, as 'module:attribute'.
+        port (int): Local port to bind.
+        **load_params: Parameters of `run_load_test` (endpoint, rate, duration, ...).
+
+    Returns:
+        list: Load test summary of each worker count, with the worker count and the speedup.
+    """
+    results = []
+    for workers in worker_counts:
+        server = start_server(app_module, workers, port)
+        try:
+            summary = asyncio.run(_load(port, **load_params))['summary']
+        finally:
+            server.terminate()
+            server.wait()
+        summary['workers'] = workers
+        summary['speedup'] = summary['throughput_rps'] / results[0]['throughput_rps'] if results else 1.0
+        results.append(summary)
+    return results
+
+if __name__ == "__main__":
+    cores = len(os.sched_getaffinity(0))
+    parser = argparse.ArgumentParser(description="Throughput scaling of the service with Gunicorn workers")
+    parser.add_argument('--workers', type=int, nargs='+',
+                        default=sorted({1, 2, 4, cores} & set(range(1, cores + 1))))
+    parser.add_argument('--app', default='services.app.app:app', help="application to serve")
+    parser.add_argument('--port', type=int, default=8010)
+    parser.add_argument('--endpoint', choices=['predict', 'predict_batch'], default='predict')
+    parser.add_argument('--rate', type=float, default=1000, help="arrival rate above the capacity, requests per second")
+    parser.add_argument('--duration', type=float, default=20, help="duration of each run, seconds")
+    parser.add_argument('--concurrency', type=int, default=64, help="maximum in-flight requests")
+    parser.add_argument('--output', help="path of the JSON report")
+    args = parser.parse_args()
+
+    results = run_scaling_benchmark(
+        args.workers, app_module=args.app, port=args.port, endpoint=args.endpoint,
+        rate=args.rate, duration=args.duration, concurrency=args.concurrency
+    )
+    print(f"{cores} cores available")
+    print(f"{'workers':>8} {'req/s':>10} {'speedup':>8} {'p50 ms':>10} {'p99 ms':>10} {'errors':>8}")
+    for result in results:
+        latency = result.get('latency_ms', {})
+        print(f"{result['workers']:>8} {result['throughput_rps']:>10.1f} {result['speedup']:>8.2f} "
+              f"{latency.get('p50', 0):>10.1f} {latency.get('p99', 0):>10.1f} {result['errors']:>8}")
+    if args.output:
+        with open(args.output, 'w') as report_file:
+            json.dump(results, report_file, indent=2)
+        print(f"Report saved to {args.output}")
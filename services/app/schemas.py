@@ -0,0 +1,93 @@
+"""
+services/app/schemas.py
+
+This module defines the typed request and response schemas of the versioned "/v2" endpoints.
+
+1. Generates the request model of a flat from REQUIRED_PARAMS and PARAM_RANGES: each parameter
+   is a strict JSON number (integers where the model expects integers) within a plausible range,
+   and missing or excess parameters are rejected.
+2. Converts validated flats into rows of values in REQUIRED_PARAMS order, which the handler
+   scores as a float array without building intermediate dictionaries or DataFrames.
+3. Defines the response models of single and batch predictions.
+
+Invalid requests are rejected by FastAPI with status 422 and the location of each error,
+instead of the {"Error": ...} bodies of the untyped "/predict" endpoints.
+
+Key Components:
+- PARAM_RANGES: Type and inclusive range of each model parameter.
+- FlatParams: Request model of the parameters of one flat.
+- Prediction, BatchPrediction: Response models.
+- to_row, to_rows: Functions converting validated flats into rows in REQUIRED_PARAMS order.
+"""
+
+from operator import attrgetter
+from pydantic import BaseModel, ConfigDict, Field, create_model
+from services.app.fastapi_handler import REQUIRED_PARAMS
+
+# Type, minimum and maximum (None for no bound) of each model parameter
+PARAM_RANGES = {
+    'floor': (int, -5, 200),
+    'is_apartment': (int, 0, 1),
+    'kitchen_area': (float, 0, 1000),
+    'living_area': (float, 0, 5000),
+    'rooms': (int, 0, 50),
+    'total_area': (float, 0, 10000),
+    'building_id': (int, 0, None),
+    'build_year': (int, 1700, 2100),
+    'building_type_int': (int, 0, 10),
+    'latitude': (float, -90, 90),
+    'longitude': (float, -180, 180),
+    'ceiling_height': (float, 0, 100),
+    'flats_count': (int, 0, 100000),
+    'floors_total': (int, 1, 200),
+    'has_elevator': (int, 0, 1),
+}
+
+# Request model of one flat, generated from the parameter ranges
+FlatParams = create_model(
+    'FlatParams',
+    __config__=ConfigDict(extra='forbid', strict=True, allow_inf_nan=False),
+    **{
+        param: (PARAM_RANGES[param][0], Field(ge=PARAM_RANGES[param][1], le=PARAM_RANGES[param][2]))
+        for param in REQUIRED_PARAMS
+    }
+)
+
+class Prediction(BaseModel):
+    """
+    Response model of a single prediction.
+    """
+    score: float
+
+class BatchPrediction(BaseModel):
+    """
+    Response model of a batch prediction, with the scores in the order of the request rows.
+    """
+    scores: list[float]
+
+# Reads the parameter values of a flat in REQUIRED_PARAMS order
+_row_values = attrgetter(*REQUIRED_PARAMS)
+
+def to_row(flat: FlatParams) -> tuple:
+    """
+    Converts a validated flat into its parameter values in REQUIRED_PARAMS order.
+
+    Args:
+        flat (FlatParams): Validated parameters of a flat.
+
+    Returns:
+        tuple: Parameter values.
+    """
+    return _row_values(flat)
+
+def to_rows(flats: list) -> list:
+    """
+    Converts validated flats into rows of parameter values in REQUIRED_PARAMS order.
+
+    Args:
+        flats (list): List of validated FlatParams.
+
+    Returns:
+        list: Tuples of parameter values.
+    """
+    return [_row_values(flat) for flat in flats]
@@ -0,0 +1,211 @@
+"""
+services/app/stage_metrics.py
+
+This module provides optional per-stage latency instrumentation of the prediction path.
+
+1. Wraps each named step of the loaded sklearn `Pipeline` (nested pipelines are expanded),
+   or the whole model if it is not a pipeline, to record how long the step takes and how
+   many rows it handles.
+2. Times request validation and response serialization (with the standard JSON encoder,
+   or with orjson for the typed "/v2" endpoints).
+3. Is switched on and off at runtime by swapping the wrappers in and out, so that a
+   disabled instrumentation leaves the original objects in place and adds no overhead.
+
+sklearn is not imported by this module: a model can only be a pipeline if sklearn was
+already imported to load it.
+
+Key Components:
+- STAGE_METRICS: Flag enabling the instrumentation at startup (environment variable).
+- Custom Prometheus Histograms: serving_stage_duration_seconds, serving_stage_rows.
+- TimedStep: Class wrapping a pipeline step with timing.
+- instrument, uninstrument: Functions wrapping and unwrapping the steps of a model.
+- timed: Function wrapping a callable with timing.
+- StageMetricsResponse: JSON response class timing its serialization.
+- StageMetricsORJSONResponse: Response class serializing with orjson, timed the same way.
+"""
+
+import os
+import sys
+import time
+import orjson
+from fastapi.responses import JSONResponse
+from prometheus_client import Histogram
+
+# Flag enabling per-stage instrumentation at startup
+STAGE_METRICS = os.getenv('STAGE_METRICS', '0') == '1'
+
+# Define Prometheus Histograms for the stages of the prediction path
+STAGE_DURATION = Histogram(
+    'serving_stage_duration_seconds',
+    'Duration of a stage of the prediction path',
+    ['stage'],
+    buckets=[1e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1, 2.5]
+)
+STAGE_ROWS = Histogram(
+    'serving_stage_rows',
+    'Number of rows handled by a pipeline stage',
+    ['stage'],
+    buckets=[1, 2, 5, 10, 20, 50, 100, 200, 500, 1000]
+)
+
+class TimedStep:
+    """
+    Wraps a pipeline step (or a whole model), recording the duration and rows of its calls.
+
+    Other attributes are delegated to the wrapped step.
+    """
+    def __init__(self, step, stage: str):
+        """
+        Initializes the wrapper.
+
+        Args:
+            step: Fitted transformer or estimator.
+            stage (str): Stage label of the metrics.
+        """
+        self.step = step
+        self.stage = stage
+
+    def __getattr__(self, name: str):
+        """Delegates attributes missing in the wrapper to the wrapped step."""
+        return getattr(self.__dict__['step'], name)
+
+    def transform(self, X, **params):
+        """Transforms X with the wrapped step, recording the call."""
+        return self._observe(self.step.transform, X, **params)
+
+    def predict(self, X, **params):
+        """Predicts for X with the wrapped step, recording the call."""
+        return self._observe(self.step.predict, X, **params)
+
+    def _observe(self, method, X, **params):
+        """
+        Calls a method of the wrapped step and records its duration and rows.
+
+        Args:
+            method (callable): Method of the wrapped step.
+            X: Input rows.
+
+        Returns:
+            Result of the method.
+        """
+        start_time = time.perf_counter()
+        result = method(X, **params)
+        STAGE_DURATION.labels(stage=self.stage).observe(time.perf_counter() - start_time)
+        STAGE_ROWS.labels(stage=self.stage).observe(X.shape[0] if hasattr(X, 'shape') else len(X))
+        return result
+
+def instrument(model, stage: str = 'model'):
+    """
+    Wraps the steps of a pipeline in place, or the model itself if it is not a pipeline.
+
+    Steps are labeled by their names, joined with '/' for nested pipelines
+    (e.g. 'processor/feature_generator'). Already wrapped steps are left unchanged.
+
+    Args:
+        model: Fitted pipeline or estimator.
+        stage (str): Stage label of a model that is not a pipeline.
+
+    Returns:
+        The instrumented model (the same object for a pipeline).
+    """
+    if not _is_pipeline(model):
+        return model if isinstance(model, TimedStep) else TimedStep(model, stage)
+    _wrap_steps(model, '')
+    return model
+
+def uninstrument(model):
+    """
+    Removes the wrappers added by `instrument`.
+
+    Args:
+        model: Instrumented pipeline or estimator.
+
+    Returns:
+        The original model (the same object for a pipeline).
+    """
+    if isinstance(model, TimedStep):
+        return model.step
+    if _is_pipeline(model):
+        for i, (name, step) in enumerate(model.steps):
+            if isinstance(step, TimedStep):
+                model.steps[i] = (name, step.step)
+            else:
+                uninstrument(step)
+    return model
+
+def _is_pipeline(model) -> bool:
+    """
+    Checks whether a model is an sklearn Pipeline without importing sklearn.
+
+    Args:
+        model: Model or pipeline step.
+
+    Returns:
+        bool: True if the model is a Pipeline.
+    """
+    pipeline_module = sys.modules.get('sklearn.pipeline')
+    return pipeline_module is not None and isinstance(model, pipeline_module.Pipeline)
+
+def _wrap_steps(pipeline, prefix: str):
+    """
+    Wraps the steps of a pipeline and its nested pipelines.
+
+    Args:
+        pipeline (Pipeline): Fitted pipeline.
+        prefix (str): Stage label prefix of the steps.
+    """
+    for i, (name, step) in enumerate(pipeline.steps):
+        if _is_pipeline(step):
+            _wrap_steps(step, f"{prefix}{name}/")
+        elif step not in (None, 'passthrough') and not isinstance(step, TimedStep):
+            pipeline.steps[i] = (name, TimedStep(step, f"{prefix}{name}"))
+
+def timed(func, stage: str):
+    """
+    Wraps a callable, recording the duration of its calls.
+
+    Args:
+        func (callable): Function to time.
+        stage (str): Stage label of the metrics.
+
+    Returns:
+        callable: Wrapped function.
+    """
+    histogram = STAGE_DURATION.labels(stage=stage)
+    def wrapper(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start_time)
+    return wrapper
+
+class StageMetricsResponse(JSONResponse):
+    """
+    JSON response recording the duration of its serialization when `enabled` is set.
+    """
+    enabled = STAGE_METRICS
+
+    def render(self, content) -> bytes:
+        """Serializes the content, recording the duration if enabled."""
+        if not self.enabled:
+            return self.serialize(content)
+        start_time = time.perf_counter()
+        body = self.serialize(content)
+        STAGE_DURATION.labels(stage='serialization').observe(time.perf_counter() - start_time)
+        return body
+
+    def serialize(self, content) -> bytes:
+        """Serializes the content with the standard JSON encoder."""
+        return super().render(content)
+
+class StageMetricsORJSONResponse(StageMetricsResponse):
+    """
+    JSON response serialized with orjson, which also encodes NumPy values natively.
+
+    Content is rendered as is, without FastAPI's generic `jsonable_encoder` pass,
+    so endpoints return it directly.
+    """
+    def serialize(self, content) -> bytes:
+        """Serializes the content with orjson."""
+        return orjson.dumps(content, option=orjson.OPT_SERIALIZE_NUMPY)
@@ -0,0 +1,525 @@
+"""
+services/app/stream_stats.py
+
+This module keeps streaming statistics of the served predictions and their input features.
+
+1. Records the parameters and the predicted price of every served prediction into a
+   preallocated buffer (one row copy under a lock, no allocation that grows with traffic),
+   and folds full buffers into a quantile sketch with vectorized NumPy operations.
+2. The sketch is a KLL-style hierarchy of compactors over all columns at once: each level
+   holds at most SKETCH_SIZE values per column with a weight of 2**level, and an overflowing
+   level is sorted and every other value (from a random offset) is promoted to the next
+   level. Memory is bounded by SKETCH_LEVELS levels, and sketches merge by combining levels,
+   which combines the statistics of the Gunicorn workers.
+3. Keeps the statistics of a sliding window: a new sketch is started every STREAM_STATS_WINDOW
+   seconds and only the last STREAM_STATS_WINDOWS are kept, so the quantiles and the PSI follow
+   a shift of the input instead of being diluted by all the traffic since the start.
+4. Compares the sketched distributions with a reference profile saved at training time
+   (`build_profile`): the population stability index (PSI) of each feature and of the
+   predicted price over the reference decile bins.
+5. Publishes the quantiles and the PSI as Prometheus gauges from a background thread every
+   STREAM_STATS_INTERVAL seconds, so scraping /metrics does no sketch work. In multiprocess
+   mode every worker saves its sketch to PROMETHEUS_MULTIPROC_DIR and publishes the merge
+   of all workers' sketches; the file of an exited worker is removed by Gunicorn
+   (`remove_worker_sketch`), and files not updated for the whole window are skipped.
+
+Key Components:
+- STREAM_STATS: Flag enabling the streaming statistics in the handler (environment variable).
+- STREAM_STATS_INTERVAL: Publication interval of the gauges in seconds (environment variable).
+- STREAM_STATS_WINDOW, STREAM_STATS_WINDOWS: Duration in seconds of a sketch window and number
+  of windows kept (environment variables).
+- REFERENCE_PROFILE_PATH: Path of the reference profile, by default next to the model file
+  (environment variable).
+- SKETCH_SIZE, SKETCH_LEVELS, STREAM_STATS_BUFFER: Sketch and buffer sizes.
+- Custom Prometheus Gauges: prediction_distribution_quantile, prediction_distribution_psi,
+  prediction_distribution_rows.
+- QuantileSketch: Class of the mergeable quantile sketch of several columns.
+- StreamingStats: Class recording predictions and publishing their distribution and drift.
+- build_profile, save_profile, load_profile: Functions of the reference profile.
+- psi: Function computing the population stability index.
+- remove_worker_sketch: Function removing the saved sketch of an exited worker.
+"""
+
+import collections
+import glob
+import json
+import os
+import threading
+import time
+import numpy as np
+from prometheus_client import Gauge
+from services.app.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Streaming statistics settings
+STREAM_STATS = os.getenv('STREAM_STATS', '1') == '1'
+STREAM_STATS_INTERVAL = float(os.getenv('STREAM_STATS_INTERVAL', 15))
+REFERENCE_PROFILE_PATH = os.getenv('REFERENCE_PROFILE_PATH')
+
+# Duration of a sketch window in seconds and number of windows kept, so the statistics cover
+# the last STREAM_STATS_WINDOW * STREAM_STATS_WINDOWS seconds (an hour by default)
+STREAM_STATS_WINDOW = float(os.getenv('STREAM_STATS_WINDOW', 300))
+STREAM_STATS_WINDOWS = int(os.getenv('STREAM_STATS_WINDOWS', 12))
+
+# Values per column of a sketch level, maximum number of levels, and rows buffered before
+# they are folded into the sketch
+SKETCH_SIZE = 256
+SKETCH_LEVELS = 32
+STREAM_STATS_BUFFER = 1024
+
+# Name of the predicted price column, published quantiles and number of reference bins
+PREDICTION_COLUMN = 'price'
+QUANTILES = [0.05, 0.25, 0.5, 0.75, 0.95]
+PROFILE_BINS = 10
+
+# Smallest bin proportion in the PSI, so that empty bins do not make it infinite
+PSI_EPSILON = 1e-4
+
+# Define Prometheus Gauges for the distribution of the served predictions; every worker
+# publishes the merge of all workers' sketches
+QUANTILE = Gauge('prediction_distribution_quantile', 'Quantile of a feature or of the predicted price',
+                 ['variable', 'quantile'], multiprocess_mode='livemostrecent')
+DRIFT = Gauge('prediction_distribution_psi', 'Population stability index against the reference profile',
+              ['variable'], multiprocess_mode='livemostrecent')
+ROWS = Gauge('prediction_distribution_rows', 'Number of predictions in the sketch window',
+             multiprocess_mode='livemostrecent')
+
+class QuantileSketch:
+    """
+    Mergeable quantile sketch of several columns with bounded memory.
+
+    All columns receive the same number of values, so they share the level sizes and weights
+    and each level is one array, sorted column by column when it is compacted.
+    """
+    def __init__(self, n_columns: int, k: int = SKETCH_SIZE, max_levels: int = SKETCH_LEVELS, seed: int = None):
+        """
+        Initializes an empty sketch.
+
+        Args:
+            n_columns (int): Number of columns.
+            k (int): Maximum number of values per column of a level.
+            max_levels (int): Maximum number of levels; values beyond the top level's capacity
+                are dropped, which takes over k * 2**max_levels values.
+            seed (int): Seed of the compaction offsets.
+        """
+        self.n_columns = n_columns
+        self.k = k
+        self.max_levels = max_levels
+        self.count = 0
+        self.levels = [np.empty((0, n_columns))]
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values: np.ndarray):
+        """
+        Adds rows of values.
+
+        Args:
+            values (np.ndarray): Array of shape (rows, columns).
+        """
+        if not len(values):
+            return
+        self.count += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compact()
+
+    def merge(self, other: 'QuantileSketch'):
+        """
+        Adds the values of another sketch of the same columns.
+
+        Args:
+            other (QuantileSketch): Sketch to merge into this one.
+        """
+        for level, values in enumerate(other.levels):
+            if level == len(self.levels):
+                self.levels.append(np.empty((0, self.n_columns)))
+            self.levels[level] = np.concatenate([self.levels[level], values])
+        self.count += other.count
+        self._compact()
+
+    def _compact(self):
+        """Promotes every other sorted value of each overflowing level to the next level."""
+        for level in range(self.max_levels):
+            if level == len(self.levels):
+                break
+            values = self.levels[level]
+            if len(values) <= self.k:
+                continue
+            values = np.sort(values, axis=0)
+            # An odd value out stays on its level
+            even = len(values) - len(values) % 2
+            if level + 1 < self.max_levels:
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty((0, self.n_columns)))
+                promoted = values[self._rng.integers(2):even:2]
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            self.levels[level] = values[even:]
+
+    def _sorted(self) -> tuple:
+        """Returns the values sorted per column, their cumulative weights and the total weight."""
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level_values), 2.0 ** level)
+                                  for level, level_values in enumerate(self.levels)])
+        order = np.argsort(values, axis=0)
+        return np.take_along_axis(values, order, axis=0), np.cumsum(weights[order], axis=0), weights.sum()
+
+    def quantiles(self, qs: list) -> np.ndarray:
+        """
+        Estimates quantiles of each column.
+
+        Args:
+            qs (list): Quantiles between 0 and 1.
+
+        Returns:
+            np.ndarray: Array of shape (quantiles, columns), NaN if the sketch is empty.
+        """
+        result = np.full((len(qs), self.n_columns), np.nan)
+        if not self.count:
+            return result
+        values, cumulative, total = self._sorted()
+        for column in range(self.n_columns):
+            index = np.searchsorted(cumulative[:, column], np.asarray(qs) * total, side='left')
+            result[:, column] = values[np.minimum(index, len(values) - 1), column]
+        return result
+
+    def fraction_below(self, column: int, edges: list, sorted_values: tuple = None) -> np.ndarray:
+        """
+        Estimates the fraction of the values of a column below each edge.
+
+        Args:
+            column (int): Column index.
+            edges (list): Increasing edges.
+            sorted_values (tuple): Result of `_sorted`, to share it between columns.
+
+        Returns:
+            np.ndarray: Fraction of values strictly below each edge.
+        """
+        values, cumulative, total = sorted_values or self._sorted()
+        index = np.searchsorted(values[:, column], edges, side='left')
+        below = np.where(index > 0, cumulative[np.maximum(index - 1, 0), column], 0)
+        return below / total
+
+    def nbytes(self) -> int:
+        """Returns the memory used by the values of the sketch."""
+        return sum(level_values.nbytes for level_values in self.levels)
+
+    def state(self) -> dict:
+        """Returns the levels and count of the sketch, as arrays to save with `np.savez`."""
+        return {'count': np.array(self.count), **{f"level_{i}": values for i, values in enumerate(self.levels)}}
+
+    @classmethod
+    def from_state(cls, state, k: int = SKETCH_SIZE, max_levels: int = SKETCH_LEVELS) -> 'QuantileSketch':
+        """
+        Creates a sketch from the arrays of `state`.
+
+        Args:
+            state: Mapping of the arrays, e.g. loaded with `np.load`.
+            k (int): Maximum number of values per column of a level.
+            max_levels (int): Maximum number of levels.
+
+        Returns:
+            QuantileSketch: Sketch with the saved levels.
+        """
+        levels = [state[f"level_{i}"] for i in range(sum(name.startswith('level_') for name in state))]
+        sketch = cls(levels[0].shape[1], k, max_levels)
+        sketch.levels = levels
+        sketch.count = int(state['count'])
+        return sketch
+
+def psi(reference: np.ndarray, current: np.ndarray) -> float:
+    """
+    Computes the population stability index of two distributions over the same bins.
+
+    Args:
+        reference (np.ndarray): Reference proportion of each bin.
+        current (np.ndarray): Current proportion of each bin.
+
+    Returns:
+        float: PSI; below 0.1 is usually read as stable, above 0.25 as a significant shift.
+    """
+    reference = np.maximum(np.asarray(reference, dtype=float), PSI_EPSILON)
+    current = np.maximum(np.asarray(current, dtype=float), PSI_EPSILON)
+    return float(np.sum((current - reference) * np.log(current / reference)))
+
+def build_profile(X, predictions, bins: int = PROFILE_BINS) -> dict:
+    """
+    Builds the reference profile of training data: quantile bins and their proportions.
+
+    A value v falls into bin i when edges[i - 1] <= v < edges[i].
+
+    Args:
+        X (pd.DataFrame): Features of the training data.
+        predictions (np.ndarray): Predicted prices of the rows of X.
+        bins (int): Number of quantile bins; features with few distinct values get fewer.
+
+    Returns:
+        dict: Edges and proportions of the bins of each feature and of PREDICTION_COLUMN.
+    """
+    columns = {name: np.asarray(X[name], dtype=float) for name in X.columns}
+    columns[PREDICTION_COLUMN] = np.asarray(predictions, dtype=float)
+    profile = {'rows': len(X), 'created_at': time.time(), 'columns': {}}
+    for name, values in columns.items():
+        edges = np.unique(np.quantile(values, np.linspace(0, 1, bins + 1)[1:-1]))
+        counts = np.bincount(np.searchsorted(edges, values, side='right'), minlength=len(edges) + 1)
+        profile['columns'][name] = {'edges': edges.tolist(), 'proportions': (counts / len(values)).tolist()}
+    return profile
+
+def save_profile(profile: dict, path: str):
+    """
+    Saves a reference profile as JSON, written aside and renamed.
+
+    Args:
+        profile (dict): Reference profile.
+        path (str): Path of the profile file.
+    """
+    with open(f"{path}.tmp", 'w') as profile_file:
+        json.dump(profile, profile_file, indent=2)
+    os.replace(f"{path}.tmp", path)
+
+def load_profile(path: str) -> dict:
+    """
+    Loads a reference profile.
+
+    Args:
+        path (str): Path of the profile file.
+
+    Returns:
+        dict: Reference profile, None if the file does not exist.
+    """
+    if not os.path.exists(path):
+        return None
+    with open(path) as profile_file:
+        return json.load(profile_file)
+
+def _worker_sketch_path(multiproc_dir: str, pid: int) -> str:
+    """Returns the path of the saved sketch of a worker."""
+    return os.path.join(multiproc_dir, f"stream_stats_{pid}.npz")
+
+def remove_worker_sketch(pid: int):
+    """
+    Removes the saved sketch of an exited worker, so it is not merged any more.
+
+    Args:
+        pid (int): Process id of the worker.
+    """
+    multiproc_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if not multiproc_dir:
+        return
+    try:
+        os.remove(_worker_sketch_path(multiproc_dir, pid))
+    except FileNotFoundError:
+        pass
+
+class StreamingStats:
+    """
+    Records served predictions and publishes the quantiles and drift of their distribution
+    over a sliding window of sketches.
+    """
+    def __init__(self, features: list, profile_path: str = None, interval: float = STREAM_STATS_INTERVAL,
+                 buffer_size: int = STREAM_STATS_BUFFER, k: int = SKETCH_SIZE,
+                 window: float = STREAM_STATS_WINDOW, windows: int = STREAM_STATS_WINDOWS):
+        """
+        Initializes empty statistics.
+
+        Args:
+            features (list): Names of the features, in the order of the recorded rows.
+            profile_path (str): Path of the reference profile, None to skip the drift scores;
+                the profile is loaded again when the file changes.
+            interval (float): Publication interval of the gauges in seconds.
+            buffer_size (int): Number of rows buffered before they are folded into the sketch.
+            k (int): Maximum number of values per column of a sketch level.
+            window (float): Duration of a sketch window in seconds.
+            windows (int): Number of windows kept, including the current one.
+        """
+        self.features = list(features)
+        self.columns = self.features + [PREDICTION_COLUMN]
+        self.profile_path = profile_path
+        self.interval = interval
+        self.window = window
+        self.windows = windows
+        self.sketch = QuantileSketch(len(self.columns), k)
+        self._previous = collections.deque(maxlen=windows - 1)
+        self._window_start = time.monotonic()
+        self._buffer = np.empty((buffer_size, len(self.columns)))
+        self._size = 0
+        self._lock = threading.Lock()
+        self._profile = None
+        self._profile_mtime = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def record(self, params, price: float):
+        """
+        Records one prediction; non-numeric parameters are skipped.
+
+        Args:
+            params: Dictionary of model parameters, or their values in feature order.
+            price (float): Predicted price.
+        """
+        values = [params[name] for name in self.features] if isinstance(params, dict) else params
+        with self._lock:
+            row = self._buffer[self._size]
+            try:
+                row[:-1] = values
+            except (TypeError, ValueError):
+                return
+            row[-1] = price
+            self._size += 1
+            if self._size == len(self._buffer):
+                self._flush()
+
+    def record_many(self, rows, prices: list):
+        """
+        Records a batch of predictions.
+
+        Args:
+            rows: List of dictionaries of model parameters, list of value tuples in feature
+                order, or a DataFrame with the feature columns.
+            prices (list): Predicted prices of the rows.
+        """
+        if not len(rows):
+            return
+        if hasattr(rows, 'columns'):
+            values = rows[self.features].to_numpy(dtype=float)
+        elif isinstance(rows[0], dict):
+            values = np.array([[row[name] for name in self.features] for row in rows], dtype=float)
+        else:
+            values = np.asarray(rows, dtype=float)
+        with self._lock:
+            self._flush()
+            self.sketch.update(np.column_stack([values, prices]))
+
+    def _rotate(self):
+        """Starts a new sketch window when the current one is over; called with the lock held."""
+        elapsed = int((time.monotonic() - self._window_start) // self.window)
+        if not elapsed:
+            return
+        self._previous.append(self.sketch)
+        # Windows without any prediction are kept empty, so older windows still expire
+        for _ in range(min(elapsed, self.windows) - 1):
+            self._previous.append(QuantileSketch(self.sketch.n_columns, self.sketch.k, self.sketch.max_levels))
+        self.sketch = QuantileSketch(self.sketch.n_columns, self.sketch.k, self.sketch.max_levels)
+        self._window_start += elapsed * self.window
+
+    def _flush(self):
+        """Folds the buffered rows into the sketch of the current window; called with the lock held."""
+        self._rotate()
+        if self._size:
+            self.sketch.update(self._buffer[:self._size].copy())
+            self._size = 0
+
+    def snapshot(self) -> QuantileSketch:
+        """
+        Returns the merge of the sketches of the kept windows, including the buffered rows.
+
+        Returns:
+            QuantileSketch: Merged copy of the window sketches.
+        """
+        with self._lock:
+            self._flush()
+            snapshot = QuantileSketch(self.sketch.n_columns, self.sketch.k, self.sketch.max_levels)
+            for sketch in [*self._previous, self.sketch]:
+                snapshot.merge(sketch)
+        return snapshot
+
+    def profile(self) -> dict:
+        """Returns the reference profile, loading it again if its file changed."""
+        if self.profile_path is None or not os.path.exists(self.profile_path):
+            self._profile = None
+            return None
+        mtime = os.path.getmtime(self.profile_path)
+        if mtime != self._profile_mtime:
+            self._profile = load_profile(self.profile_path)
+            self._profile_mtime = mtime
+        return self._profile
+
+    def drift(self, sketch: QuantileSketch = None) -> dict:
+        """
+        Computes the PSI of each column against the reference profile.
+
+        Args:
+            sketch (QuantileSketch): Sketch to compare, by default a snapshot of the statistics.
+
+        Returns:
+            dict: PSI by column, empty without a profile or recorded predictions.
+        """
+        sketch = sketch or self.snapshot()
+        profile = self.profile()
+        if profile is None or not sketch.count:
+            return {}
+        sorted_values = sketch._sorted()
+        scores = {}
+        for column, name in enumerate(self.columns):
+            if name not in profile['columns']:
+                continue
+            reference = profile['columns'][name]
+            below = sketch.fraction_below(column, reference['edges'], sorted_values)
+            current = np.diff(np.concatenate([[0.0], below, [1.0]]))
+            scores[name] = psi(reference['proportions'], current)
+        return scores
+
+    def merged(self) -> QuantileSketch:
+        """
+        Returns the sketch merged with the sketches of the other workers in multiprocess mode.
+
+        The sketch of this worker is saved to PROMETHEUS_MULTIPROC_DIR first. Files not updated
+        for the whole window are left out: they belong to workers that exited without being
+        cleaned up, and none of their predictions are in the window any more.
+
+        Returns:
+            QuantileSketch: Merged sketch, or a snapshot of this worker's sketch.
+        """
+        sketch = self.snapshot()
+        multiproc_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+        if not multiproc_dir:
+            return sketch
+        path = _worker_sketch_path(multiproc_dir, os.getpid())
+        with open(f"{path}.tmp", 'wb') as state_file:
+            np.savez(state_file, **sketch.state())
+        os.replace(f"{path}.tmp", path)
+        merged = QuantileSketch(sketch.n_columns, sketch.k, sketch.max_levels)
+        expired = time.time() - self.window * self.windows
+        for worker_path in glob.glob(os.path.join(multiproc_dir, 'stream_stats_*.npz')):
+            try:
+                if os.path.getmtime(worker_path) < expired:
+                    continue
+                with np.load(worker_path) as state:
+                    merged.merge(QuantileSketch.from_state(state, sketch.k, sketch.max_levels))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Cannot read sketch {worker_path}: {e}")
+        return merged
+
+    def publish(self):
+        """Updates the quantile, drift and row gauges from the (merged) sketch."""
+        sketch = self.merged()
+        ROWS.set(sketch.count)
+        if not sketch.count:
+            return
+        quantiles = sketch.quantiles(QUANTILES)
+        for column, name in enumerate(self.columns):
+            for q, value in zip(QUANTILES, quantiles[:, column]):
+                QUANTILE.labels(variable=name, quantile=str(q)).set(value)
+        for name, score in self.drift(sketch).items():
+            DRIFT.labels(variable=name).set(score)
+
+    def start(self):
+        """Starts the publication thread."""
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='stream-stats', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the publication thread and publishes once more."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.publish()
+
+    def _run(self):
+        """Publication loop, stopped by `stop`."""
+        while not self._stopped.wait(self.interval):
+            try:
+                self.publish()
+            except Exception as e:
+                logger.error(f"Cannot publish streaming statistics: {e}", extra={'error_type': type(e).__name__})
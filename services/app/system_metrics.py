@@ -0,0 +1,98 @@
+"""
+services/app/system_metrics.py
+
+This module samples system and process metrics in the background for Prometheus.
+
+1. Defines Prometheus Gauges for CPU, disk, memory and network usage of the host,
+   and for the resident memory, threads and open file descriptors of the serving process.
+2. Runs a daemon thread that updates the gauges at a configurable interval, so that
+   request handlers do not sample the system themselves; a failed sample is logged and
+   the next one is taken at the next interval.
+3. Combines the gauges of several worker processes in multiprocess mode: host metrics
+   take the maximum over the workers, process metrics are summed over live workers.
+
+Key Components:
+- SYSTEM_METRICS_INTERVAL: Sampling interval in seconds (environment variable).
+- Custom Prometheus Gauges: CPU_USAGE, DISK_USAGE, MEMORY_USAGE, NETWORK_USAGE,
+  PROCESS_RSS, PROCESS_THREADS, PROCESS_OPEN_FDS.
+- SystemMetricsSampler: Class running the background sampling thread.
+"""
+
+import os
+import threading
+import psutil
+from prometheus_client import Gauge
+from services.app.logger import get_logger
+
+logger = get_logger(__name__)
+
+# Sampling interval of system metrics, in seconds
+SYSTEM_METRICS_INTERVAL = float(os.getenv('SYSTEM_METRICS_INTERVAL', 5))
+
+# Define Prometheus Gauges for system metrics, sampled from the same host by every worker
+CPU_USAGE = Gauge('custom_cpu_usage_percent', 'CPU usage percent', multiprocess_mode='max')
+DISK_USAGE = Gauge('custom_disk_usage_percent', 'Disk usage percent', multiprocess_mode='max')
+MEMORY_USAGE = Gauge('custom_memory_usage_percent', 'Memory usage percent', multiprocess_mode='max')
+NETWORK_USAGE = Gauge('custom_network_usage_bytes_total', 'Network usage bytes', multiprocess_mode='max')
+
+# Define Prometheus Gauges for metrics of the serving processes, summed over live workers
+PROCESS_RSS = Gauge('custom_process_resident_memory_bytes', 'Resident memory of the serving process',
+                    multiprocess_mode='livesum')
+PROCESS_THREADS = Gauge('custom_process_threads', 'Number of threads of the serving process',
+                        multiprocess_mode='livesum')
+PROCESS_OPEN_FDS = Gauge('custom_process_open_fds', 'Number of open file descriptors of the serving process',
+                         multiprocess_mode='livesum')
+
+class SystemMetricsSampler:
+    """
+    Updates the system and process gauges from a background thread.
+    """
+    def __init__(self, interval: float = SYSTEM_METRICS_INTERVAL):
+        """
+        Initializes the sampler.
+
+        Args:
+            interval (float): Sampling interval in seconds.
+        """
+        self.interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+        self._process = None
+
+    def start(self):
+        """Takes a first sample and starts the sampling thread."""
+        self._process = psutil.Process()
+        # The first call only sets the reference point of the CPU usage
+        psutil.cpu_percent(interval=None)
+        self.sample()
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='system-metrics', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops the sampling thread."""
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def sample(self):
+        """Updates all gauges once without blocking."""
+        CPU_USAGE.set(psutil.cpu_percent(interval=None))
+        DISK_USAGE.set(psutil.disk_usage('/').percent)
+        MEMORY_USAGE.set(psutil.virtual_memory().percent)
+        net_io = psutil.net_io_counters()
+        NETWORK_USAGE.set(net_io.bytes_sent + net_io.bytes_recv)
+
+        with self._process.oneshot():
+            PROCESS_RSS.set(self._process.memory_info().rss)
+            PROCESS_THREADS.set(self._process.num_threads())
+            PROCESS_OPEN_FDS.set(self._process.num_fds())
+
+    def _run(self):
+        """Sampling loop, stopped by `stop`."""
+        while not self._stopped.wait(self.interval):
+            try:
+                self.sample()
+            except Exception as e:
+                logger.error(f"Cannot sample system metrics: {e}", extra={'error_type': type(e).__name__})
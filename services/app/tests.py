@@ -6,15 +6,106 @@ This module provides unit tests for the FastAPI application using the unittest f
 1. Tests the root endpoint for status check.
 2. Tests the prediction endpoint with empty data, random data, and various error scenarios.
 3. Tests the prediction endpoint with valid data.
+4. Tests the batch prediction endpoint with valid rows, invalid rows and an oversized batch.
+5. Tests micro-batching of concurrent single-flat requests.
+6. Tests parity of the compiled inference engine with the fitted pipeline.
+7. Tests the vectorized distance-to-center feature against geopy.
+8. Tests the model-versioned LRU/TTL prediction cache.
+9. Tests the background sampler of system metrics.
+10. Tests the structured logging of the handler, also in a forked process.
+11. Tests the open-loop load generator against the application in-process.
+12. Tests the micro-benchmark suite of the handler and pipeline stages.
+13. Tests the runtime-switchable per-stage latency instrumentation.
+14. Tests multi-worker serving with metrics combined across the worker processes.
+15. Tests the zero-downtime model swap with warmup and rollback.
+16. Tests the lean serving artifact and its NumPy tree evaluator.
+17. Tests the typed "/v2" prediction endpoints and their validation errors.
+18. Tests the streaming bulk scoring of files on a process pool.
+19. Tests the chunked, downcast training data loader and its local snapshot.
+20. Tests the training script with cached feature engineering stages.
+21. Tests incremental retraining from the watermark of the saved model and its fallbacks.
+22. Tests the cached, verified S3 model fetcher against a moto S3 stand-in.
+23. Tests the admission control and load shedding of the scoring endpoints.
+24. Tests the streaming quantile sketches of served predictions, their sliding window and their drift scores.
+25. Tests the memory-mapped building table and the completion of requests sent by building_id.
+26. Tests the Arrow IPC endpoint, its zero-copy reader and its client helper.
 
 Key Components:
 - TestOnline: Test case class for the FastAPI application.
+- TestMicroBatching: Test case class for request coalescing in the handler.
+- TestCompiledModel: Test case class for the compiled inference engine.
+- TestDistance: Test case class for the vectorized distance feature.
+- TestPredictionCache: Test case class for the prediction cache.
+- TestSystemMetrics: Test case class for the system metrics sampler.
+- TestLogging: Test case class for the structured logger.
+- TestLoadTest: Test case class for the load generator.
+- TestBenchmark: Test case class for the benchmark suite.
+- TestStageMetrics: Test case class for the per-stage latency instrumentation.
+- TestMultiWorker: Test case class for multi-worker serving with Gunicorn.
+- TestModelManager: Test case class for the model hot-swap.
+- TestModelArtifact: Test case class for the serving artifact.
+- TestTypedSchema: Test case class for the typed endpoints.
+- TestBulkScore: Test case class for the bulk scoring script.
+- TestDataLoader: Test case class for the training data loader.
+- TestTraining: Test case class for the training script.
+- TestIncrementalTraining: Test case class for incremental retraining.
+- TestModelFetcher: Test case class for the S3 model fetcher.
+- TestAdmission: Test case class for the admission control.
+- TestStreamStats: Test case class for the streaming prediction statistics.
+- TestBuildingStore: Test case class for the building table.
+- TestColumnar: Test case class for the columnar transport.
 """
 
+import asyncio
+import json
+import os
+import pickle
+import queue
+import signal
+import sqlite3
+import tempfile
+import logging
+import time
 import unittest
+import warnings
+from unittest import mock
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import numpy as np
+import pandas as pd
+from catboost import CatBoostRegressor
 from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
+from geopy.distance import geodesic
+from sklearn.preprocessing import scale
 from services.app.app import app
-from services.app.fastapi_handler import sample_data
+from services.app.compiled_model import compile_pipeline
+from services.app.fastapi_handler import FastApiHandler, MODEL_PATH, REQUIRED_PARAMS, sample_data, gen_random_data
+from services.app.prediction_cache import PredictionCache
+from services.app.system_metrics import SystemMetricsSampler
+from services.app import logger as service_logger
+from services.app import load_test
+from services.app import benchmark
+from services.app import stage_metrics
+from services.app.scaling_benchmark import start_server
+from services.app.model_manager import ModelManager
+from services.app.model_artifact import is_artifact, load_artifact, save_artifact
+from services.app import tree_ensemble
+from services.app.schemas import FlatParams, to_rows
+from services.app import bulk_score
+from services.app.admission import AdmissionController, Overloaded
+from services.app.building_store import (BUILDING_PARAMS, BuildingStore, build_building_table, load_building_store,
+                                         save_building_table)
+from services.app import columnar
+from services.app.stream_stats import QuantileSketch, StreamingStats, build_profile, remove_worker_sketch, save_profile
+from services.models import data_loader
+from services.models import model_fetcher
+from services.models.distance import MOSCOW_CENTER, DISTANCE_TOLERANCE_KM, distance_to_center
+from services.models.pipeline import AutoFeatWrapper, FeatureAdder, build_pipeline, synthetic_flats
+from services.models.create_model import continue_training, retrain, train_model
+
+# CatBoost parameter of the test fits, so that they do not write catboost_info/ to the working directory
+NO_TRAIN_FILES = {'allow_writing_files': False}
 
 class TestOnline(unittest.TestCase):
     """
@@ -78,6 +169,1471 @@ class TestOnline(unittest.TestCase):
             self.assertEqual(response.status_code, 200)
             self.assertEqual(response.json(), {'score': 16694033.207565399})
 
+    def test_predict_batch(self):
+        """Tests the batch prediction endpoint with valid and invalid rows."""
+        lack_data = self.test_data.copy()
+        del lack_data['floor']
+        format_data = self.test_data.copy()
+        format_data['floor'] = 'one'
+        batch = [self.test_data, gen_random_data(), lack_data, format_data]
+
+        with TestClient(app) as client:
+            response = client.post("/predict/batch", json=batch)
+            self.assertEqual(response.status_code, 200)
+            results = response.json()['results']
+            self.assertEqual(len(results), len(batch))
+            # Each flat gets the score it gets alone
+            for flat, result in zip(batch[:2], results):
+                self.assertAlmostEqual(result['score'], client.post("/predict", json=flat).json()['score'], delta=1e-6)
+            self.assertEqual(results[2], {'Error': 'Problem with parameters'})
+            self.assertEqual(results[3], {'Error': 'Invalid input data format or value'})
+
+            # Empty batch
+            response = client.post("/predict/batch", json=[])
+            self.assertEqual(response.json(), {'results': []})
+
+            # Batch over the size limit
+            batch = [self.test_data] * (app.handler.max_batch_size + 1)
+            response = client.post("/predict/batch", json=batch)
+            self.assertIn('Error', response.json())
+
+class TestMicroBatching(unittest.TestCase):
+    """
+    Unit test class for coalescing concurrent predictions into micro-batches.
+    """
+    def setUp(self):
+        """Sets up a handler with micro-batching and a wide collection window."""
+        self.handler = FastApiHandler(micro_batching=True)
+        self.handler.batcher.window = 0.05
+
+    def test_concurrent_requests(self):
+        """Tests that concurrent requests are coalesced and each caller gets its own result."""
+        batch_sizes = []
+        predict_batch = self.handler.batcher.predict_batch
+        self.handler.batcher.predict_batch = lambda rows: batch_sizes.append(len(rows)) or predict_batch(rows)
+
+        requests = [gen_random_data() for _ in range(8)]
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            responses = list(executor.map(self.handler.handle, requests))
+
+        self.assertLess(len(batch_sizes), len(requests))
+        self.assertEqual(sum(batch_sizes), len(requests))
+        for params, response in zip(requests, responses):
+            self.assertAlmostEqual(response['score'], self.handler.price_predict(params), delta=1e-6)
+
+    def test_batch_dependent_model(self):
+        """Tests that requests are not coalesced when the model scores depend on the batch."""
+        self.handler.row_independent = False
+        with mock.patch.object(self.handler.batcher, 'submit', side_effect=AssertionError("coalesced")):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                responses = list(executor.map(self.handler.handle, [gen_random_data() for _ in range(4)]))
+        for response in responses:
+            self.assertIsInstance(response['score'], float)
+
+    def test_error_isolation(self):
+        """Tests that an invalid row fails only its own request."""
+        error_data = sample_data()
+        error_data['floor'] = 'one'
+        requests = [sample_data(), error_data, gen_random_data()]
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            responses = list(executor.map(self.handler.handle, requests))
+
+        self.assertIsInstance(responses[0]['score'], float)
+        self.assertIn('Error', responses[1])
+        self.assertIsInstance(responses[2]['score'], float)
+
+class TestCompiledModel(unittest.TestCase):
+    """
+    Unit test class for the compiled inference engine.
+    """
+    @classmethod
+    def setUpClass(cls):
+        """Fits a small pipeline of the notebook structure on synthetic data."""
+        X, y = synthetic_flats(300)
+        pipeline = build_pipeline(k_features=3, regressor_params={'iterations': 50, 'depth': 4, **NO_TRAIN_FILES})
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            # Keep almost all generated features in the backward selector so that
+            # every kind of feature (one-hot, AutoFeat formula, polynomial) reaches the regressor
+            n_features = pipeline['processor'][:3].fit_transform(X, y).shape[1]
+            pipeline.set_params(processor__feature_union__sfs_backward__k_features=n_features - 2)
+            pipeline.fit(X, y)
+        cls.pipeline = pipeline
+        cls.X_test, _ = synthetic_flats(100, random_state=7)
+
+    def test_parity(self):
+        """Tests that the compiled engine matches the pipeline on sampled inputs."""
+        compiled = compile_pipeline(self.pipeline)
+        kinds = {feature['kind'] for feature in compiled.plan['features']}
+        self.assertLessEqual({'column', 'onehot', 'poly'}, kinds)
+
+        X_array = self.X_test[compiled.input_columns].to_numpy(dtype=float)
+        for rows in [slice(0, 1), slice(1, 8), slice(0, 100)]:
+            np.testing.assert_allclose(
+                compiled.predict(X_array[rows]),
+                self.pipeline.predict(self.X_test[rows]),
+                rtol=1e-6
+            )
+
+    def test_row_independence(self):
+        """Tests that the score of a flat does not depend on the other flats of the batch."""
+        compiled = compile_pipeline(self.pipeline)
+        self.assertTrue(compiled.row_independent)
+        X_array = self.X_test[compiled.input_columns].to_numpy(dtype=float)
+        batch_prices = self.pipeline.predict(self.X_test)
+        single_prices = [self.pipeline.predict(self.X_test.iloc[[i]])[0] for i in range(10)]
+        np.testing.assert_allclose(single_prices, batch_prices[:10], rtol=1e-9)
+        np.testing.assert_allclose(self.pipeline.predict(self.X_test.iloc[:5]), batch_prices[:5], rtol=1e-9)
+        np.testing.assert_allclose([compiled.predict(X_array[[i]])[0] for i in range(10)], batch_prices[:10],
+                                   rtol=1e-6)
+
+        # A pipeline fitted before the distance statistics were learned standardizes over the batch
+        legacy = pickle.loads(pickle.dumps(self.pipeline))
+        del legacy['processor']['preprocessor'].named_transformers_['add'].scaler_
+        self.assertFalse(compile_pipeline(legacy).row_independent)
+
+    def test_batch_scores(self):
+        """Tests that the batch endpoints of the handler give each flat its single-flat score."""
+        legacy = pickle.loads(pickle.dumps(self.pipeline))
+        del legacy['processor']['preprocessor'].named_transformers_['add'].scaler_
+        flats = self.X_test.iloc[:6].to_dict('records')
+        with tempfile.TemporaryDirectory() as model_dir:
+            for name, model in [('fitted', self.pipeline), ('legacy', legacy)]:
+                model_path = os.path.join(model_dir, f"{name}.pkl")
+                with open(model_path, 'wb') as model_file:
+                    pickle.dump(model, model_file)
+                for engine in ['pipeline', 'compiled']:
+                    with self.subTest(model=name, engine=engine):
+                        handler = FastApiHandler(micro_batching=False, prediction_cache=False, stream_stats=False,
+                                                 engine=engine, model_path=model_path)
+                        self.assertEqual(handler.row_independent, name == 'fitted')
+                        single = [handler.handle(flat)['score'] for flat in flats]
+                        batch = [result['score'] for result in handler.handle_batch(flats)['results']]
+                        rows = handler.handle_rows([tuple(flat[p] for p in REQUIRED_PARAMS) for flat in flats])
+                        X = self.X_test.iloc[:6][REQUIRED_PARAMS].to_numpy(dtype=float)
+                        np.testing.assert_allclose(batch, single, rtol=1e-9)
+                        np.testing.assert_allclose(rows['scores'], single, rtol=1e-9)
+                        np.testing.assert_allclose(handler.handle_array(X)['scores'], single, rtol=1e-9)
+
+    def test_distance_lookup(self):
+        """Tests that the compiled engine matches the pipeline with distances from the building table."""
+        compiled = compile_pipeline(self.pipeline)
+        X_test = self.X_test.copy()
+        store = BuildingStore(build_building_table(X_test))
+        # Flats of the same buildings in other places: the distance is computed for them
+        X_test.iloc[:10, X_test.columns.get_loc('latitude')] += 0.01
+        calls = []
+        compiled.distance_lookup = lambda *columns: calls.append(columns) or store.distance(*columns)
+
+        X_array = X_test[compiled.input_columns].to_numpy(dtype=float)
+        for rows in [slice(0, 1), slice(0, 100)]:
+            np.testing.assert_allclose(compiled.predict(X_array[rows]), self.pipeline.predict(X_test[rows]), rtol=1e-6)
+        self.assertEqual(len(calls), 2)
+
+        # A single row gets the features of the stored distance of its building, as in a batch
+        distance = compiled.plan['preprocessor_columns'].index('add__scale__distance')
+        self.assertTrue(any(feature.get('column') == distance or distance in list(feature.get('columns', []))
+                            for feature in compiled.plan['features']))
+        np.testing.assert_allclose(compiled.transform(X_array[[50]]), compiled.transform(X_array)[[50]], rtol=1e-9)
+
+    def test_engine_switch(self):
+        """Tests that the handler gives the same predictions with both engines."""
+        handler = FastApiHandler(engine='compiled')
+        self.assertEqual(handler.engine, 'compiled')
+        batch = [sample_data(), gen_random_data()]
+        compiled_prices = handler.batch_price_predict(batch)
+        compiled_price = handler.price_predict(sample_data())
+
+        handler.set_engine('pipeline')
+        self.assertIsNone(handler.compiled_model)
+        np.testing.assert_allclose(compiled_prices, handler.batch_price_predict(batch), rtol=1e-6)
+        np.testing.assert_allclose(compiled_price, handler.price_predict(sample_data()), rtol=1e-6)
+
+class TestDistance(unittest.TestCase):
+    """
+    Unit test class for the vectorized distance-to-center feature.
+    """
+    def setUp(self):
+        """Sets up random points around Moscow."""
+        rng = np.random.default_rng(0)
+        self.points = pd.DataFrame({
+            'latitude': rng.uniform(55.1, 56.4, 500),
+            'longitude': rng.uniform(36.8, 38.4, 500)
+        })
+        self.expected = np.array([
+            geodesic(MOSCOW_CENTER, (lat, lon)).km
+            for lat, lon in zip(self.points['latitude'], self.points['longitude'])
+        ])
+
+    def test_distance(self):
+        """Tests that vectorized distances match geopy within the stated tolerance."""
+        actual = distance_to_center(self.points['latitude'], self.points['longitude'])
+        np.testing.assert_allclose(actual, self.expected, rtol=0, atol=DISTANCE_TOLERANCE_KM)
+        self.assertEqual(distance_to_center([MOSCOW_CENTER[0]], [MOSCOW_CENTER[1]])[0], 0)
+
+    def test_feature_adder(self):
+        """Tests that the pipeline feature matches the scaled geopy distances."""
+        feature = FeatureAdder().fit_transform(self.points)
+        self.assertEqual(list(feature.columns), ['scale__distance'])
+        np.testing.assert_allclose(feature['scale__distance'], scale(self.expected), rtol=0, atol=1e-6)
+
+class TestPredictionCache(unittest.TestCase):
+    """
+    Unit test class for the prediction cache.
+    """
+    def setUp(self):
+        """Sets up a small cache."""
+        self.cache = PredictionCache(REQUIRED_PARAMS, max_entries=2, ttl=60)
+        self.test_data = sample_data()
+
+    def test_key(self):
+        """Tests that keys are canonical and depend on the model version."""
+        reordered = dict(reversed(list(self.test_data.items())))
+        reordered['floor'] = float(reordered['floor'])
+        self.assertEqual(self.cache.key('v1', self.test_data), self.cache.key('v1', reordered))
+        self.assertNotEqual(self.cache.key('v1', self.test_data), self.cache.key('v2', self.test_data))
+
+        error_data = self.test_data.copy()
+        error_data['floor'] = 'one'
+        self.assertIsNone(self.cache.key('v1', error_data))
+
+    def test_eviction(self):
+        """Tests LRU, TTL and memory-bound eviction."""
+        keys = [self.cache.key('v1', gen_random_data()) for _ in range(3)]
+        self.cache.put(keys[0], 1.0)
+        self.cache.put(keys[1], 2.0)
+        self.assertEqual(self.cache.get(keys[0]), 1.0)
+        self.cache.put(keys[2], 3.0)
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertEqual(len(self.cache), 2)
+
+        self.cache.ttl = 0
+        self.cache.put(keys[1], 2.0)
+        time.sleep(0.01)
+        self.assertIsNone(self.cache.get(keys[1]))
+
+        cache = PredictionCache(REQUIRED_PARAMS, max_bytes=1000)
+        for key in keys:
+            cache.put(key, 1.0)
+        self.assertLess(len(cache), len(keys))
+
+    def test_handler_cache(self):
+        """Tests that repeated requests are served from the cache."""
+        handler = FastApiHandler(prediction_cache=True)
+        calls = []
+        price_predict = handler.price_predict
+        handler.price_predict = lambda model_params: calls.append(model_params) or price_predict(model_params)
+
+        first = handler.handle(self.test_data)
+        second = handler.handle(dict(reversed(list(self.test_data.items()))))
+        self.assertEqual(first, second)
+        self.assertEqual(len(calls), 1)
+
+        handler.model_version = 'retrained'
+        handler.handle(self.test_data)
+        self.assertEqual(len(calls), 2)
+
+class TestSystemMetrics(unittest.TestCase):
+    """
+    Unit test class for the background sampler of system metrics.
+    """
+    def test_sampler(self):
+        """Tests that the sampler updates the gauges in the background."""
+        sampler = SystemMetricsSampler(interval=0.01)
+        sampler.start()
+        try:
+            self.assertGreater(REGISTRY.get_sample_value('custom_process_resident_memory_bytes'), 0)
+            self.assertGreater(REGISTRY.get_sample_value('custom_process_open_fds'), 0)
+            self.assertGreater(REGISTRY.get_sample_value('custom_network_usage_bytes_total'), 0)
+            self.assertTrue(sampler._thread.is_alive())
+
+            # Threads of the process include the sampler itself
+            time.sleep(0.05)
+            self.assertGreaterEqual(REGISTRY.get_sample_value('custom_process_threads'), 2)
+
+            # A failing sample is logged and does not stop the thread
+            with mock.patch('psutil.disk_usage', side_effect=OSError('disk is gone')), \
+                    self.assertLogs('services.app.system_metrics', 'ERROR'):
+                time.sleep(0.05)
+            self.assertTrue(sampler._thread.is_alive())
+        finally:
+            sampler.stop()
+        self.assertIsNone(sampler._thread)
+
+class TestLogging(unittest.TestCase):
+    """
+    Unit test class for the structured logging of the handler.
+    """
+    def test_json_format(self):
+        """Tests that records are formatted as JSON with their extra fields."""
+        record = logging.makeLogRecord({
+            'name': 'services.app.test', 'levelname': 'INFO', 'msg': 'Predicting', 'payload': {'floor': 1}
+        })
+        entry = json.loads(service_logger.JsonFormatter().format(record))
+        self.assertEqual(entry['message'], 'Predicting')
+        self.assertEqual(entry['payload'], {'floor': 1})
+
+    def test_error_log(self):
+        """Tests that prediction errors are logged completely with their type."""
+        error_data = sample_data()
+        error_data['floor'] = 'one'
+        handler = FastApiHandler(prediction_cache=False)
+        with self.assertLogs('services.app.fastapi_handler', level='ERROR') as logs:
+            handler.handle(error_data)
+        record = logs.records[0]
+        self.assertTrue(record.error_type)
+        self.assertIsNotNone(record.exc_info)
+
+    def test_traceback(self):
+        """Tests that a queued error record is written as JSON with its traceback in its own field."""
+        log_queue = queue.Queue(maxsize=1)
+        test_logger = logging.getLogger('tests.traceback')
+        test_logger.propagate = False
+        test_logger.addHandler(service_logger.RecordQueueHandler(log_queue))
+        try:
+            try:
+                raise ValueError("bad value")
+            except ValueError as e:
+                test_logger.error("Value Error: %s", e, exc_info=e, extra={'error_type': 'ValueError'})
+            # The queue is full: the record is dropped instead of blocking
+            dropped = REGISTRY.get_sample_value('log_records_dropped_total')
+            test_logger.error("Dropped")
+            self.assertEqual(REGISTRY.get_sample_value('log_records_dropped_total'), dropped + 1)
+        finally:
+            test_logger.handlers.clear()
+        entry = json.loads(service_logger.JsonFormatter().format(log_queue.get_nowait()))
+        self.assertEqual(entry['message'], "Value Error: bad value")
+        self.assertEqual(entry['error_type'], 'ValueError')
+        self.assertIn('raise ValueError("bad value")', entry['traceback'])
+
+    def test_fork(self):
+        """Tests that a forked process writes its records through a new queue and listener of its own."""
+        handler = next(handler for handler in logging.getLogger(service_logger.ROOT_LOGGER).handlers
+                       if isinstance(handler, service_logger.RecordQueueHandler))
+        parent_queue = handler.queue
+        read_fd, write_fd = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            exit_code = 1
+            try:
+                if handler.queue is not parent_queue and handler.queue.empty():
+                    pipe = os.fdopen(write_fd, 'w')
+                    service_logger._listener.handlers[0].setStream(pipe)
+                    service_logger.get_logger('tests.fork').info("Logged by the child")
+                    service_logger._listener.stop()
+                    pipe.flush()
+                    exit_code = 0
+            finally:
+                os._exit(exit_code)
+        os.close(write_fd)
+        with os.fdopen(read_fd) as pipe:
+            output = pipe.read()
+        _, status = os.waitpid(pid, 0)
+        self.assertEqual(os.waitstatus_to_exitcode(status), 0)
+        self.assertEqual(json.loads(output.strip().splitlines()[-1])['message'], "Logged by the child")
+        self.assertIs(handler.queue, parent_queue)
+
+    def test_payload_sampling(self):
+        """Tests that 1 in N payloads are logged."""
+        rate = service_logger.PAYLOAD_LOG_SAMPLE_RATE
+        try:
+            service_logger.PAYLOAD_LOG_SAMPLE_RATE = 4
+            self.assertEqual(sum(service_logger.sample_payload() for _ in range(40)), 10)
+            service_logger.PAYLOAD_LOG_SAMPLE_RATE = 0
+            self.assertFalse(any(service_logger.sample_payload() for _ in range(10)))
+        finally:
+            service_logger.PAYLOAD_LOG_SAMPLE_RATE = rate
+
+class TestLoadTest(unittest.TestCase):
+    """
+    Unit test class for the open-loop load generator.
+    """
+    def test_arrival_times(self):
+        """Tests that the send schedule follows the stepped arrival rate."""
+        schedule = list(load_test.arrival_times(rate=10, duration=2, step_rate=10, step_duration=1))
+        steps = [step for _, step in schedule]
+        self.assertEqual(steps.count(0), 10)
+        self.assertEqual(steps.count(1), 20)
+
+        for arguments in [dict(rate=0, duration=1), dict(rate=10, duration=3, step_rate=-5, step_duration=1),
+                          dict(rate=10, duration=-1)]:
+            with self.assertRaises(ValueError):
+                list(load_test.arrival_times(**arguments))
+        self.assertEqual(len(list(load_test.arrival_times(rate=10, duration=2, step_rate=-5, step_duration=1))), 15)
+
+    def test_run(self):
+        """Tests a short load test of the application in-process."""
+        async def run():
+            async with load_test.make_client(app_path='services.app.app:app') as http_client:
+                return await load_test.run_load_test(
+                    http_client, endpoint='predict_batch', rate=20, duration=0.5, batch_size=5
+                )
+        report = asyncio.run(run())
+        summary = report['summary']
+        self.assertEqual(summary['requests'], 10)
+        self.assertEqual(summary['errors'], 0)
+        latency = summary['latency_ms']
+        self.assertTrue(latency['p50'] <= latency['p95'] <= latency['p99'] <= latency['max'])
+
+        # The throughput of a shorter last step is divided by its own duration
+        async def run_steps():
+            async with load_test.make_client(app_path='services.app.app:app') as http_client:
+                return await load_test.run_load_test(
+                    http_client, endpoint='random', rate=20, duration=0.75, step_rate=20, step_duration=0.5
+                )
+        last = asyncio.run(run_steps())['steps'][-1]
+        self.assertEqual((last['step'], last['requests']), (1, 10))
+        self.assertAlmostEqual(last['throughput_rps'], 40)
+
+class TestBenchmark(unittest.TestCase):
+    """
+    Unit test class for the benchmark suite.
+    """
+    def test_pipeline_stages(self):
+        """Tests that nested pipeline steps are listed in order with their full names."""
+        names = [name for name, _ in benchmark.pipeline_stages(build_pipeline())]
+        self.assertEqual(names[0], 'processor/preprocessor')
+        self.assertEqual(names[-1], 'regressor')
+        self.assertEqual(len(names), 6)
+
+    def test_run(self):
+        """Tests a short benchmark run and the regression check against its own baseline."""
+        handler = FastApiHandler(micro_batching=False, prediction_cache=False)
+        results = benchmark.run_benchmarks(handler, batch_sizes=[1, 10], stage_rows=10, repeat=1)
+        self.assertIn('validate_params', results)
+        self.assertIn('batch_price_predict[10]', results)
+        self.assertTrue(any(name.startswith('stage[') for name in results))
+        self.assertEqual(results['dataframe[10]']['rows'], 10)
+
+        self.assertEqual(benchmark.find_regressions(results, results), [])
+        baseline = {name: dict(result, seconds_per_row=result['seconds_per_row'] / 2)
+                    for name, result in results.items()}
+        self.assertEqual(len(benchmark.find_regressions(results, baseline, threshold=0.5)), len(results))
+
+class TestStageMetrics(unittest.TestCase):
+    """
+    Unit test class for the per-stage latency instrumentation.
+    """
+    def stage_count(self, stage):
+        """Returns the number of recorded durations of a stage."""
+        value = REGISTRY.get_sample_value('serving_stage_duration_seconds_count', {'stage': stage})
+        return value or 0
+
+    def test_instrument_pipeline(self):
+        """Tests that nested pipeline steps are wrapped and restored in place."""
+        pipeline = build_pipeline()
+        steps = [step for _, step in pipeline['processor'].steps]
+        self.assertIs(stage_metrics.instrument(pipeline), pipeline)
+        self.assertEqual(
+            [step.stage for _, step in pipeline['processor'].steps][:2],
+            ['processor/preprocessor', 'processor/feature_generator']
+        )
+        self.assertEqual(pipeline.steps[-1][1].stage, 'regressor')
+
+        stage_metrics.uninstrument(pipeline)
+        self.assertEqual([step for _, step in pipeline['processor'].steps], steps)
+        self.assertNotIsInstance(pipeline.steps[-1][1], stage_metrics.TimedStep)
+
+    def test_handler_switch(self):
+        """Tests that the handler records stages only while the instrumentation is on."""
+        handler = FastApiHandler(micro_batching=False, prediction_cache=False, stage_metrics=True)
+        model_count, validation_count = self.stage_count('model'), self.stage_count('validation')
+        handler.handle(sample_data())
+        self.assertEqual(self.stage_count('model'), model_count + 1)
+        self.assertEqual(self.stage_count('validation'), validation_count + 1)
+
+        handler.set_stage_metrics(False)
+        self.assertNotIsInstance(handler.model, stage_metrics.TimedStep)
+        self.assertNotIn('validate_params', vars(handler))
+        handler.handle(sample_data())
+        self.assertEqual(self.stage_count('model'), model_count + 1)
+
+    def test_endpoint(self):
+        """Tests the admin-only runtime switch endpoint and the serialization timing."""
+        self.assertEqual(client.post("/stage_metrics", params={"enabled": True}).status_code, 403)
+        headers = {'Authorization': 'Bearer secret'}
+        with mock.patch('services.app.app.MODEL_ADMIN_TOKEN', 'secret'):
+            self.assertEqual(client.post("/stage_metrics", params={"enabled": True}).status_code, 401)
+            self.assertFalse(app.handler.stage_metrics)
+            response = client.post("/stage_metrics", params={"enabled": True}, headers=headers)
+            self.assertEqual(response.json(), {"stage_metrics": True})
+            try:
+                serialization_count = self.stage_count('serialization')
+                client.post("/predict", json=sample_data())
+                self.assertGreater(self.stage_count('serialization'), serialization_count)
+            finally:
+                client.post("/stage_metrics", params={"enabled": False}, headers=headers)
+        self.assertFalse(app.handler.stage_metrics)
+
+class TestMultiWorker(unittest.TestCase):
+    """
+    Unit test class for multi-worker serving with Gunicorn.
+    """
+    def test_combined_metrics(self):
+        """Tests that requests served by two workers are counted together on /metrics."""
+        port = 8011
+        server = start_server('services.app.app_stage_3:app', workers=2, port=port)
+        try:
+            with httpx.Client(base_url=f"http://127.0.0.1:{port}") as http_client:
+                for _ in range(20):
+                    self.assertIn('score', http_client.post("/predict", json=gen_random_data()).json())
+                metrics = http_client.get("/metrics").text
+        finally:
+            server.terminate()
+            server.wait()
+        requests = [line for line in metrics.splitlines()
+                    if line.startswith('http_requests_total{handler="/predict"')]
+        self.assertEqual(len(requests), 1)
+        self.assertEqual(float(requests[0].split()[-1]), 20)
+
+    def test_reload_all_workers(self):
+        """Tests that "/model/reload" replaces the model of every worker."""
+        port = 8012
+        model_dir = tempfile.TemporaryDirectory()
+        model_path = os.path.join(model_dir.name, 'model.pkl')
+        with open(MODEL_PATH, 'rb') as source, open(model_path, 'wb') as target:
+            target.write(source.read())
+        with mock.patch.dict(os.environ, {'MODEL_PATH': model_path, 'MODEL_ADMIN_TOKEN': 'secret'}):
+            server = start_server('services.app.app:app', workers=2, port=port)
+        try:
+            with httpx.Client(base_url=f"http://127.0.0.1:{port}", headers={'Connection': 'close'}) as http_client:
+                old_version = http_client.get("/model").json()['model_version']
+                X, y = synthetic_flats(200)
+                with open(model_path + '.tmp', 'wb') as model_file:
+                    pickle.dump(CatBoostRegressor(iterations=10, verbose=0, **NO_TRAIN_FILES).fit(X, y), model_file)
+                os.replace(model_path + '.tmp', model_path)
+                response = http_client.post("/model/reload", headers={'Authorization': 'Bearer secret'})
+                self.assertEqual(response.json()['status'], 'reloading')
+                self.assertIn('Error', http_client.post("/model/rollback",
+                                                        headers={'Authorization': 'Bearer secret'}).json())
+                versions = set()
+                for _ in range(120):
+                    time.sleep(0.5)
+                    try:
+                        versions = {http_client.get("/model").json()['model_version'] for _ in range(10)}
+                    except httpx.HTTPError:
+                        continue
+                    if old_version not in versions:
+                        break
+        finally:
+            server.terminate()
+            server.wait()
+            model_dir.cleanup()
+        self.assertEqual(len(versions), 1)
+        self.assertNotIn(old_version, versions)
+
+class TestModelManager(unittest.TestCase):
+    """
+    Unit test class for the model hot-swap.
+    """
+    @classmethod
+    def setUpClass(cls):
+        """Trains a small replacement model on synthetic data."""
+        X, y = synthetic_flats(200)
+        cls.new_model = CatBoostRegressor(iterations=20, verbose=0, **NO_TRAIN_FILES).fit(X, y)
+
+    def setUp(self):
+        """Creates a handler, a managed model file and a manager."""
+        self.handler = FastApiHandler(micro_batching=False)
+        self.model_dir = tempfile.TemporaryDirectory()
+        self.model_path = os.path.join(self.model_dir.name, 'model.pkl')
+        self.manager = ModelManager(self.handler, model_path=self.model_path, watch_interval=0.05)
+
+    def tearDown(self):
+        """Stops the watcher and removes the model file."""
+        self.manager.stop()
+        self.model_dir.cleanup()
+
+    def write_model(self, model_bytes: bytes):
+        """Replaces the managed model file atomically."""
+        with open(self.model_path + '.tmp', 'wb') as model_file:
+            model_file.write(model_bytes)
+        os.replace(self.model_path + '.tmp', self.model_path)
+
+    def version_gauge(self, version):
+        """Returns the value of the model version gauge."""
+        return REGISTRY.get_sample_value('model_version_info', {'version': version})
+
+    def test_reload_and_rollback(self):
+        """Tests that a new model is swapped in and rolled back."""
+        old_version, old_score = self.handler.model_version, self.handler.handle(sample_data())['score']
+        self.write_model(pickle.dumps(self.new_model))
+        status = self.manager.reload()
+        self.assertEqual(status['previous_version'], old_version)
+        self.assertNotEqual(self.handler.model_version, old_version)
+        self.assertEqual(self.version_gauge(self.handler.model_version), 1)
+        self.assertEqual(self.version_gauge(old_version), 0)
+        self.assertNotEqual(self.handler.handle(sample_data())['score'], old_score)
+
+        self.assertEqual(self.manager.rollback()['model_version'], old_version)
+        self.assertEqual(self.handler.handle(sample_data())['score'], old_score)
+
+    def test_failed_reload(self):
+        """Tests that a broken model file leaves the active model in place."""
+        old_version = self.handler.model_version
+        self.write_model(b'not a model')
+        self.assertIn('Error', self.manager.reload())
+        self.assertIn('Error', self.manager.rollback())
+        self.assertEqual(self.handler.model_version, old_version)
+        self.assertIn('score', self.handler.handle(sample_data()))
+
+    def test_admin_endpoints(self):
+        """Tests that the model mutations are disabled without a token and require it otherwise."""
+        with TestClient(app) as client:
+            self.assertEqual(client.post("/model/reload").status_code, 403)
+            with mock.patch('services.app.app.MODEL_ADMIN_TOKEN', 'secret'):
+                self.assertEqual(client.post("/model/reload").status_code, 401)
+                response = client.post("/model/rollback", headers={'Authorization': 'Bearer wrong'})
+                self.assertEqual(response.status_code, 401)
+                response = client.post("/model/reload", headers={'Authorization': 'Bearer secret'})
+                self.assertEqual(response.json(), {"model_version": app.handler.model_version, "status": "unchanged"})
+            self.assertEqual(client.get("/model").status_code, 200)
+
+    def test_reload_all(self):
+        """Tests that a worker asks the master to reload and cannot roll back on its own."""
+        signals = []
+        previous_handler = signal.signal(signal.SIGHUP, lambda signum, frame: signals.append(signum))
+        try:
+            self.manager.master_pid = os.getpid()
+            self.assertEqual(self.manager.reload_all()['status'], 'reloading')
+        finally:
+            signal.signal(signal.SIGHUP, previous_handler)
+        self.assertEqual(signals, [signal.SIGHUP])
+        self.assertIn('Error', self.manager.rollback())
+
+    def test_swap_while_serving(self):
+        """Tests that requests are served without errors while the watcher swaps the model."""
+        old_version = self.handler.model_version
+        self.write_model(pickle.dumps(self.new_model))
+        self.manager.start()
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            responses = list(executor.map(lambda _: self.handler.handle(gen_random_data()), range(200)))
+        self.assertTrue(all('score' in response for response in responses))
+        for _ in range(100):
+            if self.handler.model_version != old_version:
+                break
+            time.sleep(0.05)
+        self.assertNotEqual(self.handler.model_version, old_version)
+
+class TestModelArtifact(unittest.TestCase):
+    """
+    Unit test class for the serving artifact.
+    """
+    @classmethod
+    def setUpClass(cls):
+        """Writes the artifact of the bundled model."""
+        cls.handler = FastApiHandler(micro_batching=False, prediction_cache=False)
+        cls.model_dir = tempfile.TemporaryDirectory()
+        cls.artifact_path = os.path.join(cls.model_dir.name, 'model.artifact')
+        save_artifact(cls.handler.model, cls.artifact_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        """Removes the artifact."""
+        cls.model_dir.cleanup()
+
+    def test_round_trip(self):
+        """Tests that the artifact predicts like the pickled model, with NumPy and CatBoost trees."""
+        with open(self.artifact_path, 'rb') as artifact_file:
+            artifact_bytes = artifact_file.read()
+        self.assertTrue(is_artifact(artifact_bytes))
+        compiled = load_artifact(artifact_bytes)
+        self.assertIsInstance(compiled.plan['regressor'], tree_ensemble.ObliviousTreeEnsemble)
+
+        batch = [gen_random_data() for _ in range(tree_ensemble.NUMPY_MAX_ROWS + 8)]
+        expected = self.handler.batch_price_predict(batch)
+        X = np.array([[flat[column] for column in compiled.input_columns] for flat in batch], dtype=float)
+        # Small batches are evaluated with NumPy, large ones with the lazily loaded CatBoost model
+        np.testing.assert_allclose(compiled.predict(X[:5]), expected[:5], rtol=1e-9)
+        np.testing.assert_allclose(compiled.predict(X), expected, rtol=1e-9)
+
+    def test_missing_values(self):
+        """Tests that the NumPy evaluator treats missing values like CatBoost."""
+        X, y = synthetic_flats(200)
+        X = X.select_dtypes('number').astype(float)
+        X.iloc[::3, 0] = np.nan
+        model = CatBoostRegressor(iterations=30, depth=4, verbose=0, **NO_TRAIN_FILES).fit(X, y)
+        json_path = os.path.join(self.model_dir.name, 'model.json')
+        model.save_model(json_path, format='json')
+        with open(json_path) as json_file:
+            ensemble = tree_ensemble.from_catboost_json(json.load(json_file))
+        X_test = X.to_numpy()[:20]
+        X_test[::2, 1] = np.nan
+        np.testing.assert_allclose(ensemble.predict(X_test), model.predict(X_test), rtol=1e-9)
+
+    def test_handler_engine(self):
+        """Tests that a handler loading an artifact serves with the compiled engine."""
+        handler = FastApiHandler(micro_batching=False, prediction_cache=False, engine='pipeline')
+        self.assertTrue(handler.load_model(self.artifact_path))
+        self.assertEqual(handler.engine, 'compiled')
+        np.testing.assert_allclose(handler.price_predict(sample_data()),
+                                   self.handler.price_predict(sample_data()), rtol=1e-9)
+
+class TestTypedSchema(unittest.TestCase):
+    """
+    Unit test class for the typed "/v2" prediction endpoints.
+    """
+    def setUp(self):
+        """Sets up test data for the unit tests."""
+        self.test_data = sample_data()
+
+    def assert_rejected(self, data, param: str):
+        """Asserts that a request is rejected with status 422 at the given parameter."""
+        with TestClient(app) as client:
+            response = client.post("/v2/predict", json=data)
+        self.assertEqual(response.status_code, 422)
+        self.assertIn(['body', param], [error['loc'] for error in response.json()['detail']])
+
+    def test_predict(self):
+        """Tests that the typed endpoint predicts like the untyped one."""
+        with TestClient(app) as client:
+            response = client.post("/v2/predict", json=self.test_data)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), client.post("/predict", json=self.test_data).json())
+
+            # Integers are accepted for float parameters
+            float_data = dict(self.test_data, kitchen_area=7)
+            self.assertEqual(client.post("/v2/predict", json=float_data).json(), response.json())
+
+    def test_validation_errors(self):
+        """Tests that invalid parameters are rejected with the location of the error."""
+        self.assert_rejected(dict(self.test_data, floor='one'), 'floor')
+        self.assert_rejected(dict(self.test_data, floor=1.5), 'floor')
+        self.assert_rejected(dict(self.test_data, latitude=100.0), 'latitude')
+        self.assert_rejected(dict(self.test_data, has_elevator=2), 'has_elevator')
+        self.assert_rejected(dict(self.test_data, extra_data=42), 'extra_data')
+        missing_data = self.test_data.copy()
+        del missing_data['floor']
+        self.assert_rejected(missing_data, 'floor')
+
+    def test_predict_batch(self):
+        """Tests that the typed batch endpoint predicts like the untyped one and limits the batch size."""
+        batch = [self.test_data] + [gen_random_data() for _ in range(9)]
+        with TestClient(app) as client:
+            response = client.post("/v2/predict/batch", json=batch)
+            self.assertEqual(response.status_code, 200)
+            expected = [result['score'] for result in client.post("/predict/batch", json=batch).json()['results']]
+            np.testing.assert_allclose(response.json()['scores'], expected, rtol=1e-9)
+
+            self.assertEqual(client.post("/v2/predict/batch", json=[]).json(), {'scores': []})
+            response = client.post("/v2/predict/batch", json=[self.test_data] * (app.handler.max_batch_size + 1))
+            self.assertEqual(response.status_code, 422)
+            response = client.post("/v2/predict/batch", json=[self.test_data, dict(self.test_data, rooms='two')])
+            self.assertEqual(response.status_code, 422)
+            self.assertEqual(response.json()['detail'][0]['loc'], ['body', 1, 'rooms'])
+
+    def test_rows_with_both_engines(self):
+        """Tests that rows are scored like dictionaries with both inference engines."""
+        batch = [sample_data(), gen_random_data(), gen_random_data()]
+        rows = to_rows([FlatParams.model_validate(flat) for flat in batch])
+        handler = FastApiHandler(micro_batching=False, prediction_cache=False, engine='compiled')
+        for engine in ['compiled', 'pipeline']:
+            handler.set_engine(engine)
+            np.testing.assert_allclose(handler.rows_price_predict(rows), handler.batch_price_predict(batch), rtol=1e-9)
+            self.assertAlmostEqual(handler.handle_row(rows[0])['score'], handler.price_predict(batch[0]))
+
+class TestBulkScore(unittest.TestCase):
+    """
+    Unit test class for the bulk scoring script.
+    """
+    def setUp(self):
+        """Writes a file of flats with a few invalid rows."""
+        self.data_dir = tempfile.TemporaryDirectory()
+        self.flats = pd.DataFrame([gen_random_data() for _ in range(250)])
+        self.flats.insert(0, 'flat_id', range(1000, 1250))
+        self.flats = self.flats.astype({'floor': object})
+        self.flats.loc[3, 'floor'] = 'one'
+        self.flats.loc[70, 'rooms'] = None
+        self.flats.loc[200, 'latitude'] = 123.0
+        self.input_path = os.path.join(self.data_dir.name, 'flats.csv')
+        self.flats.to_csv(self.input_path, index=False)
+
+    def tearDown(self):
+        """Removes the files."""
+        self.data_dir.cleanup()
+
+    def test_bulk_score(self):
+        """Tests that every row is scored or rejected, in input order, like the service scores it alone."""
+        output_path = os.path.join(self.data_dir.name, 'scores.csv')
+        stats = bulk_score.bulk_score(self.input_path, output_path, id_column='flat_id', chunk_size=64,
+                                      workers=2, progress=None)
+        self.assertEqual((stats['rows'], stats['scored'], stats['errors']), (250, 247, 3))
+
+        results = pd.read_csv(output_path)
+        self.assertEqual(results['flat_id'].tolist(), self.flats['flat_id'].tolist())
+        self.assertEqual(results.loc[3, 'error'], 'Invalid input data format or value')
+        self.assertEqual(results.loc[70, 'error'], 'Problem with parameters')
+        self.assertEqual(results.loc[200, 'error'], 'Invalid value of latitude')
+        valid = results['error'].isna()
+        handler = FastApiHandler(micro_batching=False, prediction_cache=False, stream_stats=False)
+        expected = [handler.price_predict(flat) for flat in self.flats[valid][REQUIRED_PARAMS].to_dict('records')]
+        np.testing.assert_allclose(results.loc[valid, 'score'], expected, rtol=1e-9)
+
+        # The chunk size does not change the scores
+        bulk_score.bulk_score(self.input_path, output_path, id_column='flat_id', chunk_size=250, workers=1,
+                              progress=None)
+        np.testing.assert_allclose(pd.read_csv(output_path)['score'], results['score'], rtol=1e-9)
+
+    def test_missing_columns(self):
+        """Tests that an input without a required parameter is rejected."""
+        self.flats.drop(columns='floor').to_csv(self.input_path, index=False)
+        with self.assertRaises(ValueError):
+            bulk_score.bulk_score(self.input_path, os.path.join(self.data_dir.name, 'scores.csv'),
+                                  workers=1, progress=None)
+
+    def test_parquet(self):
+        """Tests scoring a Parquet file into a Parquet file, identified by the row number."""
+        try:
+            import pyarrow
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        input_path = os.path.join(self.data_dir.name, 'flats.parquet')
+        output_path = os.path.join(self.data_dir.name, 'scores.parquet')
+        pd.read_csv(self.input_path).to_parquet(input_path)
+        stats = bulk_score.bulk_score(input_path, output_path, chunk_size=64, workers=1, progress=None)
+        results = pd.read_parquet(output_path)
+        self.assertEqual(results[bulk_score.ROW_COLUMN].tolist(), list(range(250)))
+        self.assertEqual(int(results['error'].notna().sum()), stats['errors'])
+
+class TestDataLoader(unittest.TestCase):
+    """
+    Unit test class for the training data loader.
+    """
+    def setUp(self):
+        """Writes a SQLite stand-in of the training table."""
+        self.data_dir = tempfile.TemporaryDirectory()
+        self.snapshot_dir = os.path.join(self.data_dir.name, 'snapshots')
+        self.url = f"sqlite:///{os.path.join(self.data_dir.name, 'flats.db')}"
+        data_loader.write_synthetic_table(self.url, 300)
+        self.connections = 0
+
+    def tearDown(self):
+        """Removes the database and the snapshots."""
+        self.data_dir.cleanup()
+
+    def connect(self):
+        """Returns an engine of the stand-in database, counting the connections."""
+        from sqlalchemy import create_engine
+        self.connections += 1
+        return create_engine(self.url)
+
+    def test_chunked_typed_load(self):
+        """Tests that the chunked load selects the training columns with downcast types and equal values."""
+        data, info = data_loader.load_training_data(self.connect, snapshot_dir=self.snapshot_dir, chunk_size=64)
+        self.assertEqual((info['source'], info['rows']), ('database', 300))
+        self.assertEqual(list(data.columns), data_loader.TRAINING_COLUMNS)
+        for column, dtype in data_loader.COLUMN_DTYPES.items():
+            self.assertEqual(data[column].dtype, np.dtype(dtype))
+        self.assertEqual(data[data_loader.TARGET].dtype, np.float64)
+
+        expected = pd.read_sql(f"SELECT * FROM {data_loader.TABLE_NAME}", self.connect())
+        for column in data_loader.TRAINING_COLUMNS:
+            np.testing.assert_array_equal(data[column], expected[column])
+
+    def test_snapshot(self):
+        """Tests that repeat loads read the snapshot, and a corrupted or expired snapshot is loaded again."""
+        data, _ = data_loader.load_training_data(self.connect, snapshot_dir=self.snapshot_dir)
+        snapshot, info = data_loader.load_training_data(self.connect, snapshot_dir=self.snapshot_dir)
+        self.assertEqual((info['source'], self.connections), ('snapshot', 1))
+        pd.testing.assert_frame_equal(snapshot, data)
+
+        with open(info['path'], 'ab') as snapshot_file:
+            snapshot_file.write(b'corrupted')
+        _, info = data_loader.load_training_data(self.connect, snapshot_dir=self.snapshot_dir)
+        self.assertEqual((info['source'], self.connections), ('database', 2))
+        _, info = data_loader.load_training_data(self.connect, snapshot_dir=self.snapshot_dir, refresh=True)
+        self.assertEqual((info['source'], self.connections), ('database', 3))
+        # A snapshot older than the maximum age picks up the rows added since
+        with sqlite3.connect(self.url.removeprefix('sqlite:///')) as connection:
+            connection.execute(f"DELETE FROM {data_loader.TABLE_NAME} WHERE id >= 200")
+        _, info = data_loader.load_training_data(self.connect, snapshot_dir=self.snapshot_dir, max_age=3600)
+        self.assertEqual((info['source'], info['rows']), ('snapshot', 300))
+        _, info = data_loader.load_training_data(self.connect, snapshot_dir=self.snapshot_dir, max_age=0)
+        self.assertEqual((info['source'], info['rows'], info['watermark']), ('database', 200, 199))
+
+    def test_watermark(self):
+        """Tests that loads record the largest row ID, and a load after a watermark reads only newer rows."""
+        data, info = data_loader.load_training_data(self.connect, snapshot_dir=self.snapshot_dir)
+        self.assertEqual(info['watermark'], 299)
+        self.assertEqual(list(data.columns), data_loader.TRAINING_COLUMNS)
+        _, info = data_loader.load_training_data(self.connect, snapshot_dir=self.snapshot_dir)
+        self.assertEqual((info['source'], info['watermark']), ('snapshot', 299))
+
+        new_data, info = data_loader.load_training_data(self.connect, snapshot_dir=self.snapshot_dir, since=249)
+        self.assertEqual((info['source'], info['rows'], info['watermark']), ('database', 50, 299))
+        pd.testing.assert_frame_equal(new_data, data.iloc[250:].reset_index(drop=True))
+        empty, info = data_loader.load_training_data(self.connect, since=299)
+        self.assertEqual((len(empty), info['watermark']), (0, 299))
+
+    def test_downcast_keeps_unfit_columns(self):
+        """Tests that columns with values out of the downcast range or missing values keep their type."""
+        chunk = pd.DataFrame({'rooms': [1, 300], 'floor': [1.0, np.nan], 'build_year': [1990, 2000],
+                              'has_elevator': [True, False], 'latitude': [55.7522123456789, 59.9386]})
+        downcast = data_loader.downcast(chunk)
+        self.assertEqual(downcast['latitude'].tolist(), chunk['latitude'].tolist())
+        self.assertEqual(downcast['rooms'].dtype, np.int64)
+        self.assertEqual(downcast['floor'].dtype, np.float64)
+        self.assertEqual(downcast['build_year'].dtype, np.int16)
+        self.assertEqual(downcast['has_elevator'].tolist(), [1, 0])
+
+class TestTraining(unittest.TestCase):
+    """
+    Unit test class for the training script.
+    """
+    def setUp(self):
+        """Generates a small synthetic dataset and a cache directory."""
+        self.X, self.y = synthetic_flats(300)
+        self.cache_dir = tempfile.TemporaryDirectory()
+        self.params = dict(n_jobs=1, cache_dir=self.cache_dir.name, k_features=3, sfs_batch=200)
+
+    def tearDown(self):
+        """Removes the cache."""
+        self.cache_dir.cleanup()
+
+    def test_cached_stages(self):
+        """Tests that changing only the regressor reuses the cached feature engineering."""
+        model, report = train_model(self.X, self.y, regressor_params={'iterations': 20, 'depth': 4, **NO_TRAIN_FILES},
+                                    **self.params)
+        self.assertIsNone(model.memory)
+        self.assertIsNone(model['processor'].memory)
+
+        # AutoFeat would fail if it were fitted again
+        with mock.patch.object(AutoFeatWrapper, 'fit', side_effect=AssertionError("AutoFeat refitted")):
+            changed, _ = train_model(self.X, self.y, regressor_params={'iterations': 20, 'depth': 3, **NO_TRAIN_FILES},
+                                     **self.params)
+        self.assertEqual(changed['regressor'].get_params()['depth'], 3)
+        pd.testing.assert_frame_equal(changed['processor'].transform(self.X), model['processor'].transform(self.X))
+
+    def test_cross_validation(self):
+        """Tests that cross-validation reports the RMSE of each fold."""
+        _, report = train_model(self.X, self.y, model='catboost', cv=3, n_jobs=1,
+                                regressor_params={'iterations': 20, **NO_TRAIN_FILES})
+        self.assertEqual(len(report['cv_rmse']), 3)
+        self.assertTrue(all(rmse > 0 for rmse in report['cv_rmse']))
+
+class TestIncrementalTraining(unittest.TestCase):
+    """
+    Unit test class for incremental retraining.
+    """
+    def setUp(self):
+        """Writes a SQLite stand-in of the training table."""
+        from sqlalchemy import create_engine
+        self.data_dir = tempfile.TemporaryDirectory()
+        self.model_path = os.path.join(self.data_dir.name, 'model.pkl')
+        self.engine = create_engine(f"sqlite:///{os.path.join(self.data_dir.name, 'flats.db')}")
+        data_loader.write_synthetic_table(self.engine.url, 300)
+        self.params = dict(model_path=self.model_path, snapshot_dir=os.path.join(self.data_dir.name, 'snapshots'),
+                           incremental_iterations=10, model='catboost', n_jobs=1, cache_dir=None,
+                           regressor_params={'iterations': 20, **NO_TRAIN_FILES})
+
+    def tearDown(self):
+        """Removes the database, the snapshots and the model."""
+        self.data_dir.cleanup()
+
+    def add_rows(self, n_rows: int):
+        """Appends rows with the next IDs to the training table."""
+        start = int(pd.read_sql(f"SELECT MAX(id) FROM {data_loader.TABLE_NAME}", self.engine).iloc[0, 0]) + 1
+        X, y = synthetic_flats(n_rows, random_state=start)
+        rows = pd.concat([X, y], axis=1)
+        rows.insert(0, 'flat_id', np.arange(start, start + n_rows))
+        rows.insert(0, 'id', np.arange(start, start + n_rows))
+        rows.to_sql(data_loader.TABLE_NAME, self.engine, if_exists='append', index=False)
+
+    def test_incremental_retrain(self):
+        """Tests that a retrain continues the saved model on the new rows only, and records its history."""
+        model, meta = retrain(lambda: self.engine, **self.params)
+        self.assertEqual((meta['history'][-1]['mode'], meta['watermark'], meta['rows']), ('full', 299, 300))
+        with open(f"{self.model_path}.json") as meta_file:
+            self.assertEqual(json.load(meta_file), meta)
+        buildings = np.isfinite(load_building_store(f"{self.model_path}.buildings.npy").values[:, -1]).sum()
+
+        self.add_rows(100)
+        continued, meta = retrain(lambda: self.engine, **self.params)
+        run = meta['history'][-1]
+
+        # The building table keeps the buildings of the full retrain and gets those of the new rows
+        store = load_building_store(f"{self.model_path}.buildings.npy")
+        new_ids = pd.read_sql(f"SELECT building_id FROM {data_loader.TABLE_NAME} WHERE id > 299", self.engine)
+        self.assertTrue(all(store.lookup(int(i)) is not None for i in new_ids['building_id']))
+        self.assertGreater(np.isfinite(store.values[:, -1]).sum(), buildings)
+        self.assertEqual((run['mode'], run['rows'], meta['watermark'], meta['rows']), ('incremental', 100, 399, 400))
+        self.assertEqual(continued.tree_count_, model.tree_count_ + 10)
+        self.assertEqual(run['previous_mode'], 'full')
+        # The reference RMSE is the holdout RMSE of the full retrain, not the RMSE on the new rows
+        self.assertGreater(meta['history'][0]['holdout_rmse'], 0)
+        self.assertEqual(meta['reference_rmse'], meta['history'][0]['holdout_rmse'])
+        self.assertEqual(meta['summary']['full']['next_rows_rmse'], run['previous_rmse'])
+        self.assertEqual(meta['summary']['incremental']['retrains'], 1)
+        with open(self.model_path, 'rb') as model_file:
+            self.assertEqual(pickle.load(model_file).tree_count_, continued.tree_count_)
+
+        # Up to date: nothing is trained or saved
+        self.assertEqual(retrain(lambda: self.engine, **self.params), (None, meta))
+
+    def test_full_retrain_fallbacks(self):
+        """Tests that a retrain falls back to a full one on schedule and on drift of the RMSE."""
+        retrain(lambda: self.engine, **self.params)
+        self.add_rows(50)
+        _, meta = retrain(lambda: self.engine, full_retrain_days=0, **self.params)
+        self.assertEqual((meta['history'][-1]['mode'], meta['history'][-1]['reason']), ('full', 'schedule'))
+        self.assertEqual((meta['watermark'], meta['rows']), (349, 350))
+
+        self.add_rows(50)
+        _, meta = retrain(lambda: self.engine, drift_threshold=0, **self.params)
+        self.assertEqual(meta['history'][-1]['mode'], 'full')
+        self.assertTrue(meta['history'][-1]['reason'].startswith('drift'))
+        self.assertEqual((meta['watermark'], len(meta['history'])), (399, 3))
+
+        # A history without a reference RMSE cannot detect drift
+        with open(f"{self.model_path}.json", 'w') as meta_file:
+            json.dump(dict(meta, reference_rmse=None), meta_file)
+        self.add_rows(50)
+        _, meta = retrain(lambda: self.engine, **self.params)
+        self.assertEqual((meta['history'][-1]['mode'], meta['history'][-1]['reason']), ('full', 'no reference RMSE'))
+        self.assertIsNotNone(meta['reference_rmse'])
+
+    def test_pipeline_warm_start(self):
+        """Tests that continuing a fitted pipeline keeps its feature engineering and extends its regressor."""
+        X, y = synthetic_flats(400)
+        model, _ = train_model(X[:300], y[:300], n_jobs=1, cache_dir=None, k_features=3, sfs_batch=200,
+                               regressor_params={'iterations': 20, 'depth': 4, **NO_TRAIN_FILES})
+        continued, report = continue_training(model, X[300:], y[300:], iterations=10)
+        self.assertIs(continued['processor'], model['processor'])
+        self.assertEqual(continued['regressor'].tree_count_, 30)
+        self.assertEqual(model['regressor'].tree_count_, 20)
+        self.assertGreater(report['fit_seconds'], 0)
+
+class TestModelFetcher(unittest.TestCase):
+    """
+    Unit test class for the S3 model fetcher.
+    """
+    def setUp(self):
+        """Starts a moto S3 stand-in with a model object, and creates the cache directory."""
+        try:
+            import boto3
+            from moto import mock_aws
+        except ImportError:
+            self.skipTest("boto3 or moto is not installed")
+        self.s3_mock = mock_aws()
+        self.s3_mock.start()
+        self.s3_client = boto3.client('s3', region_name='us-east-1', aws_access_key_id='test',
+                                      aws_secret_access_key='test')
+        self.s3_client.create_bucket(Bucket='models')
+        self.data_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.data_dir.name, 'cache')
+        self.path = os.path.join(self.data_dir.name, 'model.pkl')
+        self.upload(os.urandom(300000))
+
+    def tearDown(self):
+        """Stops the S3 stand-in and removes the cache."""
+        self.s3_mock.stop()
+        self.data_dir.cleanup()
+
+    def upload(self, content: bytes):
+        """Uploads a model object with its SHA-256 metadata."""
+        self.content = content
+        source = os.path.join(self.data_dir.name, 'source.pkl')
+        with open(source, 'wb') as source_file:
+            source_file.write(content)
+        model_fetcher.upload_model(self.s3_client, source, 'models', 'model.pkl')
+
+    def fetch(self) -> dict:
+        """Fetches the model object in ranged GETs of 64 KiB, counting the GETs."""
+        with mock.patch.object(self.s3_client, 'get_object', wraps=self.s3_client.get_object) as get_object:
+            info = model_fetcher.fetch_model(self.s3_client, 'models', 'model.pkl', self.path,
+                                             cache_dir=self.cache_dir, part_size=2**16, workers=4)
+        info['gets'] = get_object.call_count
+        return info
+
+    def read_model(self) -> bytes:
+        """Reads the fetched model file."""
+        with open(self.path, 'rb') as model_file:
+            return model_file.read()
+
+    def test_cached_fetch(self):
+        """Tests that an unchanged object is downloaded once, in ranged GETs, and not replaced again."""
+        info = self.fetch()
+        self.assertEqual((info['downloaded'], info['replaced'], info['gets']), (True, True, 5))
+        self.assertEqual(self.read_model(), self.content)
+
+        info = self.fetch()
+        self.assertEqual((info['downloaded'], info['replaced'], info['gets']), (False, False, 0))
+
+        os.remove(self.path)
+        info = self.fetch()
+        self.assertEqual((info['downloaded'], info['replaced']), (False, True))
+        self.assertEqual(self.read_model(), self.content)
+
+    def test_changed_object(self):
+        """Tests that a changed object is downloaded again, and the previous cached file is removed."""
+        first = self.fetch()
+        self.upload(os.urandom(1000))
+        info = self.fetch()
+        self.assertEqual((info['downloaded'], info['replaced'], info['gets']), (True, True, 1))
+        self.assertEqual(self.read_model(), self.content)
+        self.assertEqual(os.listdir(os.path.join(self.cache_dir, 'objects')), [info['sha256']])
+        self.assertNotEqual(info['sha256'], first['sha256'])
+
+    def test_checksum_errors(self):
+        """Tests that a download not matching its checksum is rejected and the model file is kept."""
+        self.fetch()
+        self.s3_client.put_object(Bucket='models', Key='model.pkl', Body=b'new model',
+                                  Metadata={model_fetcher.SHA256_METADATA: '0' * 64})
+        with self.assertRaises(model_fetcher.ChecksumError):
+            self.fetch()
+        self.assertEqual(self.read_model(), self.content)
+        self.assertFalse([name for name in os.listdir(os.path.join(self.cache_dir, 'objects')) if name.endswith('.tmp')])
+
+        # Without metadata, a single-part upload is verified against its MD5 ETag
+        self.s3_client.put_object(Bucket='models', Key='model.pkl', Body=b'new model')
+        self.assertTrue(self.fetch()['downloaded'])
+        self.assertEqual(self.read_model(), b'new model')
+
+    def test_corrupted_cache(self):
+        """Tests that a cached file that no longer matches its SHA-256 is downloaded again."""
+        info = self.fetch()
+        blob_path = os.path.join(self.cache_dir, 'objects', info['sha256'])
+        with open(blob_path + '.corrupted', 'wb') as blob_file:
+            blob_file.write(b'corrupted')
+        os.replace(blob_path + '.corrupted', blob_path)
+        info = self.fetch()
+        self.assertEqual((info['downloaded'], info['replaced']), (True, False))
+        self.assertEqual(self.read_model(), self.content)
+
+class TestAdmission(unittest.TestCase):
+    """
+    Unit test class for the admission control.
+    """
+    def test_queue_full(self):
+        """Tests that requests over the limit wait in the queue, and are rejected when it is full."""
+        controller = AdmissionController(max_concurrency=1, queue_size=1, latency_slo_ms=1000)
+
+        async def scenario():
+            await controller.acquire()
+            waiting = asyncio.create_task(controller.acquire())
+            await asyncio.sleep(0)
+            with self.assertRaises(Overloaded) as rejection:
+                await controller.acquire()
+            self.assertEqual((rejection.exception.reason, rejection.exception.retry_after), ('queue_full', 1))
+
+            # The slot of the finished request passes to the waiting one
+            controller.release(0.01)
+            await waiting
+            self.assertEqual(controller.in_flight, 1)
+            controller.release(0.01)
+            self.assertEqual(controller.in_flight, 0)
+
+        asyncio.run(scenario())
+
+    def test_latency_slo(self):
+        """Tests that requests whose expected or actual wait exceeds the SLO are rejected."""
+        controller = AdmissionController(max_concurrency=1, queue_size=10, latency_slo_ms=100)
+
+        async def scenario():
+            await controller.acquire()
+            controller.service_time = 2.5
+            with self.assertRaises(Overloaded) as rejection:
+                await controller.acquire()
+            self.assertEqual((rejection.exception.reason, rejection.exception.retry_after), ('slo', 3))
+
+            controller.service_time = 0.01
+            with self.assertRaises(Overloaded) as rejection:
+                await controller.acquire()
+            self.assertEqual(rejection.exception.reason, 'timeout')
+
+            # A cancelled waiter leaves the queue without taking a slot
+            waiting = asyncio.create_task(controller.acquire())
+            await asyncio.sleep(0)
+            waiting.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await waiting
+            controller.release(0.01)
+            self.assertEqual(controller.in_flight, 0)
+
+        asyncio.run(scenario())
+
+    def test_endpoints(self):
+        """Tests that an overloaded service sheds scoring requests with 503 and still serves health checks."""
+        rejections = REGISTRY.get_sample_value('admission_rejections_total', {'reason': 'queue_full'}) or 0
+        with TestClient(app) as test_client:
+            with mock.patch.multiple(app.admission, max_concurrency=1, queue_size=0, in_flight=1):
+                for method, path in [('POST', '/predict'), ('POST', '/v2/predict'), ('GET', '/random')]:
+                    response = test_client.request(method, path, json=sample_data() if method == 'POST' else None)
+                    self.assertEqual(response.status_code, 503)
+                    self.assertEqual(response.headers['Retry-After'], '1')
+                self.assertEqual(test_client.get("/").status_code, 200)
+                self.assertEqual(test_client.get("/model").status_code, 200)
+            self.assertNotEqual(test_client.post("/predict", json={}).status_code, 503)
+        self.assertEqual(REGISTRY.get_sample_value('admission_rejections_total', {'reason': 'queue_full'}),
+                         rejections + 3)
+        self.assertEqual(app.admission.in_flight, 0)
+
+class TestStreamStats(unittest.TestCase):
+    """
+    Unit test class for the streaming prediction statistics.
+    """
+    def test_sketch(self):
+        """Tests the accuracy, bounded memory and merging of the quantile sketch."""
+        rng = np.random.default_rng(0)
+        values = np.column_stack([rng.normal(size=200000), rng.exponential(size=200000)])
+        sketch = QuantileSketch(2, seed=0)
+        for chunk in np.array_split(values, 200):
+            sketch.update(chunk)
+        qs = [0.05, 0.5, 0.95]
+        ranks = [np.mean(values[:, column] < estimate)
+                 for column in range(2) for estimate in sketch.quantiles(qs)[:, column]]
+        np.testing.assert_allclose(ranks, qs * 2, atol=0.01)
+
+        # Memory grows with the logarithm of the count: at most k + 1 values per column of a level
+        for chunk in np.array_split(np.tile(values, (4, 1)), 400):
+            sketch.update(chunk)
+        self.assertEqual(sketch.count, 1000000)
+        self.assertLessEqual(len(sketch.levels), np.log2(sketch.count / sketch.k) + 2)
+        self.assertLessEqual(sketch.nbytes(), len(sketch.levels) * (sketch.k + 1) * 2 * 8)
+        self.assertLess(sketch.nbytes(), 64 * 1024)
+
+        first, second = QuantileSketch(2, seed=1), QuantileSketch(2, seed=2)
+        first.update(values[:100000])
+        second.update(values[100000:])
+        first.merge(second)
+        self.assertEqual(first.count, len(values))
+        ranks = [np.mean(values[:, 0] < estimate) for estimate in first.quantiles(qs)[:, 0]]
+        np.testing.assert_allclose(ranks, qs, atol=0.01)
+
+    def test_drift(self):
+        """Tests that the PSI is near zero for the reference distribution and high after a shift."""
+        rng = np.random.default_rng(0)
+        X = pd.DataFrame({'total_area': rng.normal(60, 15, 20000), 'rooms': rng.integers(1, 5, 20000)})
+        prices = X['total_area'] * 2e5
+        with tempfile.TemporaryDirectory() as temp_dir:
+            profile_path = os.path.join(temp_dir, 'model.pkl.profile.json')
+            save_profile(build_profile(X, prices), profile_path)
+
+            stable = StreamingStats(['total_area', 'rooms'], profile_path=profile_path)
+            stable.record_many(X, prices)
+            shifted = StreamingStats(['total_area', 'rooms'], profile_path=profile_path)
+            for row in X.assign(total_area=X['total_area'] * 1.5).itertuples(index=False):
+                shifted.record(tuple(row), row.total_area * 2e5)
+
+            for name, score in stable.drift().items():
+                self.assertLess(score, 0.01, name)
+            scores = shifted.drift()
+            self.assertGreater(scores['total_area'], 0.25)
+            self.assertGreater(scores['price'], 0.25)
+            self.assertLess(scores['rooms'], 0.01)
+
+    def test_window(self):
+        """Tests that old windows expire, so the PSI follows a shift, and stale worker files are skipped."""
+        rng = np.random.default_rng(0)
+        X = pd.DataFrame({'total_area': rng.normal(60, 15, 5000), 'rooms': rng.integers(1, 5, 5000)})
+        prices = X['total_area'] * 2e5
+        with tempfile.TemporaryDirectory() as temp_dir:
+            profile_path = os.path.join(temp_dir, 'model.pkl.profile.json')
+            save_profile(build_profile(X, prices), profile_path)
+            stats = StreamingStats(['total_area', 'rooms'], profile_path=profile_path, window=0.5, windows=2)
+            stats.record_many(X, prices)
+            time.sleep(0.6)
+            shifted = X.assign(total_area=X['total_area'] * 1.5)
+            stats.record_many(shifted, shifted['total_area'] * 2e5)
+            # Both windows are kept: half of the rows are shifted
+            self.assertEqual(stats.snapshot().count, 2 * len(X))
+            time.sleep(0.5)
+            # The reference window expired: only the shifted rows are left
+            self.assertEqual(stats.snapshot().count, len(X))
+            self.assertGreater(stats.drift()['total_area'], 1)
+            time.sleep(1)
+            self.assertEqual(stats.snapshot().count, 0)
+
+            with mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': temp_dir}):
+                stats.record_many(X, prices)
+                self.assertEqual(stats.merged().count, len(X))
+                # Sketch left by a worker that exited without being cleaned up
+                stale = os.path.join(temp_dir, 'stream_stats_1.npz')
+                os.link(os.path.join(temp_dir, f"stream_stats_{os.getpid()}.npz"), stale)
+                self.assertEqual(stats.merged().count, 2 * len(X))
+                os.utime(stale, (time.time() - 2, time.time() - 2))
+                self.assertEqual(stats.merged().count, len(X))
+                remove_worker_sketch(os.getpid())
+                self.assertEqual([name for name in os.listdir(temp_dir) if name.endswith('.npz')],
+                                 ['stream_stats_1.npz'])
+
+    def test_handler(self):
+        """Tests that the handler records its predictions and the gauges are published."""
+        handler = FastApiHandler(micro_batching=False, prediction_cache=False, stream_stats=True)
+        handler.handle(sample_data())
+        handler.handle_batch([sample_data(), {}])
+        handler.handle_rows([tuple(gen_random_data()[name] for name in REQUIRED_PARAMS)])
+        self.assertEqual(handler.stream_stats.snapshot().count, 3)
+
+        handler.stream_stats.publish()
+        self.assertEqual(REGISTRY.get_sample_value('prediction_distribution_rows'), 3)
+        median = REGISTRY.get_sample_value('prediction_distribution_quantile',
+                                           {'variable': 'price', 'quantile': '0.5'})
+        self.assertGreater(median, 0)
+        self.assertIsNone(FastApiHandler(micro_batching=False, stream_stats=False).stream_stats)
+
+class TestBuildingStore(unittest.TestCase):
+    """
+    Unit test class for the building table.
+    """
+    @classmethod
+    def setUpClass(cls):
+        """Saves the building table of synthetic flats next to a copy of the model."""
+        cls.X, _ = synthetic_flats(2000)
+        cls.temp_dir = tempfile.TemporaryDirectory()
+        cls.model_path = os.path.join(cls.temp_dir.name, 'model.pkl')
+        with open(MODEL_PATH, 'rb') as source, open(cls.model_path, 'wb') as target:
+            target.write(source.read())
+        save_building_table(build_building_table(cls.X), f"{cls.model_path}.buildings.npy")
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.temp_dir.cleanup()
+
+    def flat(self, i: int) -> dict:
+        """Returns the parameters of a synthetic flat as sent in a request."""
+        return self.X.iloc[[i]].to_dict('records')[0]
+
+    def test_table(self):
+        """Tests the lookup of the last flat of a building, unknown ids and the update of a table."""
+        store = load_building_store(f"{self.model_path}.buildings.npy")
+        self.assertIsInstance(store.values.base, np.memmap)
+        last = self.flat(int(np.flatnonzero(~self.X['building_id'].duplicated(keep='last'))[0]))
+        building = store.lookup(last['building_id'])
+        self.assertEqual(building, {name: last[name] for name in BUILDING_PARAMS})
+        self.assertIsInstance(building['build_year'], int)
+        unknown = next(i for i in range(len(store.values)) if i not in set(self.X['building_id']))
+        for building_id in [unknown, len(store.values), -1, '1', float(last['building_id']), None, True]:
+            self.assertIsNone(store.lookup(building_id))
+
+        new = self.X.iloc[:2].assign(building_id=[last['building_id'], len(store.values) + 10],
+                                     build_year=[1950, 1960])
+        updated = build_building_table(new, store.values)
+        self.assertEqual(len(updated), len(store.values) + 11)
+        np.testing.assert_array_equal(updated[unknown], store.values[unknown])
+        self.assertEqual(updated[last['building_id'], 0], 1950)
+        self.assertEqual(updated[len(store.values) + 10, 0], 1960)
+
+    def test_distance(self):
+        """Tests that stored distances equal computed ones, and overridden coordinates are computed."""
+        store = load_building_store(f"{self.model_path}.buildings.npy")
+        X = self.X.drop_duplicates('building_id', keep='last').iloc[:50].copy()
+        X.iloc[:5, X.columns.get_loc('latitude')] += 0.01
+        X.iloc[5:10, X.columns.get_loc('building_id')] += 10**6
+        np.testing.assert_allclose(store.distance(X['building_id'], X['latitude'], X['longitude']),
+                                   distance_to_center(X['latitude'], X['longitude']), rtol=1e-12)
+
+    def test_handler(self):
+        """Tests requests completed from the table, client overrides and unknown buildings."""
+        handler = FastApiHandler(micro_batching=False, prediction_cache=False, stream_stats=False,
+                                 engine='compiled', model_path=self.model_path)
+        self.assertIsNotNone(handler.building_store)
+        i = int(np.flatnonzero(~self.X['building_id'].duplicated(keep='last'))[0])
+        full = self.flat(i)
+        flat = {name: value for name, value in full.items() if name not in BUILDING_PARAMS}
+        self.assertAlmostEqual(handler.handle(flat)['score'], handler.handle(full)['score'])
+        override = dict(flat, latitude=55.7, floors_total=30)
+        self.assertAlmostEqual(handler.handle(override)['score'],
+                               handler.handle(dict(full, latitude=55.7, floors_total=30))['score'])
+        unknown = dict(flat, building_id=10**6)
+        self.assertEqual(handler.handle(unknown), {"Error": "Problem with parameters"})
+        results = handler.handle_batch([flat, full, unknown])['results']
+        self.assertAlmostEqual(results[0]['score'], results[1]['score'])
+        self.assertEqual(results[2], {"Error": "Problem with parameters"})
+        self.assertIsNotNone(handler.compiled_model.distance_lookup)
+
+        handler = FastApiHandler(micro_batching=False, stream_stats=False, building_store=False,
+                                 model_path=self.model_path)
+        self.assertIsNone(handler.building_store)
+        self.assertEqual(handler.handle(flat), {"Error": "Problem with parameters"})
+
+class TestColumnar(unittest.TestCase):
+    """
+    Unit test class for the columnar transport.
+    """
+    def setUp(self):
+        try:
+            import pyarrow
+        except ImportError:
+            self.skipTest("pyarrow is not installed")
+        self.flats = pd.DataFrame([gen_random_data() for _ in range(250)], columns=REQUIRED_PARAMS)
+
+    def post(self, client: TestClient, body: bytes) -> httpx.Response:
+        """Posts an Arrow IPC stream to the endpoint."""
+        return client.post('/v2/predict/arrow', content=body, headers={'Content-Type': columnar.ARROW_MEDIA_TYPE})
+
+    def test_predict(self):
+        """Tests that scores of several record batches match the JSON batch endpoint."""
+        with TestClient(app) as client:
+            scores = columnar.predict_columnar(client, self.flats, batch_rows=100)
+            response = client.post('/v2/predict/batch', json=self.flats.iloc[:100].to_dict('records'))
+        self.assertEqual(len(scores), len(self.flats))
+        np.testing.assert_allclose(scores[:100], response.json()['scores'])
+
+    def test_zero_copy(self):
+        """Tests that the packed layout is read as views of the request body, one per record batch."""
+        body = columnar.encode_rows(self.flats, batch_rows=100)
+        batches = columnar.read_batches(body)
+        self.assertEqual([len(X) for X in batches], [100, 100, 50])
+        self.assertFalse(batches[0].flags.writeable)
+        address = np.frombuffer(body, dtype=np.uint8).ctypes.data
+        self.assertTrue(address <= batches[0].ctypes.data < address + len(body))
+        np.testing.assert_array_equal(np.concatenate(batches), self.flats.to_numpy(dtype=float))
+
+    def test_columnar_layout(self):
+        """Tests a stream of one column per parameter, in any order, against the packed layout."""
+        import pyarrow as pa
+        table = pa.Table.from_pandas(self.flats[REQUIRED_PARAMS[::-1]], preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        with TestClient(app) as client:
+            response = self.post(client, sink.getvalue().to_pybytes())
+            self.assertEqual(response.headers['content-type'], columnar.ARROW_MEDIA_TYPE)
+            np.testing.assert_allclose(columnar.decode_scores(response.content),
+                                       columnar.predict_columnar(client, self.flats))
+
+    def test_errors(self):
+        """Tests that invalid values, missing parameters and broken streams get status 422."""
+        invalid = self.flats.copy()
+        invalid.loc[[3, 7], 'floor'] = 1000
+        with TestClient(app) as client:
+            response = self.post(client, columnar.encode_rows(invalid))
+            self.assertEqual(response.status_code, 422)
+            self.assertIn("floor in rows [3, 7]", response.json()['detail'])
+            self.assertEqual(self.post(client, columnar.encode_rows(np.empty((0, len(REQUIRED_PARAMS))))).status_code,
+                             200)
+            self.assertEqual(self.post(client, b'not an arrow stream').status_code, 422)
+
+        import pyarrow as pa
+        table = pa.Table.from_pandas(self.flats.drop(columns='floor'), preserve_index=False)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        with self.assertRaisesRegex(columnar.ColumnarError, 'floor'):
+            columnar.read_batches(sink.getvalue().to_pybytes())
+        with self.assertRaisesRegex(columnar.ColumnarError, 'limit of 100 rows'):
+            columnar.read_batches(columnar.encode_rows(self.flats), max_rows=100)
+
+    def test_limits(self):
+        """Tests that large bodies are rejected before they are read and large batches are scored in slices."""
+        body = columnar.encode_rows(self.flats)
+        with TestClient(app) as client, mock.patch('services.app.app.COLUMNAR_MAX_BYTES', len(body) - 1):
+            self.assertEqual(self.post(client, body).status_code, 413)
+            # Without Content-Length, the body is read until it exceeds the limit
+            chunks = (body[start:start + 1024] for start in range(0, len(body), 1024))
+            response = client.post('/v2/predict/arrow', content=chunks,
+                                   headers={'Content-Type': columnar.ARROW_MEDIA_TYPE})
+            self.assertEqual(response.status_code, 413)
+
+        import pyarrow as pa
+        calls = []
+        with mock.patch.object(app.handler, 'handle_array', side_effect=lambda X: calls.append(len(X)) or
+                               {"scores": np.zeros(len(X))}):
+            chunks = list(columnar.write_scores(app.handler, columnar.read_batches(body), max_rows=100))
+        self.assertEqual(calls, [100, 100, 50])
+        self.assertEqual(pa.ipc.open_stream(b''.join(chunks)).read_all().num_rows, len(self.flats))
+
 if __name__ == '__main__':
     client = TestClient(app)
     unittest.main()
@@ -0,0 +1,146 @@
+"""
+services/app/tree_ensemble.py
+
+This module evaluates a CatBoost model of symmetric (oblivious) trees with NumPy.
+
+1. Reads the model from CatBoost's JSON export, so that serving small requests does not
+   import CatBoost (which itself imports pandas and notebook widgets).
+2. Binarizes every distinct (feature, border) split of the model once per batch, with the
+   float32 comparison and NaN treatment of CatBoost, builds the leaf index of every tree
+   level by level and sums the leaf values.
+3. Delegates batches larger than NUMPY_MAX_ROWS, where the multithreaded CatBoost evaluator
+   is faster, to a CatBoost model loaded on first use.
+
+Key Components:
+- NUMPY_MAX_ROWS: Largest batch evaluated with NumPy when a CatBoost loader is given.
+- ObliviousTreeEnsemble: Class predicting with the trees of a CatBoost JSON export.
+- from_catboost_json: Function building the ensemble, or None if the model is not supported.
+"""
+
+import threading
+import numpy as np
+
+# Largest batch evaluated with NumPy when a CatBoost model can be loaded for larger ones
+NUMPY_MAX_ROWS = 32
+
+class ObliviousTreeEnsemble:
+    """
+    Predicts with the oblivious trees of a CatBoost regression model.
+    """
+    def __init__(self, feature_names: list, split_features: np.ndarray, split_borders: np.ndarray,
+                 nan_as_true: np.ndarray, tree_splits: np.ndarray, leaf_values: np.ndarray,
+                 scale: float, bias: float, load_catboost=None):
+        """
+        Initializes the ensemble.
+
+        Args:
+            feature_names (list): Names of the model features, in input column order.
+            split_features (np.ndarray): Feature index of each distinct split.
+            split_borders (np.ndarray): float32 border of each distinct split.
+            nan_as_true (np.ndarray): Whether NaN satisfies each distinct split.
+            tree_splits (np.ndarray): Distinct split index of each tree level, shape (trees, depth).
+                Index 0 is a split that is never satisfied, padding shallower trees.
+            leaf_values (np.ndarray): Leaf values, shape (trees, 2 ** depth).
+            scale (float): Scale of the sum of leaf values.
+            bias (float): Bias added to the scaled sum.
+            load_catboost (callable): Function returning the equivalent CatBoost model for
+                batches larger than NUMPY_MAX_ROWS, None to evaluate every batch with NumPy.
+        """
+        self.feature_names_ = feature_names
+        self.split_features = split_features
+        self.split_borders = split_borders[:, None]
+        self.nan_as_true = nan_as_true[:, None]
+        self.tree_splits = tree_splits
+        self.leaf_values = leaf_values
+        self.scale = scale
+        self.bias = bias
+        self._leaf_dtype = np.uint8 if tree_splits.shape[1] <= 8 else np.uint16
+        self._load_catboost = load_catboost
+        self._catboost = None
+        self._lock = threading.Lock()
+
+    def predict(self, X: np.ndarray) -> np.ndarray:
+        """
+        Predicts for a float array of model features.
+
+        Args:
+            X (np.ndarray): Float array of shape (rows, features).
+
+        Returns:
+            np.ndarray: Predictions.
+        """
+        X = np.asarray(X, dtype=float)
+        if X.shape[0] > NUMPY_MAX_ROWS and self._load_catboost is not None:
+            return self.catboost_model().predict(X)
+
+        # Split outcomes and leaf indices are laid out as (splits or trees, rows)
+        values = X.T.astype(np.float32)[self.split_features]
+        binarized = np.where(np.isnan(values), self.nan_as_true, values > self.split_borders)
+        binarized = binarized.astype(self._leaf_dtype)
+        leaves = np.zeros((self.tree_splits.shape[0], X.shape[0]), dtype=self._leaf_dtype)
+        for level, splits in enumerate(self.tree_splits.T):
+            leaves |= binarized[splits] << level
+        total = np.take_along_axis(self.leaf_values, leaves.astype(np.intp), axis=1).sum(axis=0)
+        return self.scale * total + self.bias
+
+    def catboost_model(self):
+        """
+        Returns the CatBoost model for large batches, loading it on first use.
+
+        Returns:
+            CatBoost model.
+        """
+        if self._catboost is None:
+            with self._lock:
+                if self._catboost is None:
+                    self._catboost = self._load_catboost()
+        return self._catboost
+
+def from_catboost_json(model: dict, load_catboost=None):
+    """
+    Builds the ensemble from CatBoost's JSON export of a model.
+
+    Args:
+        model (dict): Model exported with `save_model(..., format='json')`.
+        load_catboost (callable): Function returning the equivalent CatBoost model for large batches.
+
+    Returns:
+        ObliviousTreeEnsemble: Ensemble, or None if the model has categorical or text
+            features, non-symmetric trees or several outputs.
+    """
+    features = model['features_info']
+    if set(features) != {'float_features'} or 'oblivious_trees' not in model:
+        return None
+    trees = model['oblivious_trees']
+    depth = max(len(tree['splits']) for tree in trees)
+    scale, biases = model.get('scale_and_bias', [1, [0]])
+    if len(biases) != 1 or any(len(tree['leaf_values']) != 2 ** len(tree['splits']) for tree in trees):
+        return None
+
+    float_features = sorted(features['float_features'], key=lambda feature: feature['feature_index'])
+    nan_treatment = {feature['feature_index']: feature['nan_value_treatment'] for feature in float_features}
+    # Shallower trees are padded with a split that is never satisfied, so that their leaf
+    # index stays below the number of their leaves
+    splits = {(0, np.float32(np.inf)): 0}
+    tree_splits = []
+    leaf_values = np.zeros((len(trees), 2 ** depth))
+    for i, tree in enumerate(trees):
+        if any(split['split_type'] != 'FloatFeature' for split in tree['splits']):
+            return None
+        tree_splits.append([
+            splits.setdefault((split['float_feature_index'], np.float32(split['border'])), len(splits))
+            for split in tree['splits']
+        ] + [0] * (depth - len(tree['splits'])))
+        leaf_values[i, :len(tree['leaf_values'])] = tree['leaf_values']
+    split_features, split_borders = zip(*splits)
+    return ObliviousTreeEnsemble(
+        feature_names=[feature['feature_id'] for feature in float_features],
+        split_features=np.array(split_features),
+        split_borders=np.array(split_borders, dtype=np.float32),
+        nan_as_true=np.array([False] + [nan_treatment[feature] == 'AsTrue' for feature in split_features[1:]]),
+        tree_splits=np.array(tree_splits),
+        leaf_values=leaf_values,
+        scale=float(scale),
+        bias=float(biases[0]),
+        load_catboost=load_catboost
+    )
@@ -1,69 +1,478 @@
 """
 services/models/create_model.py
 
-This script trains a CatBoost regression model using data from a PostgreSQL database
-and saves the fitted model to a file.
+This script trains the model pipeline of `model_pipeline.ipynb` and saves the fitted model to a file.
 
-1. Loads environment variables for database connection.
-2. Connects to the PostgreSQL database and retrieves data from the specified table.
-3. Prepares the data for training by separating features and target variable.
-4. Trains a CatBoost regression model.
-5. Saves the trained model to a pickle file.
+1. Loads the training data with `data_loader`: from the local Parquet snapshot if it exists,
+   otherwise from the database (connection from the .env file) in typed chunks. A synthetic
+   dataset can be used instead.
+2. Fits the pipeline of `pipeline.py` (or a plain CatBoost regressor) with the sequential
+   feature selectors running in parallel.
+3. Caches the fitted feature engineering stages on disk, keyed by the hash of their parameters
+   and input data, so a run that only changes the regressor does not recompute them.
+4. Optionally cross-validates the pipeline with the folds running in parallel.
+5. Saves the fitted model to a pickle file, and optionally its lean serving artifact, each
+   with a sidecar JSON file of its training history and the watermark of its data.
+6. Retrains incrementally (--incremental): loads only the rows added after the watermark of
+   the saved model and continues training its CatBoost regressor on them, keeping the fitted
+   feature engineering. Falls back to a full retrain when the last full retrain is older than
+   TRAINING_FULL_RETRAIN_DAYS, or when the RMSE of the saved model on the new rows exceeds its
+   reference RMSE by more than TRAINING_DRIFT_THRESHOLD. The reference RMSE is recorded by the
+   full retrain: the cross-validation RMSE, or else the RMSE on a TRAINING_HOLDOUT share of
+   the rows left out of a preliminary fit.
+7. Saves the reference profile of the training data and of the model's predictions next to
+   each model file ('<model>.profile.json'), against which the service measures the drift of
+   the served predictions. Incremental retrains keep the profile of the last full retrain.
+8. Saves the building table of the training data next to each model file
+   ('<model>.buildings.npy'), from which the service completes requests sent with only the
+   flat-level parameters and building_id. Incremental retrains add the buildings of the new rows.
+9. Compares the training wall-clock time of sequential, parallel and cached runs on
+   synthetic data (--compare).
 
 Key Components:
-- TABLE_NAME: Name of the table in the database containing the training data.
 - RANDOM_STATE: Random state for model reproducibility.
 - MODEL_NAME: Path to save the trained model.
-- ENV_VARS: List of required environment variables for database connection.
+- TRAINING_CACHE_DIR: Directory of the cached pipeline stages (environment variable).
+- TRAINING_FULL_RETRAIN_DAYS, TRAINING_DRIFT_THRESHOLD, TRAINING_INCREMENTAL_ITERATIONS:
+  Full retrain schedule, drift threshold and boosting iterations of an incremental retrain
+  (environment variables).
+- TRAINING_HOLDOUT: Share of the rows held out to measure the reference RMSE of a full
+  retrain without cross-validation (environment variable).
+- train_model: Function fitting and optionally cross-validating the model.
+- continue_training: Function continuing the training of a fitted model on new rows.
+- retrain: Function retraining the saved model fully or incrementally and saving it.
+- summarize_history: Function comparing the timings and metrics of full and incremental retrains.
+- save_reference_profile: Function saving the reference profile next to the model files.
+- save_building_store: Function saving the building table next to the model files.
+- compare_training: Function comparing the training time of sequential, parallel and cached runs.
 """
 
+import argparse
+import json
 import os
 import sys
 import pickle
-import pandas as pd
-from sqlalchemy import create_engine
+import tempfile
+import time
+import warnings
+import numpy as np
 from catboost import CatBoostRegressor
-from dotenv import load_dotenv
+from joblib import Memory
+from sklearn.base import clone
+from sklearn.metrics import root_mean_squared_error
+from sklearn.model_selection import KFold, cross_validate, train_test_split
+from sklearn.pipeline import Pipeline
+from services.app.building_store import build_building_table, load_building_store, save_building_table
+from services.app.logger import get_logger
+from services.app.stream_stats import build_profile, save_profile
+from services.models.data_loader import SNAPSHOT_DIR, TARGET, load_training_data
+from services.models.pipeline import PIPELINE_VERSION, build_pipeline, synthetic_flats
+
+logger = get_logger(__name__)
 
 # Constants
-TABLE_NAME = 'clean_flats'
 RANDOM_STATE = 42
 MODEL_NAME = 'services/models/fitted_model.pkl'
-ENV_VARS = [
-    'DB_DESTINATION_USER',
-    'DB_DESTINATION_PASSWORD',
-    'DB_DESTINATION_HOST',
-    'DB_DESTINATION_PORT',
-    'DB_DESTINATION_NAME'
-]
-
-# Load environment variables from .env file
-load_dotenv(dotenv_path='/.env')
-
-# Check if all required environment variables are defined
-if not all(_ in os.environ for _ in ENV_VARS):
-    print("Cannot create model: environment variables are not defined, check .env file.")
-    sys.exit()
-
-# Create a connection to the PostgreSQL database
-con = create_engine(
-    f"postgresql://{os.getenv('DB_DESTINATION_USER')}:"
-    f"{os.getenv('DB_DESTINATION_PASSWORD')}@"
-    f"{os.getenv('DB_DESTINATION_HOST')}:"
-    f"{os.getenv('DB_DESTINATION_PORT')}/"
-    f"{os.getenv('DB_DESTINATION_NAME')}"
-)
-
-# Load data from the database
-df = pd.read_sql(sql=f'SELECT * FROM {TABLE_NAME}', con=con).drop(['id', 'flat_id'], axis=1)
-X, y = df.drop('price', axis=1), df['price']
-
-# Train the CatBoost regression model
-model = CatBoostRegressor(verbose=0, random_state=RANDOM_STATE)
-model.fit(X, y)
-
-# Save the trained model to a pickle file
-with open(MODEL_NAME, 'wb') as model_file:
-    pickle.dump(model, model_file)
-
-print(f'Fitted model saved to {MODEL_NAME}')
+
+# Directory of the cached pipeline stages
+TRAINING_CACHE_DIR = os.getenv('TRAINING_CACHE_DIR', 'services/models/cache')
+
+# Maximum age of the last full retrain before an incremental retrain falls back to a full one, in days
+TRAINING_FULL_RETRAIN_DAYS = float(os.getenv('TRAINING_FULL_RETRAIN_DAYS', 7))
+
+# Maximum ratio of the RMSE of the saved model on the new rows to its reference RMSE
+TRAINING_DRIFT_THRESHOLD = float(os.getenv('TRAINING_DRIFT_THRESHOLD', 1.2))
+
+# Number of boosting iterations added by an incremental retrain
+TRAINING_INCREMENTAL_ITERATIONS = int(os.getenv('TRAINING_INCREMENTAL_ITERATIONS', 200))
+
+# Share of the rows held out to measure the reference RMSE of a full retrain without cross-validation
+TRAINING_HOLDOUT = float(os.getenv('TRAINING_HOLDOUT', 0.1))
+
+# Maximum number of training rows sampled for the reference profile
+PROFILE_ROWS = 100000
+
+def train_model(X, y, model: str = 'pipeline', n_jobs: int = -1, cache_dir: str = TRAINING_CACHE_DIR,
+                cv: int = 0, k_features: int = 10, sfs_batch: int = 5000,
+                regressor_params: dict = None, holdout: float = 0) -> tuple:
+    """
+    Fits the model, and optionally cross-validates it or measures its holdout RMSE beforehand.
+
+    Args:
+        X (pd.DataFrame): Features with the REQUIRED_PARAMS columns.
+        y (pd.Series): Prices.
+        model (str): 'pipeline' for the pipeline of `pipeline.py`, 'catboost' for a plain regressor.
+        n_jobs (int): Number of parallel jobs of the feature selectors and the folds (-1 for all cores).
+        cache_dir (str): Directory of the cached pipeline stages, None to disable caching.
+        cv (int): Number of cross-validation folds, 0 to skip cross-validation.
+        k_features (int): Number of features kept by each sequential feature selector.
+        sfs_batch (int): Number of rows used to fit the backward feature selector.
+        regressor_params (dict): CatBoostRegressor parameters overriding the tuned ones.
+        holdout (float): Share of the rows left out of a preliminary fit to measure the RMSE on
+            them, 0 to skip it; not used when cross-validated.
+
+    Returns:
+        tuple: Fitted model, and a dictionary with the fit seconds, the cross-validation
+            seconds and RMSE of each fold if cross-validated, and the holdout seconds and RMSE
+            if measured.
+    """
+    if model == 'catboost':
+        estimator = CatBoostRegressor(verbose=0, random_state=RANDOM_STATE, **(regressor_params or {}))
+    else:
+        # Stages cached by an earlier version of the custom transformers are not reused
+        memory = Memory(os.path.join(cache_dir, f"pipeline-v{PIPELINE_VERSION}"), verbose=0) if cache_dir else None
+        estimator = build_pipeline(k_features=k_features, sfs_batch=sfs_batch, regressor_params=regressor_params,
+                                   n_jobs=n_jobs, memory=memory)
+
+    report = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        if cv:
+            start_time = time.perf_counter()
+            scores = cross_validate(
+                estimator, X, y, cv=KFold(cv, shuffle=True, random_state=RANDOM_STATE),
+                scoring='neg_root_mean_squared_error', n_jobs=n_jobs
+            )
+            report['cv_seconds'] = time.perf_counter() - start_time
+            report['cv_rmse'] = (-scores['test_score']).tolist()
+        elif holdout:
+            start_time = time.perf_counter()
+            X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=holdout, random_state=RANDOM_STATE)
+            preliminary = clone(estimator).fit(X_train, y_train)
+            report['holdout_seconds'] = time.perf_counter() - start_time
+            report['holdout_rmse'] = float(root_mean_squared_error(y_test, preliminary.predict(X_test)))
+        start_time = time.perf_counter()
+        estimator.fit(X, y)
+        report['fit_seconds'] = time.perf_counter() - start_time
+
+    # The cache is a training concern: the saved model does not refer to it
+    if model != 'catboost':
+        estimator.set_params(memory=None, processor__memory=None)
+    return estimator, report
+
+def continue_training(model, X, y, iterations: int = TRAINING_INCREMENTAL_ITERATIONS) -> tuple:
+    """
+    Continues the training of a fitted model on new rows.
+
+    The CatBoost regressor is trained further from the fitted one (CatBoost `init_model`),
+    adding `iterations` trees; the fitted feature engineering of a pipeline is kept as is.
+
+    Args:
+        model: Fitted pipeline of `pipeline.py`, or a fitted CatBoost regressor.
+        X (pd.DataFrame): New features with the REQUIRED_PARAMS columns.
+        y (pd.Series): New prices.
+        iterations (int): Number of boosting iterations to add.
+
+    Returns:
+        tuple: New fitted model (the given model is not changed), and a dictionary with the fit seconds.
+    """
+    is_pipeline = isinstance(model, Pipeline)
+    regressor = model['regressor'] if is_pipeline else model
+    continued = CatBoostRegressor(**dict(regressor.get_params(), iterations=iterations))
+
+    start_time = time.perf_counter()
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        continued.fit(model['processor'].transform(X) if is_pipeline else X, y, init_model=regressor)
+    report = {'fit_seconds': time.perf_counter() - start_time}
+
+    if is_pipeline:
+        continued = Pipeline([('processor', model['processor']), ('regressor', continued)])
+    return continued, report
+
+def _meta_path(model_path: str) -> str:
+    """Returns the path of the training history sidecar of a model file."""
+    return f"{model_path}.json"
+
+def _save_model(model, meta: dict, model_path: str, artifact_path: str = None):
+    """
+    Saves a model pickle and optionally its serving artifact, each with its training history sidecar.
+
+    Args:
+        model: Fitted model.
+        meta (dict): Training history and watermark of the model, None for a model trained outside
+            the training table (the sidecars of a previous model are removed).
+        model_path (str): Path of the model pickle.
+        artifact_path (str): Path of the serving artifact, None to skip it.
+    """
+    # Write aside and rename, so that a watching service never reads a partial file
+    with open(model_path + '.tmp', 'wb') as model_file:
+        pickle.dump(model, model_file)
+    os.replace(model_path + '.tmp', model_path)
+    paths = [model_path]
+    if artifact_path:
+        from services.app.model_artifact import save_artifact
+        save_artifact(model, artifact_path)
+        paths.append(artifact_path)
+    for path in paths:
+        if meta is None:
+            if os.path.exists(_meta_path(path)):
+                os.remove(_meta_path(path))
+            continue
+        with open(_meta_path(path), 'w') as meta_file:
+            json.dump(meta, meta_file, indent=2)
+
+def save_reference_profile(model, X, paths: list):
+    """
+    Saves the reference profile of training data and of the model's predictions next to model files.
+
+    Args:
+        model: Fitted model.
+        X (pd.DataFrame): Training features with the REQUIRED_PARAMS columns.
+        paths (list): Paths of the model files; the profile is saved as '<path>.profile.json'.
+    """
+    sample = X.sample(PROFILE_ROWS, random_state=RANDOM_STATE) if len(X) > PROFILE_ROWS else X
+    profile = build_profile(sample, model.predict(sample))
+    for path in paths:
+        save_profile(profile, f"{path}.profile.json")
+
+def save_building_store(X, paths: list, update: bool = False):
+    """
+    Saves the building table of training data next to model files.
+
+    Args:
+        X (pd.DataFrame): Training features with the REQUIRED_PARAMS columns.
+        paths (list): Paths of the model files; the table is saved as '<path>.buildings.npy'.
+        update (bool): Whether to add the buildings of X to the existing tables.
+    """
+    for path in paths:
+        store = load_building_store(f"{path}.buildings.npy") if update else None
+        table = build_building_table(X, store.values if store is not None else None)
+        save_building_table(table, f"{path}.buildings.npy")
+
+def summarize_history(history: list) -> dict:
+    """
+    Compares the timings and metrics of the full and incremental retrains of a training history.
+
+    Each retrain measures the RMSE of the replaced model on the new rows before training on them,
+    so the models of both kinds are compared on rows they have not seen.
+
+    Args:
+        history (list): Retrains of the training history, oldest first.
+
+    Returns:
+        dict: By kind ('full', 'incremental'): number of retrains, mean load and fit seconds,
+            and mean RMSE on the rows of the next retrain of the models it produced.
+    """
+    summary = {}
+    for kind in ['full', 'incremental']:
+        runs = [run for run in history if run['mode'] == kind]
+        unseen_rmse = [run['previous_rmse'] for run in history
+                       if run.get('previous_mode') == kind and run.get('previous_rmse') is not None]
+        summary[kind] = {
+            'retrains': len(runs),
+            'load_seconds': float(np.mean([run['load_seconds'] for run in runs])) if runs else None,
+            'fit_seconds': float(np.mean([run['fit_seconds'] for run in runs])) if runs else None,
+            'next_rows_rmse': float(np.mean(unseen_rmse)) if unseen_rmse else None,
+        }
+    return summary
+
+def retrain(connect, model_path: str = MODEL_NAME, mode: str = 'auto', artifact_path: str = None,
+            full_retrain_days: float = TRAINING_FULL_RETRAIN_DAYS,
+            drift_threshold: float = TRAINING_DRIFT_THRESHOLD,
+            incremental_iterations: int = TRAINING_INCREMENTAL_ITERATIONS, holdout: float = TRAINING_HOLDOUT,
+            refresh: bool = False, snapshot_dir: str = SNAPSHOT_DIR, **train_params) -> tuple:
+    """
+    Retrains the saved model fully or incrementally, and saves it with its training history.
+
+    In 'auto' mode the retrain is incremental when the model has a training history, its last
+    full retrain is recent and its RMSE on the new rows has not drifted from its reference RMSE
+    (the mean cross-validation RMSE of the last full retrain, or its holdout RMSE when it was
+    not cross-validated). A history without a reference RMSE gets a full retrain.
+
+    Args:
+        connect (callable): Function returning the SQLAlchemy engine of the training table.
+        model_path (str): Path of the model pickle, read by incremental retrains and overwritten.
+        mode (str): 'auto', 'full' or 'incremental' (no schedule or drift fallback).
+        artifact_path (str): Path of the serving artifact to write as well, None to skip it.
+        full_retrain_days (float): Maximum age of the last full retrain, in days.
+        drift_threshold (float): Maximum ratio of the RMSE on the new rows to the reference RMSE.
+        incremental_iterations (int): Number of boosting iterations added by an incremental retrain.
+        holdout (float): Share of the rows held out by a full retrain without cross-validation
+            to measure the reference RMSE.
+        refresh (bool): Whether a full retrain reads the database even if a valid snapshot exists;
+            a full retrain replacing a model with a history always reads the database.
+        snapshot_dir (str): Directory of the training data snapshots.
+        **train_params: Parameters of `train_model` of a full retrain.
+
+    Returns:
+        tuple: Saved model (None if an incremental retrain found no new rows), and its training
+            history: watermark, last full retrain time, reference RMSE, retrains and their summary.
+    """
+    meta = None
+    if os.path.exists(model_path) and os.path.exists(_meta_path(model_path)):
+        with open(_meta_path(model_path)) as meta_file:
+            meta = json.load(meta_file)
+    run = {'started_at': time.time()}
+
+    if meta is None:
+        run['reason'] = 'no training history'
+    elif mode == 'full':
+        run['reason'] = 'requested'
+    elif mode == 'auto' and time.time() - meta['last_full_at'] > full_retrain_days * 86400:
+        run['reason'] = 'schedule'
+    elif mode == 'auto' and meta['reference_rmse'] is None:
+        run['reason'] = 'no reference RMSE'
+    else:
+        with open(model_path, 'rb') as model_file:
+            previous = pickle.load(model_file)
+        start_time = time.perf_counter()
+        new_data, data_info = load_training_data(connect, since=meta['watermark'])
+        run['load_seconds'] = time.perf_counter() - start_time
+        if not len(new_data):
+            logger.info(f"No rows after watermark {meta['watermark']}, the model is up to date")
+            return None, meta
+
+        X, y = new_data.drop(TARGET, axis=1), new_data[TARGET]
+        run['previous_mode'] = meta['history'][-1]['mode']
+        run['previous_rmse'] = float(root_mean_squared_error(y, previous.predict(X)))
+        reference = meta['reference_rmse']
+        if mode == 'auto' and run['previous_rmse'] > drift_threshold * reference:
+            run['reason'] = f"drift: RMSE {run['previous_rmse']:.0f} on new rows, reference {reference:.0f}"
+        else:
+            model, report = continue_training(previous, X, y, iterations=incremental_iterations)
+            run.update(mode='incremental', reason='new rows', rows=len(new_data),
+                       watermark=data_info['watermark'], fit_seconds=report['fit_seconds'])
+            meta.update(watermark=data_info['watermark'],
+                        rows=meta['rows'] + len(new_data), history=meta['history'] + [run])
+            meta['summary'] = summarize_history(meta['history'])
+            _save_model(model, meta, model_path, artifact_path)
+            save_building_store(X, [path for path in [model_path, artifact_path] if path], update=True)
+            return model, meta
+
+    # Full retrain on the whole table
+    start_time = time.perf_counter()
+    data, data_info = load_training_data(connect, snapshot_dir=snapshot_dir, refresh=refresh or meta is not None)
+    run['load_seconds'] = time.perf_counter() - start_time
+    model, report = train_model(data.drop(TARGET, axis=1), data[TARGET], holdout=holdout, **train_params)
+    run.update(mode='full', rows=len(data), watermark=data_info['watermark'], fit_seconds=report['fit_seconds'])
+    if 'holdout_rmse' in report:
+        run.update(holdout_seconds=report['holdout_seconds'], holdout_rmse=report['holdout_rmse'])
+    history = (meta['history'] if meta else []) + [run]
+    meta = {
+        'model': train_params.get('model', 'pipeline'),
+        'watermark': data_info['watermark'],
+        'rows': len(data),
+        'last_full_at': run['started_at'],
+        'reference_rmse': float(np.mean(report['cv_rmse'])) if 'cv_rmse' in report else report.get('holdout_rmse'),
+        'history': history,
+        'summary': summarize_history(history),
+    }
+    _save_model(model, meta, model_path, artifact_path)
+    paths = [path for path in [model_path, artifact_path] if path]
+    save_reference_profile(model, data.drop(TARGET, axis=1), paths)
+    save_building_store(data.drop(TARGET, axis=1), paths)
+    return model, meta
+
+def compare_training(n_rows: int, n_jobs: int = -1, **train_params) -> dict:
+    """
+    Measures the training wall-clock time of sequential, parallel and cached runs on synthetic data.
+
+    Args:
+        n_rows (int): Number of synthetic rows.
+        n_jobs (int): Number of parallel jobs of the parallel runs.
+        **train_params: Parameters of `train_model` (k_features, sfs_batch, regressor_params).
+
+    Returns:
+        dict: Fit seconds by run: 'sequential' (one job, no cache), 'parallel' (no cache),
+            'cold_cache' (parallel, empty cache), 'regressor_change' (parallel, cache warmed
+            by the previous run, other regressor parameters).
+    """
+    X, y = synthetic_flats(n_rows)
+    regressor_params = train_params.pop('regressor_params', None) or {}
+    changed_params = dict(regressor_params, depth=regressor_params.get('depth', 9) - 2)
+    with tempfile.TemporaryDirectory() as cache_dir:
+        runs = {
+            'sequential': dict(n_jobs=1, cache_dir=None, regressor_params=regressor_params),
+            'parallel': dict(n_jobs=n_jobs, cache_dir=None, regressor_params=regressor_params),
+            'cold_cache': dict(n_jobs=n_jobs, cache_dir=cache_dir, regressor_params=regressor_params),
+            'regressor_change': dict(n_jobs=n_jobs, cache_dir=cache_dir, regressor_params=changed_params),
+        }
+        return {name: train_model(X, y, **params, **train_params)[1]['fit_seconds'] for name, params in runs.items()}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Training of the model pipeline")
+    parser.add_argument('--model', choices=['pipeline', 'catboost'], default='pipeline')
+    parser.add_argument('--n-jobs', type=int, default=-1, help="parallel jobs of the selectors and folds")
+    parser.add_argument('--cache-dir', default=TRAINING_CACHE_DIR, help="directory of the cached stages")
+    parser.add_argument('--no-cache', action='store_true', help="do not cache the pipeline stages")
+    parser.add_argument('--cv', type=int, default=0, help="number of cross-validation folds (0 to skip)")
+    parser.add_argument('--k-features', type=int, default=10)
+    parser.add_argument('--sfs-batch', type=int, default=5000)
+    parser.add_argument('--regressor-params', type=json.loads, default=None,
+                        help="JSON of CatBoostRegressor parameters, e.g. '{\"depth\": 6}'")
+    parser.add_argument('--refresh', action='store_true', help="load the data from the database, not the snapshot")
+    parser.add_argument('--incremental', action='store_true',
+                        help="continue training the saved model on the rows added since it was trained, "
+                             "retraining fully on schedule or on drift")
+    parser.add_argument('--incremental-iterations', type=int, default=TRAINING_INCREMENTAL_ITERATIONS)
+    parser.add_argument('--synthetic', type=int, metavar='ROWS', help="train on a synthetic dataset of this many rows")
+    parser.add_argument('--output', default=MODEL_NAME, help="path of the fitted model pickle")
+    parser.add_argument('--artifact', help="path of the lean serving artifact to write as well")
+    parser.add_argument('--compare', type=int, metavar='ROWS',
+                        help="compare the training time of sequential, parallel and cached runs on synthetic data")
+    args = parser.parse_args()
+
+    if args.compare:
+        times = compare_training(args.compare, n_jobs=args.n_jobs, k_features=args.k_features,
+                                 sfs_batch=args.sfs_batch, regressor_params=args.regressor_params)
+        print(f"{os.cpu_count()} cores, {args.compare} synthetic rows")
+        print(f"{'run':<18} {'fit s':>8}")
+        for name, seconds in times.items():
+            print(f"{name:<18} {seconds:>8.1f}")
+        sys.exit()
+
+    train_params = dict(model=args.model, n_jobs=args.n_jobs, cache_dir=None if args.no_cache else args.cache_dir,
+                        cv=args.cv, k_features=args.k_features, sfs_batch=args.sfs_batch,
+                        regressor_params=args.regressor_params)
+    if args.synthetic:
+        X, y = synthetic_flats(args.synthetic)
+        model, report = train_model(X, y, **train_params)
+        if 'cv_rmse' in report:
+            print(f"Cross-validation RMSE {np.mean(report['cv_rmse']):.0f} ± {np.std(report['cv_rmse']):.0f} "
+                  f"({args.cv} folds, {report['cv_seconds']:.1f} s)")
+        print(f"Fitted in {report['fit_seconds']:.1f} s")
+
+        # Save the trained model to a pickle file, and its serving artifact
+        _save_model(model, None, args.output, args.artifact)
+        print(f'Fitted model saved to {args.output}')
+        if args.artifact:
+            print(f'Serving artifact saved to {args.artifact}')
+        save_reference_profile(model, X, [path for path in [args.output, args.artifact] if path])
+        print(f'Reference profile saved to {args.output}.profile.json')
+        save_building_store(X, [path for path in [args.output, args.artifact] if path])
+        print(f'Building table saved to {args.output}.buildings.npy')
+        sys.exit()
+
+    from sqlalchemy import create_engine
+    from services.models.data_loader import database_url
+
+    # Train on the local snapshot or the database, or only on the new rows if incremental
+    try:
+        model, meta = retrain(lambda: create_engine(database_url()), model_path=args.output,
+                              mode='auto' if args.incremental else 'full', artifact_path=args.artifact,
+                              incremental_iterations=args.incremental_iterations, refresh=args.refresh,
+                              **train_params)
+    except RuntimeError as e:
+        print(f"Cannot create model: {e}")
+        sys.exit()
+    if model is None:
+        print(f"No new rows after watermark {meta['watermark']}, {args.output} is up to date")
+        sys.exit()
+
+    run = meta['history'][-1]
+    print(f"{run['mode'].capitalize()} retrain ({run['reason']}) on {run['rows']} rows up to watermark "
+          f"{run['watermark']}: loaded in {run['load_seconds']:.1f} s, fitted in {run['fit_seconds']:.1f} s")
+    if run.get('previous_rmse') is not None:
+        print(f"RMSE of the previous model on the new rows {run['previous_rmse']:.0f}")
+    if run.get('holdout_rmse') is not None:
+        print(f"Holdout RMSE {run['holdout_rmse']:.0f} ({run['holdout_seconds']:.1f} s), reference of the drift check")
+    print(f"Fitted model saved to {args.output}" + (f" and {args.artifact}" if args.artifact else "")
+          + f", training history in {args.output}.json, reference profile in {args.output}.profile.json, "
+          + f"building table in {args.output}.buildings.npy")
+    print(f"{'retrains':<12} {'count':>6} {'load s':>8} {'fit s':>8} {'next rows RMSE':>15}")
+    for kind, stats in meta['summary'].items():
+        cells = [f"{stats[key]:>8.1f}" if stats[key] is not None else f"{'-':>8}"
+                 for key in ['load_seconds', 'fit_seconds']]
+        rmse = f"{stats['next_rows_rmse']:>15.0f}" if stats['next_rows_rmse'] is not None else f"{'-':>15}"
+        print(f"{kind:<12} {stats['retrains']:>6} {' '.join(cells)} {rmse}")
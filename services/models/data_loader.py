@@ -0,0 +1,345 @@
+"""
+services/models/data_loader.py
+
+This module loads the training data of the model with bounded memory and caches it locally.
+
+1. Selects only the model parameters and the target from the training table, instead of
+   `SELECT *`, and reads them in chunks through a server-side cursor.
+2. Downcasts each chunk as it arrives to the types implied by PARAM_RANGES of the serving
+   schema (int8/int16/int32 for integer parameters). Float parameters stay float64, the type
+   they are served with, since float32 would round coordinates and heights. A column whose
+   values do not fit keeps its type, so downcasting never changes a value.
+3. Writes the loaded table as a local Parquet snapshot with a sidecar file of its content
+   hash. Repeat loads read the snapshot and skip the database entirely; a snapshot whose
+   hash does not match, or older than TRAINING_SNAPSHOT_MAX_AGE, is loaded again from the
+   database, so new rows are picked up without `--refresh`.
+4. Records the watermark of the loaded data (the largest row ID), and loads only the rows
+   added after a given watermark for incremental retraining, directly from the database.
+5. When run as a script, compares the load time and peak memory of `SELECT *` with default
+   dtypes, of the chunked typed load and of the snapshot, against the configured database
+   or a synthetic SQLite stand-in.
+
+The target is kept as float64 so that training is not affected by rounding of prices.
+
+Key Components:
+- TABLE_NAME, TARGET, TRAINING_COLUMNS: Training table, target and loaded columns.
+- WATERMARK_COLUMN: Increasing row ID column of the training table.
+- TRAINING_CHUNK_SIZE: Number of rows fetched at a time (environment variable).
+- SNAPSHOT_DIR: Directory of the local snapshots (environment variable).
+- SNAPSHOT_MAX_AGE: Age in seconds after which a snapshot is loaded again (environment variable).
+- COLUMN_DTYPES: Downcast type of each model parameter.
+- database_url: Function building the database URL from the environment.
+- downcast: Function downcasting a chunk where it is safe.
+- read_table: Function reading the training columns in chunks.
+- load_training_data: Function loading the training data from the snapshot or the database.
+- write_synthetic_table: Function writing a synthetic stand-in of the training table.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+from services.app.fastapi_handler import REQUIRED_PARAMS
+from services.app.logger import get_logger
+from services.app.schemas import PARAM_RANGES
+
+logger = get_logger(__name__)
+
+# Training table, target and loaded columns
+TABLE_NAME = 'clean_flats'
+TARGET = 'price'
+TRAINING_COLUMNS = REQUIRED_PARAMS + [TARGET]
+
+# Increasing row ID of the training table, whose largest loaded value is the watermark of the data
+WATERMARK_COLUMN = 'id'
+
+# Number of rows fetched from the database at a time
+TRAINING_CHUNK_SIZE = int(os.getenv('TRAINING_CHUNK_SIZE', 50000))
+
+# Directory of the local snapshots of the training data
+SNAPSHOT_DIR = os.getenv('TRAINING_SNAPSHOT_DIR', 'services/models/snapshots')
+
+# Age in seconds after which a snapshot is loaded again from the database (a day by default)
+SNAPSHOT_MAX_AGE = float(os.getenv('TRAINING_SNAPSHOT_MAX_AGE', 24 * 3600))
+
+# Environment variables of the database connection
+ENV_VARS = [
+    'DB_DESTINATION_USER',
+    'DB_DESTINATION_PASSWORD',
+    'DB_DESTINATION_HOST',
+    'DB_DESTINATION_PORT',
+    'DB_DESTINATION_NAME'
+]
+
+def _smallest_int(minimum: int, maximum: int) -> str:
+    """Returns the smallest signed integer type holding a range (int32 if unbounded)."""
+    if minimum is None or maximum is None:
+        return 'int32'
+    for dtype in ['int8', 'int16']:
+        if np.iinfo(dtype).min <= minimum and maximum <= np.iinfo(dtype).max:
+            return dtype
+    return 'int32'
+
+# Downcast type of each model parameter, from the ranges of the serving schema; float
+# parameters keep float64, as float32 would not hold the values served to the model
+COLUMN_DTYPES = {
+    param: _smallest_int(minimum, maximum) if param_type is int else 'float64'
+    for param, (param_type, minimum, maximum) in PARAM_RANGES.items()
+}
+
+def database_url() -> str:
+    """
+    Builds the database URL from the environment.
+
+    TRAINING_DATABASE_URL (e.g. a SQLite file) takes precedence over the PostgreSQL
+    connection variables of the .env file.
+
+    Returns:
+        str: SQLAlchemy database URL.
+
+    Raises:
+        RuntimeError: If the connection variables are not defined.
+    """
+    if os.getenv('TRAINING_DATABASE_URL'):
+        return os.environ['TRAINING_DATABASE_URL']
+    from dotenv import load_dotenv
+    load_dotenv(dotenv_path='/.env')
+    if not all(_ in os.environ for _ in ENV_VARS):
+        raise RuntimeError("Database environment variables are not defined, check .env file.")
+    return (
+        f"postgresql://{os.getenv('DB_DESTINATION_USER')}:"
+        f"{os.getenv('DB_DESTINATION_PASSWORD')}@"
+        f"{os.getenv('DB_DESTINATION_HOST')}:"
+        f"{os.getenv('DB_DESTINATION_PORT')}/"
+        f"{os.getenv('DB_DESTINATION_NAME')}"
+    )
+
+def _fits(values: pd.Series, dtype: str) -> bool:
+    """
+    Checks whether a column can be cast to a type without changing any value.
+
+    Args:
+        values (pd.Series): Column values.
+        dtype (str): Target type.
+
+    Returns:
+        bool: True if every value is the same after the cast.
+    """
+    if values.dtype == bool or not len(values):
+        return True
+    if not pd.api.types.is_numeric_dtype(values) or values.isna().any():
+        return False
+    if np.issubdtype(np.dtype(dtype), np.integer):
+        info = np.iinfo(dtype)
+        return bool((values % 1 == 0).all() and values.min() >= info.min and values.max() <= info.max)
+    return bool((values.astype(dtype) == values).all())
+
+def downcast(chunk: pd.DataFrame) -> pd.DataFrame:
+    """
+    Downcasts the model parameters of a chunk to COLUMN_DTYPES where the values fit.
+
+    Args:
+        chunk (pd.DataFrame): Chunk of the training table.
+
+    Returns:
+        pd.DataFrame: Chunk with downcast columns; columns that do not fit keep their type.
+    """
+    casts = {}
+    for column, dtype in COLUMN_DTYPES.items():
+        if column not in chunk:
+            continue
+        if _fits(chunk[column], dtype):
+            casts[column] = dtype
+        else:
+            logger.warning(f"Column {column} does not fit {dtype}, keeping {chunk[column].dtype}")
+    return chunk.astype(casts)
+
+def read_table(engine, table: str = TABLE_NAME, columns: list = TRAINING_COLUMNS,
+               chunk_size: int = TRAINING_CHUNK_SIZE, since: int = None) -> pd.DataFrame:
+    """
+    Reads columns of a table in chunks through a server-side cursor, downcasting each chunk.
+
+    Peak memory is the downcast table plus one chunk in default types.
+
+    Args:
+        engine: SQLAlchemy engine.
+        table (str): Table name.
+        columns (list): Columns to read.
+        chunk_size (int): Number of rows fetched at a time.
+        since (int): Watermark; only the rows with a larger WATERMARK_COLUMN are read if given.
+
+    Returns:
+        pd.DataFrame: Table with downcast columns.
+    """
+    query = f"SELECT {', '.join(columns)} FROM {table}"
+    if since is not None:
+        query += f" WHERE {WATERMARK_COLUMN} > {int(since)}"
+    with engine.connect() as connection:
+        connection = connection.execution_options(stream_results=True, max_row_buffer=chunk_size)
+        chunks = [downcast(chunk) for chunk in pd.read_sql(query, connection, chunksize=chunk_size)]
+    if not chunks:
+        return pd.DataFrame(columns=columns)
+    # Chunks with a column that did not fit are combined in the wider type
+    return pd.concat(chunks, ignore_index=True)
+
+def _file_hash(path: str) -> str:
+    """Returns the SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as snapshot_file:
+        for block in iter(lambda: snapshot_file.read(2**20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def snapshot_path(snapshot_dir: str = SNAPSHOT_DIR, table: str = TABLE_NAME,
+                  columns: list = TRAINING_COLUMNS) -> str:
+    """
+    Returns the path of the snapshot of a query, keyed by the table, columns and types.
+
+    Args:
+        snapshot_dir (str): Directory of the snapshots.
+        table (str): Table name.
+        columns (list): Loaded columns.
+
+    Returns:
+        str: Path of the Parquet snapshot.
+    """
+    query_key = json.dumps({'table': table, 'columns': columns, 'dtypes': COLUMN_DTYPES}, sort_keys=True)
+    return os.path.join(snapshot_dir, f"{table}-{hashlib.sha256(query_key.encode()).hexdigest()[:12]}.parquet")
+
+def load_training_data(connect, snapshot_dir: str = SNAPSHOT_DIR, table: str = TABLE_NAME,
+                       columns: list = TRAINING_COLUMNS, chunk_size: int = TRAINING_CHUNK_SIZE,
+                       refresh: bool = False, since: int = None,
+                       max_age: float = SNAPSHOT_MAX_AGE) -> tuple:
+    """
+    Loads the training data from the local snapshot, or from the database into a new snapshot.
+
+    The rows added after a watermark are always loaded from the database, without a snapshot.
+
+    Args:
+        connect (callable): Function returning the SQLAlchemy engine, called only if the
+            snapshot is missing, stale or refreshed.
+        snapshot_dir (str): Directory of the snapshots, None to always read the database
+            without writing a snapshot.
+        table (str): Table name.
+        columns (list): Columns to load.
+        chunk_size (int): Number of rows fetched at a time.
+        refresh (bool): Whether to read the database even if a valid snapshot exists.
+        since (int): Watermark; only the rows added after it are loaded if given.
+        max_age (float): Age in seconds after which the snapshot is loaded again.
+
+    Returns:
+        tuple: Training DataFrame, and a dictionary with the source ('snapshot' or 'database'),
+            the snapshot path, its content hash, the number of rows and the watermark of the
+            data (`since` if no rows were added after it).
+    """
+    path = snapshot_path(snapshot_dir, table, columns) if snapshot_dir is not None and since is None else None
+    meta_path = f"{path}.json" if path is not None else None
+    if path is not None and not refresh and os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path) as meta_file:
+            meta = json.load(meta_file)
+        # Snapshots written before watermarks were recorded are loaded again
+        fresh = time.time() - meta['created_at'] <= max_age
+        if fresh and meta['content_hash'] == _file_hash(path) and 'watermark' in meta:
+            return pd.read_parquet(path), dict(meta, source='snapshot', path=path)
+        logger.warning(f"Snapshot {path} is outdated, expired or does not match its content hash, "
+                       "loading from the database")
+
+    data = read_table(connect(), table, columns + [WATERMARK_COLUMN], chunk_size, since=since)
+    watermark = int(data[WATERMARK_COLUMN].max()) if len(data) else since
+    data = data.drop(columns=WATERMARK_COLUMN)
+    meta = {'table': table, 'columns': columns, 'rows': len(data), 'watermark': watermark,
+            'created_at': time.time()}
+    if path is None:
+        return data, dict(meta, source='database', path=None, content_hash=None)
+
+    # Write aside and rename, so that an interrupted load never leaves a partial snapshot
+    os.makedirs(snapshot_dir, exist_ok=True)
+    data.to_parquet(path + '.tmp', index=False)
+    os.replace(path + '.tmp', path)
+    meta['content_hash'] = _file_hash(path)
+    with open(meta_path, 'w') as meta_file:
+        json.dump(meta, meta_file, indent=2)
+    return data, dict(meta, source='database', path=path)
+
+def write_synthetic_table(url: str, n_rows: int, table: str = TABLE_NAME):
+    """
+    Writes a synthetic stand-in of the training table, with the id columns of the real table.
+
+    Args:
+        url (str): SQLAlchemy database URL (e.g. 'sqlite:///flats.db').
+        n_rows (int): Number of rows.
+        table (str): Table name.
+    """
+    from sqlalchemy import create_engine
+    from services.models.pipeline import synthetic_flats
+
+    X, y = synthetic_flats(n_rows)
+    data = pd.concat([X, y], axis=1)
+    data.insert(0, 'flat_id', np.arange(n_rows))
+    data.insert(0, 'id', np.arange(n_rows))
+    data.to_sql(table, create_engine(url), if_exists='replace', index=False, chunksize=TRAINING_CHUNK_SIZE)
+
+# Measures a load in a fresh interpreter: 'select_all' is the previous path of create_model.py
+LOAD_PROBE = """
+import json, sys, time
+import pandas as pd
+from sqlalchemy import create_engine
+from services.models import data_loader
+mode, url, snapshot_dir = sys.argv[1:4]
+start_time = time.perf_counter()
+if mode == 'select_all':
+    data = pd.read_sql(sql=f'SELECT * FROM {data_loader.TABLE_NAME}', con=create_engine(url))
+    data = data.drop(['id', 'flat_id'], axis=1)
+else:
+    data, _ = data_loader.load_training_data(lambda: create_engine(url), snapshot_dir=snapshot_dir,
+                                             refresh=mode == 'chunked')
+print(json.dumps({
+    'seconds': time.perf_counter() - start_time,
+    'max_rss_mib': int(next(line for line in open('/proc/self/status') if line.startswith('VmHWM')).split()[1]) / 1024,
+    'frame_mib': data.memory_usage(deep=True).sum() / 2**20,
+}))
+"""
+
+def compare_loads(url: str, snapshot_dir: str) -> dict:
+    """
+    Measures the load time and peak memory of each load path in a fresh interpreter.
+
+    Args:
+        url (str): SQLAlchemy database URL.
+        snapshot_dir (str): Directory of the snapshots.
+
+    Returns:
+        dict: Seconds, peak RSS and DataFrame size in MiB of 'select_all', 'chunked' and 'snapshot'.
+    """
+    env = dict(os.environ, LOG_LEVEL='WARNING')
+    return {
+        mode: json.loads(subprocess.run(
+            [sys.executable, '-c', LOAD_PROBE, mode, url, snapshot_dir],
+            env=env, check=True, capture_output=True, text=True
+        ).stdout.splitlines()[-1])
+        for mode in ['select_all', 'chunked', 'snapshot']
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load time and peak memory of the training data loaders")
+    parser.add_argument('--url', help="database URL (default: TRAINING_DATABASE_URL or the .env connection)")
+    parser.add_argument('--synthetic', type=int, metavar='ROWS',
+                        help="write a synthetic SQLite stand-in of the table with this many rows and use it")
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR)
+    args = parser.parse_args()
+
+    url = args.url
+    if args.synthetic:
+        url = f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='flats_'), 'flats.db')}"
+        write_synthetic_table(url, args.synthetic)
+        print(f"Synthetic table of {args.synthetic} rows written to {url}")
+    results = compare_loads(url or database_url(), args.snapshot_dir)
+    print(f"{'load path':<12} {'seconds':>8} {'peak RSS MiB':>13} {'frame MiB':>10}")
+    for mode, result in results.items():
+        print(f"{mode:<12} {result['seconds']:>8.2f} {result['max_rss_mib']:>13.1f} {result['frame_mib']:>10.1f}")
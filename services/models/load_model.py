@@ -5,7 +5,9 @@ This script loads a pre-trained model from an S3 bucket, saves it locally, and
 generates a random prediction using the loaded model.
 
 1. Loads environment variables for S3 and AWS credentials.
-2. Downloads the model file from the specified S3 bucket.
+2. Fetches the model file from the specified S3 bucket through the local model cache of
+   `model_fetcher.py`: the download is skipped when the object has not changed, and the
+   file is verified and replaced atomically when it has.
 3. Loads the model using joblib.
 4. Generates a random set of model parameters and makes a prediction.
 
@@ -23,6 +25,7 @@ import boto3
 import joblib
 from random import randint, uniform
 from services.app import fastapi_handler
+from services.models.model_fetcher import ChecksumError, fetch_model
 
 # Constants
 MODEL_NAME = 'services/models/loaded_model.pkl'
@@ -39,8 +42,7 @@ load_dotenv(dotenv_path='/.env')
 
 # Check if all required environment variables are defined
 if not all(_ in os.environ for _ in ENV_VARS):
-    print("Cannot load model: environment variables are not defined, check .env file.")
-    sys.exit()
+    sys.exit("Cannot load model: environment variables are not defined, check .env file.")
 
 # Create an S3 client
 s3_client = boto3.client(
@@ -50,8 +52,13 @@ s3_client = boto3.client(
     endpoint_url=os.environ['MLFLOW_S3_ENDPOINT_URL']
 )
 
-# Download the model file from the S3 bucket
-s3_client.download_file(os.getenv('S3_BUCKET_NAME'), os.getenv('MODEL_FILE_KEY'), MODEL_NAME)
+# Fetch the model file from the S3 bucket unless the cached copy is current
+try:
+    fetch_info = fetch_model(s3_client, os.getenv('S3_BUCKET_NAME'), os.getenv('MODEL_FILE_KEY'), MODEL_NAME)
+except ChecksumError as e:
+    sys.exit(f"Cannot load model: {e}")
+print(f"Model file {'downloaded' if fetch_info['downloaded'] else 'found in the cache'} "
+      f"in {fetch_info['seconds']:.1f} s (SHA-256 {fetch_info['sha256'][:12]})")
 
 # Load the model using joblib
 model = joblib.load(MODEL_NAME)
@@ -0,0 +1,247 @@
+"""
+services/models/model_fetcher.py
+
+This module fetches the model file from S3 through a local content-addressed cache.
+
+1. Reads the ETag, version and size of the S3 object with a HEAD request, and compares them
+   with the reference of the last fetch of the same object. When they match and the cached
+   file still has the recorded SHA-256, the download is skipped.
+2. Otherwise downloads the object in parallel ranged GETs of FETCH_PART_SIZE bytes, each
+   conditional on the ETag of the HEAD request, so that an object replaced mid-download
+   fails instead of mixing two versions.
+3. Verifies the downloaded file against the checksum published with the object: the
+   'sha256' user metadata if present, otherwise the ETag when it is the MD5 of the content
+   (single-part uploads). Multipart ETags without 'sha256' metadata only get a size check.
+4. Stores verified files under their SHA-256 in the cache, and links (or copies) them to the
+   destination with an atomic rename, so a half-written model file is never loaded.
+   A destination that already holds the cached file is not touched, so a watching service
+   does not reload it.
+5. Removes the cached file of the previous version of an object once no fetched object
+   refers to it; destinations linked to it keep their content.
+6. Serializes fetches of the same object through a lock file, so replicas sharing the cache
+   directory on a host download each version once.
+
+Key Components:
+- MODEL_CACHE_DIR: Directory of the cached model files (environment variable).
+- FETCH_PART_SIZE: Size of the ranged GETs of a download (environment variable).
+- FETCH_WORKERS: Number of parallel ranged GETs (environment variable).
+- ChecksumError: Exception raised when a downloaded file does not match its checksum.
+- upload_model: Function uploading a model file with its SHA-256 as metadata.
+- fetch_model: Function fetching a model file through the cache.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+from services.app.logger import get_logger
+
+# Directory of the cached model files and of the references of the fetched objects
+MODEL_CACHE_DIR = os.getenv('MODEL_CACHE_DIR', 'services/models/model_cache')
+
+# Size of the ranged GETs of a download, in bytes
+FETCH_PART_SIZE = int(os.getenv('FETCH_PART_SIZE', 8 * 2**20))
+
+# Number of parallel ranged GETs of a download
+FETCH_WORKERS = int(os.getenv('FETCH_WORKERS', 8))
+
+# User metadata key of the SHA-256 of the object content
+SHA256_METADATA = 'sha256'
+
+logger = get_logger(__name__)
+
+class ChecksumError(Exception):
+    """
+    Raised when a downloaded file does not match the checksum or size published with the object.
+    """
+
+def _file_digest(path: str, algorithm: str = 'sha256') -> str:
+    """Returns the hex digest of a file's contents."""
+    digest = hashlib.new(algorithm)
+    with open(path, 'rb') as model_file:
+        for block in iter(lambda: model_file.read(2**20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def upload_model(s3_client, path: str, bucket: str, key: str) -> dict:
+    """
+    Uploads a model file with the SHA-256 of its content as 'sha256' user metadata.
+
+    Args:
+        s3_client: boto3 S3 client.
+        path (str): Path of the model file.
+        bucket (str): S3 bucket.
+        key (str): S3 object key.
+
+    Returns:
+        dict: Response of the upload.
+    """
+    with open(path, 'rb') as model_file:
+        return s3_client.put_object(Bucket=bucket, Key=key, Body=model_file,
+                                    Metadata={SHA256_METADATA: _file_digest(path)})
+
+def _download(s3_client, bucket: str, key: str, head: dict, path: str, part_size: int, workers: int):
+    """
+    Downloads an object in parallel ranged GETs conditional on its ETag.
+
+    Args:
+        s3_client: boto3 S3 client.
+        bucket (str): S3 bucket.
+        key (str): S3 object key.
+        head (dict): Response of the HEAD request of the object.
+        path (str): Path of the file to write.
+        part_size (int): Size of the ranged GETs, in bytes.
+        workers (int): Number of parallel ranged GETs.
+    """
+    size = head['ContentLength']
+    version = {'VersionId': head['VersionId']} if head.get('VersionId') else {}
+
+    def get_part(start: int):
+        end = min(start + part_size, size) - 1
+        body = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}",
+                                    IfMatch=head['ETag'], **version)['Body'].read()
+        if len(body) != end - start + 1:
+            raise ChecksumError(f"Part at {start} of s3://{bucket}/{key} has {len(body)} bytes, "
+                                f"expected {end - start + 1}")
+        os.pwrite(fd, body, start)
+
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        os.ftruncate(fd, size)
+        starts = range(0, size, part_size)
+        if len(starts) <= 1 or workers <= 1:
+            for start in starts:
+                get_part(start)
+        else:
+            with ThreadPoolExecutor(max_workers=min(workers, len(starts))) as executor:
+                # Consume the results to raise the error of a failed part
+                list(executor.map(get_part, starts))
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def _verify(path: str, head: dict) -> str:
+    """
+    Verifies a downloaded file against the checksum published with the object.
+
+    Args:
+        path (str): Path of the downloaded file.
+        head (dict): Response of the HEAD request of the object.
+
+    Returns:
+        str: SHA-256 of the file.
+
+    Raises:
+        ChecksumError: If the file does not match the size, 'sha256' metadata or MD5 ETag of the object.
+    """
+    if os.path.getsize(path) != head['ContentLength']:
+        raise ChecksumError(f"Downloaded {os.path.getsize(path)} bytes, expected {head['ContentLength']}")
+    sha256 = _file_digest(path)
+    expected = head.get('Metadata', {}).get(SHA256_METADATA)
+    if expected is not None and expected != sha256:
+        raise ChecksumError(f"SHA-256 {sha256} does not match the object metadata {expected}")
+    etag = head['ETag'].strip('"')
+    if expected is None and '-' not in etag and _file_digest(path, 'md5') != etag:
+        raise ChecksumError(f"MD5 of the file does not match the ETag {etag}")
+    return sha256
+
+def _link(source: str, path: str):
+    """Replaces a file atomically with a hard link to (or, across file systems, a copy of) another file."""
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        os.link(source, tmp_path)
+    except OSError:
+        shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, path)
+
+def _prune(cache_dir: str, sha256: str):
+    """Removes a cached file that is no longer referenced by any fetched object."""
+    refs_dir = os.path.join(cache_dir, 'refs')
+    for name in os.listdir(refs_dir):
+        if name.endswith('.json'):
+            with open(os.path.join(refs_dir, name)) as ref_file:
+                if json.load(ref_file)['sha256'] == sha256:
+                    return
+    blob_path = os.path.join(cache_dir, 'objects', sha256)
+    if os.path.exists(blob_path):
+        os.remove(blob_path)
+
+def fetch_model(s3_client, bucket: str, key: str, path: str, cache_dir: str = MODEL_CACHE_DIR,
+                part_size: int = FETCH_PART_SIZE, workers: int = FETCH_WORKERS) -> dict:
+    """
+    Fetches a model file from S3 through the local cache and places it at a path atomically.
+
+    Args:
+        s3_client: boto3 S3 client.
+        bucket (str): S3 bucket.
+        key (str): S3 object key.
+        path (str): Destination of the model file.
+        cache_dir (str): Directory of the cached model files.
+        part_size (int): Size of the ranged GETs of a download, in bytes.
+        workers (int): Number of parallel ranged GETs of a download.
+
+    Returns:
+        dict: Destination path, SHA-256, ETag and version of the object, whether it was
+            downloaded, whether the destination was replaced, its size and the fetch seconds.
+
+    Raises:
+        ChecksumError: If the downloaded file does not match the checksum of the object.
+    """
+    start_time = time.perf_counter()
+    objects_dir = os.path.join(cache_dir, 'objects')
+    refs_dir = os.path.join(cache_dir, 'refs')
+    os.makedirs(objects_dir, exist_ok=True)
+    os.makedirs(refs_dir, exist_ok=True)
+    ref_path = os.path.join(refs_dir, hashlib.sha256(f"{bucket}/{key}".encode()).hexdigest()[:16] + '.json')
+
+    with open(f"{ref_path}.lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        head = s3_client.head_object(Bucket=bucket, Key=key)
+        ref = None
+        if os.path.exists(ref_path):
+            with open(ref_path) as ref_file:
+                ref = json.load(ref_file)
+
+        cached = (
+            ref is not None
+            and (ref['etag'], ref['version_id']) == (head['ETag'], head.get('VersionId'))
+            and os.path.exists(os.path.join(objects_dir, ref['sha256']))
+            and _file_digest(os.path.join(objects_dir, ref['sha256'])) == ref['sha256']
+        )
+        if cached:
+            sha256 = ref['sha256']
+        else:
+            tmp_path = os.path.join(objects_dir, f"download-{os.getpid()}.tmp")
+            try:
+                _download(s3_client, bucket, key, head, tmp_path, part_size, workers)
+                sha256 = _verify(tmp_path, head)
+            except Exception:
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                raise
+            os.replace(tmp_path, os.path.join(objects_dir, sha256))
+            replaced_sha256 = ref['sha256'] if ref is not None else None
+            ref = {'bucket': bucket, 'key': key, 'etag': head['ETag'], 'version_id': head.get('VersionId'),
+                   'sha256': sha256, 'size': head['ContentLength']}
+            with open(f"{ref_path}.tmp", 'w') as ref_file:
+                json.dump(ref, ref_file, indent=2)
+            os.replace(f"{ref_path}.tmp", ref_path)
+            if replaced_sha256 not in (None, sha256):
+                _prune(cache_dir, replaced_sha256)
+
+        blob_path = os.path.join(objects_dir, sha256)
+        replaced = not (os.path.exists(path) and (os.path.samefile(blob_path, path) or _file_digest(path) == sha256))
+        if replaced:
+            _link(blob_path, path)
+
+    info = {'path': path, 'sha256': sha256, 'etag': head['ETag'], 'version_id': head.get('VersionId'),
+            'downloaded': not cached, 'replaced': replaced, 'bytes': head['ContentLength'],
+            'seconds': time.perf_counter() - start_time}
+    logger.info(f"Model s3://{bucket}/{key} {'downloaded' if not cached else 'found in the cache'}",
+                extra={'sha256': sha256, 'etag': head['ETag'], 'fetch_seconds': info['seconds']})
+    return info
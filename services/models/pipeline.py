@@ -0,0 +1,348 @@
+"""
+services/models/pipeline.py
+
+This module contains the feature engineering pipeline from `model_pipeline.ipynb`.
+
+1. Defines the custom transformers used by the fitted pipeline (vectorized distance feature,
+   AutoFeat wrapper, DataFrame-returning transformers, duplicate column removal,
+   sequential feature selection). The score of a flat does not depend on the other flats
+   of the batch: the distance is standardized with the mean and deviation learned in `fit`,
+   and the AutoFeat one-hot columns of categories absent from a batch are zero.
+2. Builds the full pipeline: preprocessor -> AutoFeat and polynomial features ->
+   duplicate removal -> union of forward and backward SFS selectors -> CatBoost.
+   The selectors can evaluate their candidate subsets in parallel and run concurrently,
+   and the fitted stages can be cached on disk (keyed by the hash of their parameters
+   and input data), so a fit that only changes the regressor reuses the feature engineering.
+3. Generates a synthetic flats dataset for tests and benchmarks.
+
+Key Components:
+- RANDOM_STATE: Random state for reproducibility.
+- PIPELINE_VERSION: Version of the fitted state of the custom transformers.
+- Column groups: NUM_*_COLUMNS, CAT_COLUMNS, KBINS_COLUMNS.
+- FeatureAdder, AutoFeatWrapper, DataFrameColumnTransformer, DuplicatesRemover,
+  CustomSequentialFeatureSelector: Custom transformers of the pipeline.
+- build_pipeline: Function to build the unfitted pipeline.
+- synthetic_flats: Function to generate a synthetic flats dataset.
+"""
+
+import numpy as np
+import pandas as pd
+from autofeat import AutoFeatRegressor
+from catboost import CatBoostRegressor
+from mlxtend.feature_selection import SequentialFeatureSelector
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.compose import ColumnTransformer
+from sklearn.linear_model import Ridge
+from sklearn.metrics import make_scorer, root_mean_squared_error
+from sklearn.pipeline import Pipeline, FeatureUnion
+from sklearn.preprocessing import StandardScaler, KBinsDiscretizer, PowerTransformer, PolynomialFeatures, scale
+from services.app.fastapi_handler import REQUIRED_PARAMS
+from services.models.distance import MOSCOW_CENTER, distance_to_center
+
+# Random state for reproducibility
+RANDOM_STATE = 42
+
+# Version of the fitted state of the custom transformers; a change invalidates the cached stages
+PIPELINE_VERSION = 2
+
+# Column groups of the flats dataset
+NUM_DISCRETE_COLUMNS = ['floor', 'ceiling_height', 'flats_count', 'floors_total']
+NUM_TIME_COLUMNS = ['building_id', 'build_year']
+NUM_AREA_COLUMNS = ['kitchen_area', 'living_area', 'total_area']
+NUM_GEO_COLUMNS = ['latitude', 'longitude']
+CAT_COLUMNS = ['is_apartment', 'rooms', 'building_type_int', 'has_elevator']
+
+# Columns to be transformed using KBinsDiscretizer
+KBINS_COLUMNS = NUM_DISCRETE_COLUMNS + NUM_TIME_COLUMNS + NUM_GEO_COLUMNS
+
+# Custom transformer to add a new feature 'scale__distance' representing the distance to Moscow center,
+# standardized with the mean and deviation of the training distances
+class FeatureAdder(BaseEstimator, TransformerMixin):
+    def fit(self, X, y=None):
+        X_new = pd.DataFrame(X)
+        self.scaler_ = StandardScaler().fit(distance_to_center(X_new['latitude'], X_new['longitude'])[:, None])
+        return self
+
+    def transform(self, X):
+        X_new = pd.DataFrame(X)
+        distance = distance_to_center(X_new['latitude'], X_new['longitude'])
+        if not hasattr(self, 'scaler_'):
+            # Fitted before the statistics were learned: standardized over the batch
+            return pd.DataFrame({'scale__distance': scale(distance)}, index=X_new.index)
+        return pd.DataFrame({'scale__distance': self.scaler_.transform(distance[:, None])[:, 0]}, index=X_new.index)
+
+    def get_feature_names_out(self, input_features=None):
+        return ['scale__distance']
+
+# Wrapper for AutoFeatRegressor to integrate it into scikit-learn pipelines
+class AutoFeatWrapper(BaseEstimator, TransformerMixin):
+    def __init__(self, model):
+        self.model = model
+
+    def fit(self, X, y=None):
+        self.model.fit(X, y)
+        self.feature_names_out = self.model.all_columns_
+        return self
+
+    def transform(self, X):
+        index = X.index
+        transformed_X = self.model.transform(X)
+        # AutoFeat one-hot encodes the categories of the batch: those absent from it are zero
+        transformed_df = pd.DataFrame(transformed_X).reindex(columns=self.feature_names_out, fill_value=0)
+        transformed_df.index = index
+        return transformed_df
+
+    def get_feature_names_out(self, X=None):
+        return self.feature_names_out
+
+# Custom ColumnTransformer that returns a DataFrame instead of a numpy array
+class DataFrameColumnTransformer(ColumnTransformer):
+    def __init__(self, transformers, remainder='passthrough'):
+        super().__init__(transformers, remainder=remainder)
+
+    def transform(self, X):
+        X_transformed = super().transform(X)
+        feature_names_out = self.get_feature_names_out()
+        return pd.DataFrame(X_transformed, columns=feature_names_out)
+
+    def fit_transform(self, X, y=None):
+        X_transformed = super().fit_transform(X, y)
+        feature_names_out = self.get_feature_names_out()
+        return pd.DataFrame(X_transformed, columns=feature_names_out)
+
+# Custom transformer to remove duplicate columns
+class DuplicatesRemover(BaseEstimator, TransformerMixin):
+    def fit(self, X, y=None):
+        X_df = pd.DataFrame(X).copy()
+        self.original_columns_ = X_df.columns.tolist()
+        X_df = X_df.T.drop_duplicates().T
+        self.columns_to_keep_ = X_df.columns.tolist()
+        self.dropped_columns_ = [col for col in self.original_columns_ if col not in self.columns_to_keep_]
+        return self
+
+    def transform(self, X):
+        X_df = pd.DataFrame(X, columns=self.original_columns_)
+        return X_df[self.columns_to_keep_]
+
+    def get_feature_names_out(self, input_features=None):
+        return self.columns_to_keep_
+
+# Custom implementation of SequentialFeatureSelector to handle batch processing and customized output
+class CustomSequentialFeatureSelector(SequentialFeatureSelector):
+
+    def __init__(
+            self,
+            estimator,
+            k_features,
+            forward=True,
+            floating=False,
+            scoring=None,
+            cv=0,
+            n_jobs=1,
+            pre_dispatch='2*n_jobs',
+            clone_estimator=True,
+            verbose=0,
+            batch=None
+            ):
+        self.batch = batch
+        super().__init__(
+            estimator=estimator,
+            k_features=k_features,
+            forward=forward,
+            floating=floating,
+            scoring=scoring,
+            cv=cv,
+            n_jobs=n_jobs,
+            pre_dispatch=pre_dispatch,
+            clone_estimator=clone_estimator,
+            verbose=verbose
+            )
+
+    def fit_transform(self, X, y=None, **fit_params):
+        """
+        Fit the model with optional batch processing and transform the data.
+        """
+        X_full = X.copy()
+        if self.batch is not None:
+            print('Using batch: ', self.batch)
+            X = X[:self.batch]
+            y = y[:self.batch]
+        self.fit(X, y, **fit_params)
+        self.selected_features_ = list(self.k_feature_names_)
+        selected_data = self.transform(X_full)
+        return pd.DataFrame(selected_data, columns=self.get_feature_names_out(X_full.columns))
+
+    def get_feature_names_out(self, input_features=None):
+        """
+        Return the names of the selected features.
+        """
+        return self.selected_features_
+
+    def set_output(self, transform=None):
+        """
+        Placeholder method to comply with scikit-learn's API.
+        """
+        pass
+
+def build_pipeline(cat_columns: list = CAT_COLUMNS, k_features: int = 10, sfs_batch: int = 5000,
+                   regressor_params: dict = None, n_jobs: int = 1, memory=None) -> Pipeline:
+    """
+    Builds the unfitted feature engineering and regression pipeline of `model_pipeline.ipynb`.
+
+    Args:
+        cat_columns (list): Categorical columns passed through the preprocessor.
+        k_features (int): Number of features kept by each sequential feature selector.
+        sfs_batch (int): Number of rows used to fit the backward feature selector.
+        regressor_params (dict): CatBoostRegressor parameters overriding the tuned ones.
+        n_jobs (int): Number of parallel jobs of each sequential feature selector (-1 for all
+            cores); with more than one job, the forward and backward selectors also run concurrently.
+        memory: joblib.Memory or cache directory of the fitted stages, None to disable caching.
+
+    Returns:
+        Pipeline: Unfitted pipeline.
+    """
+    # Define columns for AutoFeat transformations
+    autofeat_cat_columns = ['bin5__' + x for x in KBINS_COLUMNS] + ['remainder__' + x for x in cat_columns]
+    autofeat_feateng_columns = (
+        ['power__' + x for x in NUM_AREA_COLUMNS]
+        + ['add__scale__distance']
+        + ['scale__' + x for x in KBINS_COLUMNS]
+    )
+    autofeat_columns = autofeat_cat_columns + autofeat_feateng_columns
+
+    # Define columns for polynomial feature transformations
+    polyfeat_columns = autofeat_feateng_columns
+
+    # Define a pipeline for power transformation and scaling
+    power_scale_transformer = Pipeline([
+        ('pwr', PowerTransformer(method='box-cox')),
+        ('scale', StandardScaler())
+    ])
+
+    # Define a preprocessor to apply transformations to specified columns
+    preprocessor = ColumnTransformer(
+        transformers=[
+            ('power', power_scale_transformer, NUM_AREA_COLUMNS),
+            ('bin5', KBinsDiscretizer(n_bins=5, encode='ordinal', strategy='kmeans', subsample=None,
+                                      random_state=RANDOM_STATE), KBINS_COLUMNS),
+            ('add', FeatureAdder(), NUM_GEO_COLUMNS),
+            ('scale', StandardScaler(), KBINS_COLUMNS)
+        ],
+        remainder='passthrough'
+    )
+    preprocessor.set_output(transform='pandas')
+
+    # Define a feature generator to apply AutoFeat and polynomial feature transformations
+    feature_generator = ColumnTransformer(
+        transformers=[
+            ('auto_feat', AutoFeatWrapper(
+                AutoFeatRegressor(
+                    categorical_cols=autofeat_cat_columns,
+                    feateng_cols=autofeat_feateng_columns,
+                    verbose=0,
+                    feateng_steps=1,
+                    n_jobs=-1
+                )
+            ), autofeat_columns),
+            ('poly_features', PolynomialFeatures(
+                degree=2, interaction_only=False,
+                include_bias=False
+            ), polyfeat_columns)
+        ],
+        remainder='passthrough'
+    )
+    feature_generator.set_output(transform='pandas')
+
+    # Define forward and backward feature selectors using the custom sequential feature selector
+    scorer = make_scorer(root_mean_squared_error, greater_is_better=False)
+    sfs_forward = CustomSequentialFeatureSelector(
+        estimator=Ridge(),
+        k_features=k_features,
+        forward=True,
+        scoring=scorer,
+        verbose=0,
+        cv=3,
+        n_jobs=n_jobs
+    )
+    sfs_backward = CustomSequentialFeatureSelector(
+        estimator=Ridge(),
+        k_features=k_features,
+        forward=False,
+        scoring=scorer,
+        verbose=0,
+        cv=0,
+        n_jobs=n_jobs,
+        batch=sfs_batch
+    )
+
+    # Combine the forward and backward feature selectors into a feature union
+    feature_union = FeatureUnion([
+        ('sfs_forward', sfs_forward),
+        ('sfs_backward', sfs_backward)
+    ], n_jobs=None if n_jobs == 1 else 2)
+    feature_union.set_output(transform='pandas')
+    feature_union.set_params(verbose_feature_names_out=True)
+
+    params = dict(
+        iterations=784,
+        learning_rate=0.0933769458215897,
+        depth=9,
+        l2_leaf_reg=6.25803192908997,
+        loss_function='RMSE',
+        verbose=0,
+        random_state=RANDOM_STATE
+    )
+    params.update(regressor_params or {})
+
+    # Define the machine learning pipeline; with a memory, each fitted stage of the processor
+    # and the processor as a whole are cached
+    return Pipeline([
+        (
+            'processor', Pipeline([
+                ('preprocessor', preprocessor),
+                ('feature_generator', feature_generator),
+                ('drop_duplicates_1', DuplicatesRemover()),
+                ('feature_union', feature_union),
+                ('drop_duplicates_2', DuplicatesRemover()),
+            ], memory=memory)
+        ),
+        ('regressor', CatBoostRegressor(**params))
+    ], memory=memory)
+
+def synthetic_flats(n_rows: int, random_state: int = RANDOM_STATE) -> tuple:
+    """
+    Generates a synthetic flats dataset with plausible value ranges and prices.
+
+    Args:
+        n_rows (int): Number of rows to generate.
+        random_state (int): Seed of the random generator.
+
+    Returns:
+        tuple: Features DataFrame with REQUIRED_PARAMS columns and the price Series.
+    """
+    rng = np.random.default_rng(random_state)
+    floors_total = rng.integers(2, 40, n_rows)
+    total_area = rng.uniform(20, 200, n_rows)
+    living_area = total_area * rng.uniform(0.4, 0.7, n_rows)
+    kitchen_area = total_area * rng.uniform(0.1, 0.25, n_rows)
+    X = pd.DataFrame({
+        'floor': rng.integers(1, floors_total + 1),
+        'is_apartment': rng.binomial(1, 0.05, n_rows),
+        'kitchen_area': kitchen_area,
+        'living_area': living_area,
+        'rooms': np.clip((total_area // 30).astype(int), 1, 6),
+        'total_area': total_area,
+        'building_id': rng.integers(1, 25000, n_rows),
+        'build_year': rng.integers(1900, 2024, n_rows),
+        'building_type_int': rng.integers(0, 7, n_rows),
+        'latitude': rng.uniform(55.55, 55.95, n_rows),
+        'longitude': rng.uniform(37.35, 37.85, n_rows),
+        'ceiling_height': rng.choice([2.5, 2.64, 2.7, 2.8, 3.0, 3.2], n_rows),
+        'flats_count': rng.integers(10, 1000, n_rows),
+        'floors_total': floors_total,
+        'has_elevator': rng.binomial(1, 0.8, n_rows)
+    }, columns=REQUIRED_PARAMS)
+    distance = np.hypot((X['latitude'] - MOSCOW_CENTER[0]) * 111, (X['longitude'] - MOSCOW_CENTER[1]) * 63)
+    price_per_meter = 4e5 * np.exp(-distance / 15) + 1e5 + 500 * (X['build_year'] - 1900)
+    y = pd.Series(total_area * price_per_meter * rng.lognormal(0, 0.1, n_rows), name='price')
+    return X, y